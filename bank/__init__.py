@@ -1,6 +1,12 @@
 from bank.account import Account
 from bank.employee import Employee
-from bank.service import Service
+from bank.service import Service, ServiceStatus
 from bank.customer import Customer
 from bank.storage import Storage
 from bank.storage import FileUtils
+from bank.storage import BinaryFileUtils
+from bank.storage import JournalFileUtils
+from bank.storage import IndexedFileUtils
+from bank.storage import ShardedFileUtils
+from bank.storage import SqliteUtils
+from bank.storage import ConcurrentModificationError
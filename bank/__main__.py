@@ -1,14 +1,61 @@
 import argparse
-from bank import Storage, FileUtils
+import logging
+import random
+import sys
+import time
+from bank import Storage, FileUtils, BinaryFileUtils, JournalFileUtils, IndexedFileUtils
+from bank import ShardedFileUtils
+from bank import SqliteUtils
+from bank import ConcurrentModificationError
 from bank.main import list_employees, add_employee, remove_employee
 from bank.main import list_applicaitons, approve_application, remove_application
-from bank.main import list_customers, add_customer, remove_customer
+from bank.main import list_customers, find_customers, add_customer, remove_customer
 from bank.main import list_accounts, add_account, remove_account, deposit, withdraw, transfer
+from bank.main import statement, parse_since
 from bank.main import list_services, apply_for_service, borrow_from_service, pay_to_service
+from bank.main import report_totals, report_memory, report_codecs
+from bank.money import parse_amount
+from bank.storage.compression import parse_location
+from bank.batch import run_batch
+from bank.bulk import import_customers, export_customers, EXPORT_COLUMNS
+from bank.eod import end_of_day
+from bank.server import serve, send_command
+
+# attempts for a command whose save raced with another process
+RETRIES = 5
+
+BACKENDS = {
+    "json": FileUtils,
+    "binary": BinaryFileUtils,
+    "journal": JournalFileUtils,
+    "indexed": IndexedFileUtils,
+    "sharded": ShardedFileUtils,
+    "sqlite": SqliteUtils
+}
+
+
+def reference(value):
+    """ argparse type of customer, account, service and employee arguments, a position or @<id> """
+    if value.startswith("@"):
+        int(value[1:])
+        return value
+    return int(value)
+
+
+def since(value):
+    """ argparse type of the start of a statement, a sequence number or an ISO date and time """
+    parse_since(value)
+    return value
+
 
 parser = argparse.ArgumentParser()
 parser.description = "simulate a bank, demonstrate OOP design practices"
-parser.add_argument("-f", "--file", default="bank.json", required=False)
+parser.add_argument("-f", "--file", type=parse_location, default="bank.json", required=False,
+                    help="path[:compression[:level]], compression is one of gzip, bz2, lzma "
+                         "or none and defaults to the one implied by the extension")
+parser.add_argument("-b", "--backend", choices=BACKENDS.keys(), default="json", required=False)
+parser.add_argument("-c", "--connect", metavar="ADDRESS", required=False,
+                    help="forward the command to a server started with bank serve")
 command_subparsers = parser.add_subparsers()
 command_subparsers.required = True
 
@@ -29,7 +76,7 @@ employee_add.set_defaults(func=add_employee)
 
 # bank employee remove <index>
 employee_remove = employee_subparser.add_parser('remove')
-employee_remove.add_argument("employee_index", type=int)
+employee_remove.add_argument("employee_index", type=reference)
 employee_remove.set_defaults(func=remove_employee)
 
 # EMPLOYEE APPLICATION SUB COMMAND
@@ -43,14 +90,14 @@ employee_service_list.set_defaults(func=list_applicaitons)
 
 # bank employee service approve <customer_index> <service_index>
 employee_service_approve = employee_application_subparser.add_parser('approve')
-employee_service_approve.add_argument('customer_index', type=int)
-employee_service_approve.add_argument('service_index', type=int)
+employee_service_approve.add_argument('customer_index', type=reference)
+employee_service_approve.add_argument('service_index', type=reference)
 employee_service_approve.set_defaults(func=approve_application)
 
 # bank employee service deny <customer_index> <service_index>
 employee_service_deny = employee_application_subparser.add_parser('deny')
-employee_service_deny.add_argument('customer_index', type=int)
-employee_service_deny.add_argument('service_index', type=int)
+employee_service_deny.add_argument('customer_index', type=reference)
+employee_service_deny.add_argument('service_index', type=reference)
 employee_service_deny.set_defaults(func=remove_application)
 
 # CUSTOMER SUB COMMAND
@@ -62,6 +109,11 @@ customer_subparser.required = True
 customer_add = customer_subparser.add_parser("list")
 customer_add.set_defaults(func=list_customers)
 
+# bank customer find <query>
+customer_find = customer_subparser.add_parser("find")
+customer_find.add_argument("query", type=str)
+customer_find.set_defaults(func=find_customers)
+
 # bank customer add <first_name> <last_name> <address>
 customer_add = customer_subparser.add_parser('add')
 customer_add.add_argument("first_name", type=str)
@@ -71,7 +123,7 @@ customer_add.set_defaults(func=add_customer)
 
 # bank customer remove <index>
 customer_remove = customer_subparser.add_parser('remove')
-customer_remove.add_argument("customer_index", type=int)
+customer_remove.add_argument("customer_index", type=reference)
 customer_remove.set_defaults(func=remove_customer)
 
 # CUSTOMER ACCOUNT SUB COMMAND
@@ -81,43 +133,51 @@ customer_account_subparser.required = True
 
 # bank customer account list <customer_index>
 customer_account_list = customer_account_subparser.add_parser('list')
-customer_account_list.add_argument("customer_index", type=int)
+customer_account_list.add_argument("customer_index", type=reference)
 customer_account_list.set_defaults(func=list_accounts)
 
 # bank customer account add <customer_index>
 customer_account_add = customer_account_subparser.add_parser('add')
-customer_account_add.add_argument("customer_index", type=int)
+customer_account_add.add_argument("customer_index", type=reference)
 customer_account_add.add_argument("type", type=str)
 customer_account_add.set_defaults(func=add_account)
 
 # bank customer account remove <customer_index> <account_index>
 customer_remove = customer_account_subparser.add_parser('remove')
-customer_remove.add_argument("customer_index", type=int)
-customer_remove.add_argument("account_index", type=int)
+customer_remove.add_argument("customer_index", type=reference)
+customer_remove.add_argument("account_index", type=reference)
 customer_remove.set_defaults(func=remove_account)
 
 # bank customer account deposit <customer_index> <account_index> <amount>
 customer_account_deposit = customer_account_subparser.add_parser('deposit')
-customer_account_deposit.add_argument("customer_index", type=int)
-customer_account_deposit.add_argument("account_index", type=int)
-customer_account_deposit.add_argument("amount", type=float)
+customer_account_deposit.add_argument("customer_index", type=reference)
+customer_account_deposit.add_argument("account_index", type=reference)
+customer_account_deposit.add_argument("amount", type=parse_amount)
 customer_account_deposit.set_defaults(func=deposit)
 
 # bank customer account withdraw <customer_index> <account_index> <amount>
 customer_account_withdraw = customer_account_subparser.add_parser('withdraw')
-customer_account_withdraw.add_argument("customer_index", type=int)
-customer_account_withdraw.add_argument("account_index", type=int)
-customer_account_withdraw.add_argument("amount", type=float)
+customer_account_withdraw.add_argument("customer_index", type=reference)
+customer_account_withdraw.add_argument("account_index", type=reference)
+customer_account_withdraw.add_argument("amount", type=parse_amount)
 customer_account_withdraw.set_defaults(func=withdraw)
 
 # bank customer account transfer <customer_index> <source_account_index> <destination_account_index> <amount>
 customer_account_transfer = customer_account_subparser.add_parser('transfer')
-customer_account_transfer.add_argument("customer_index", type=int)
-customer_account_transfer.add_argument("source_account_index", type=int)
-customer_account_transfer.add_argument("destination_account_index", type=int)
-customer_account_transfer.add_argument("amount", type=float)
+customer_account_transfer.add_argument("customer_index", type=reference)
+customer_account_transfer.add_argument("source_account_index", type=reference)
+customer_account_transfer.add_argument("destination_account_index", type=reference)
+customer_account_transfer.add_argument("amount", type=parse_amount)
 customer_account_transfer.set_defaults(func=transfer)
 
+# bank customer account statement <customer_index> <account_index> [--since <seq|date>] [--limit <count>]
+customer_account_statement = customer_account_subparser.add_parser('statement')
+customer_account_statement.add_argument("customer_index", type=reference)
+customer_account_statement.add_argument("account_index", type=reference)
+customer_account_statement.add_argument("--since", type=since, default=None)
+customer_account_statement.add_argument("--limit", type=int, default=50)
+customer_account_statement.set_defaults(func=statement)
+
 # # CUSTOMER SERVICE SUB COMMAND
 customer_service_parser = customer_subparser.add_parser('service')
 customer_service_subparser = customer_service_parser.add_subparsers()
@@ -125,31 +185,122 @@ customer_service_subparser.required = True
 
 # bank customer service list <customer_index>
 customer_service_list = customer_service_subparser.add_parser('list')
-customer_service_list.add_argument("customer_index", type=int)
+customer_service_list.add_argument("customer_index", type=reference)
 customer_service_list.set_defaults(func=list_services)
 
 # bank customer service apply <customer_index> <limit>
 customer_service_apply = customer_service_subparser.add_parser('apply')
-customer_service_apply.add_argument("customer_index", type=int)
-customer_service_apply.add_argument("limit", type=float)
+customer_service_apply.add_argument("customer_index", type=reference)
+customer_service_apply.add_argument("limit", type=parse_amount)
 customer_service_apply.set_defaults(func=apply_for_service)
 
 # bank customer service borrow <customer_index> <service_index> <account_index> <amount>
 customer_service_borrow = customer_service_subparser.add_parser('borrow')
-customer_service_borrow.add_argument("customer_index", type=int)
-customer_service_borrow.add_argument("service_index", type=int)
-customer_service_borrow.add_argument("account_index", type=int)
-customer_service_borrow.add_argument("amount", type=float)
+customer_service_borrow.add_argument("customer_index", type=reference)
+customer_service_borrow.add_argument("service_index", type=reference)
+customer_service_borrow.add_argument("account_index", type=reference)
+customer_service_borrow.add_argument("amount", type=parse_amount)
 customer_service_borrow.set_defaults(func=borrow_from_service)
 
 # bank customer service pay <customer_index> <service_index> <account_index> <amount>
 customer_service_pay = customer_service_subparser.add_parser('pay')
-customer_service_pay.add_argument("customer_index", type=int)
-customer_service_pay.add_argument("service_index", type=int)
-customer_service_pay.add_argument("account_index", type=int)
-customer_service_pay.add_argument("amount", type=float)
+customer_service_pay.add_argument("customer_index", type=reference)
+customer_service_pay.add_argument("service_index", type=reference)
+customer_service_pay.add_argument("account_index", type=reference)
+customer_service_pay.add_argument("amount", type=parse_amount)
 customer_service_pay.set_defaults(func=pay_to_service)
 
+# REPORT SUB COMMAND
+report_parser = command_subparsers.add_parser('report')
+report_subparser = report_parser.add_subparsers()
+report_subparser.required = True
+
+# bank report totals
+report_totals_parser = report_subparser.add_parser('totals')
+report_totals_parser.set_defaults(func=report_totals)
+
+# bank report memory
+report_memory_parser = report_subparser.add_parser('memory')
+report_memory_parser.set_defaults(func=report_memory)
+
+# bank report codecs
+report_codecs_parser = report_subparser.add_parser('codecs')
+report_codecs_parser.set_defaults(func=report_codecs)
+
+# BATCH SUB COMMAND
+# bank batch <file|-> [--save-every <count>] [--save-interval <seconds>]
+batch_parser = command_subparsers.add_parser('batch')
+batch_parser.add_argument("source", type=str)
+batch_parser.add_argument("--save-every", type=int, default=0)
+batch_parser.add_argument("--save-interval", type=float, default=0)
+batch_parser.set_defaults(func=run_batch, parser=parser)
+
+# IMPORT SUB COMMAND
+# bank import <file|-> [--format <csv|jsonl>]
+import_parser = command_subparsers.add_parser('import')
+import_parser.add_argument("source", type=str)
+import_parser.add_argument("--format", choices=("csv", "jsonl"), default=None)
+import_parser.set_defaults(func=import_customers)
+
+# EXPORT SUB COMMAND
+# bank export [<file|->] [--format <csv|jsonl>] [--records <customers|accounts|services>]
+#             [--columns <column,...>] [--min-balance <amount>] [--max-balance <amount>] [--status <status>]
+export_parser = command_subparsers.add_parser('export')
+export_parser.add_argument("output", type=str, nargs="?", default="-")
+export_parser.add_argument("--format", choices=("csv", "jsonl"), default=None)
+export_parser.add_argument("--records", choices=EXPORT_COLUMNS.keys(), default="customers")
+export_parser.add_argument("--columns", type=str, default=None)
+export_parser.add_argument("--min-balance", type=parse_amount, default=None)
+export_parser.add_argument("--max-balance", type=parse_amount, default=None)
+export_parser.add_argument("--status", type=str, default=None)
+export_parser.set_defaults(func=export_customers)
+
+# EOD SUB COMMAND
+# bank eod [--rules <file> [--keep-rules]] [--workers <count>]
+eod_parser = command_subparsers.add_parser('eod')
+eod_parser.add_argument("--rules", type=str, default=None)
+eod_parser.add_argument("--keep-rules", action="store_true")
+eod_parser.add_argument("--workers", type=int, default=0)
+eod_parser.set_defaults(func=end_of_day)
+
+# SERVE SUB COMMAND
+# bank serve <socket_path|host:port> [--save-every <count>] [--save-interval <seconds>] [--durable]
+serve_parser = command_subparsers.add_parser('serve')
+serve_parser.add_argument("address", type=str)
+serve_parser.add_argument("--save-every", type=int, default=1000)
+serve_parser.add_argument("--save-interval", type=float, default=1.0)
+serve_parser.add_argument("--durable", action="store_true")
+serve_parser.set_defaults(func=serve)
+
 arguments = parser.parse_args()
-with Storage(FileUtils, arguments.file) as storage:
-    arguments.func(storage, arguments)
+if arguments.connect:
+    if arguments.func in (run_batch, import_customers, export_customers, end_of_day, serve):
+        parser.error("{0} can not be forwarded to a server".format(arguments.func.__name__))
+    response = send_command(arguments.connect, arguments)
+    print(response["output"], end="")
+    for message in response["log"]:
+        print(message, file=sys.stderr)
+    if not response["ok"]:
+        logging.critical("Command failed, %s", response["error"])
+        sys.exit(1)
+else:
+    path, compression, level = arguments.file
+    options = {}
+    if compression is not None:
+        if not getattr(BACKENDS[arguments.backend], "compressible", False):
+            parser.error("the {0} backend does not compress".format(arguments.backend))
+        options = {"compression": compression, "level": level}
+    # batches save part way through and imports consume their input, so only single
+    # commands can be safely repeated
+    attempts = 1 if arguments.func in (run_batch, import_customers, serve) else RETRIES
+    for attempt in range(1, attempts + 1):
+        try:
+            with Storage(BACKENDS[arguments.backend], path, **options) as storage:
+                arguments.func(storage, arguments)
+            break
+        except ConcurrentModificationError as err:
+            if attempt == attempts:
+                logging.critical("Giving up after %s attempts: %s", attempts, err)
+                sys.exit(1)
+            logging.warning("%s, retrying", err)
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
@@ -1,12 +1,31 @@
+import sys
+import time
+
+from bank.money import cents
+
+
 class Account:
     """
     class representing an account.
+    Balances and amounts are integer cents.
+    Balance changes are reported to the owner (a Customer or Service) if it has one, and
+    kept as transactions until Storage takes them for the ledger.
+    id is assigned by Storage when the owning customer is saved.
     """
+    # _pending is None while the account is unchanged since it was saved, otherwise the list
+    # of transactions not taken yet, so a loaded account needs no list nor a dirty flag
+    __slots__ = ("id", "_type", "_balance", "_owner", "_pending")
+
     def __init__(self, type_str, balance):
+        balance = cents(balance)
         if type_str != 'service' and balance < 0:
             raise ValueError("Only service accounts can have negative balance")
-        self._type = type_str
+        self.id = None
+        # a handful of distinct types are shared by every account
+        self._type = sys.intern(type_str)
         self._balance = balance
+        self._owner = None
+        self._pending = []
 
     @property
     def type(self):
@@ -24,25 +43,60 @@ class Account:
         """
         return self._balance
 
-    def deposit(self, amount):
-        """ deposit to account balance """
-        self._balance += amount
+    @property
+    def dirty(self):
+        """ True if the account has changed since it was last saved """
+        return self._pending is not None
+
+    def mark_clean(self):
+        """ mark the account as saved, transactions which were not taken are dropped """
+        self._pending = None
 
-    def withdrawl(self, amount):
+    def deposit(self, amount, kind="deposit"):
+        """ deposit to account balance, kind describes the transaction """
+        amount = cents(amount)
+        self._change_balance(amount, kind)
+
+    def withdrawl(self, amount, kind="withdrawal"):
         """ withdraw from account balance. Raises ValueError if withdrawl amount exceeds funds. """
+        amount = cents(amount)
         if amount > self._balance and self._type != "service":
             raise ValueError("Insufficient Funds")
-        self._balance -= amount
+        self._change_balance(-amount, kind)
+
+    def _change_balance(self, delta, kind):
+        self._balance += delta
+        if self._pending is None:
+            self._pending = []
+        self._pending.append((time.time(), kind, delta, self._balance))
+        if self._owner is not None:
+            self._owner._balance_changed(delta)
+
+    def take_transactions(self):
+        """
+        Returns the transactions since the last call as (time, kind, amount, balance) tuples,
+        amount being the change of the balance and balance the one after the transaction
+        """
+        if not self._pending:
+            return []
+        transactions, self._pending = self._pending, []
+        return transactions
 
     def to_dict(self):
         """ Serializes class instance to dictionary """
-        return {
+        data = {
             "type": self._type,
             "balance": self._balance
         }
+        if self.id is not None:
+            data["id"] = self.id
+        return data
 
     @classmethod
     def from_dict(cls, source):
         """ Creates class instance from dict """
-        return cls(source["type"], source["balance"])
+        account = cls(source["type"], source["balance"])
+        account.id = source.get("id")
+        account.mark_clean()
+        return account
     
\ No newline at end of file
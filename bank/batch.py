@@ -0,0 +1,102 @@
+import contextlib
+import json
+import logging
+import os
+import select
+import shlex
+import sys
+import time
+
+from bank.commands import COMMANDS, COMMAND_ERRORS, command_from_dict, describe_error
+
+
+def _parse_line(parser, line):
+    """Returns (function, args) for a command line or a JSON object"""
+    if line.startswith("{"):
+        return command_from_dict(json.loads(line))
+    args = parser.parse_args(shlex.split(line))
+    # batch, serve, import, export and eod manage storage themselves
+    if args.func not in COMMANDS.values():
+        raise ValueError("{0} can not be run in a batch".format(args.func.__name__))
+    return args.func, args
+
+
+def _read_lines(source, timeout):
+    """
+    Yields the lines of source, and None whenever timeout() seconds pass while waiting for
+    one, so work can be done while the writer of a pipe is idle. timeout returns None to
+    wait for as long as it takes.
+    """
+    fd = source.fileno()
+    buffered = b""
+    while True:
+        wait = timeout()
+        if wait is not None and not select.select([fd], [], [], max(wait, 0.))[0]:
+            yield None
+            continue
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            break
+        lines = (buffered + chunk).split(b"\n")
+        buffered = lines.pop()
+        for line in lines:
+            yield line.decode()
+    if buffered:
+        yield buffered.decode()
+
+
+def run_batch(storage, args):
+    """
+    apply every command in args.source (a file, or - for stdin) against one loaded storage.
+    Lines use the command line grammar, e.g. customer account deposit 0 0 10, or are JSON
+    objects naming a bank/main.py function, e.g. {"command": "deposit", "customer_index": 0, ...}.
+    Failing lines are reported and skipped, storage is saved every args.save_every operations,
+    once args.save_interval seconds passed since the first unsaved operation, also while
+    waiting for the next line, and at the end.
+    """
+    # stdin is left open for the caller
+    if args.source == "-":
+        source = contextlib.nullcontext(sys.stdin)
+    else:
+        source = open(args.source, "rb")
+    save_interval = getattr(args, "save_interval", 0)
+    applied = failed = unsaved = 0
+    first_unsaved = None
+
+    def timeout():
+        if not save_interval or first_unsaved is None:
+            return None
+        return first_unsaved + save_interval - time.monotonic()
+
+    line_number = 0
+    with source as source:
+        for line in _read_lines(source, timeout):
+            if line is None:
+                # the interval passed while waiting for input
+                storage.save()
+                unsaved = 0
+                first_unsaved = None
+                continue
+            line_number += 1
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                func, command_args = _parse_line(args.parser, line)
+                func(storage, command_args)
+            except COMMAND_ERRORS as err:
+                logging.error("line %s: %s failed, %s", line_number, line, describe_error(err))
+                failed += 1
+                continue
+
+            applied += 1
+            unsaved += 1
+            if first_unsaved is None:
+                first_unsaved = time.monotonic()
+            if ((args.save_every and unsaved >= args.save_every)
+                    or (save_interval and time.monotonic() - first_unsaved >= save_interval)):
+                storage.save()
+                unsaved = 0
+                first_unsaved = None
+
+    print("Applied {0} operations, {1} failed".format(applied, failed))
@@ -0,0 +1,219 @@
+import csv
+import json
+import logging
+import sys
+import time
+
+from bank import Account, Customer, Service, ServiceStatus
+from bank.commands import describe_error
+from bank.money import format_amount, parse_amount
+
+# bytes read from or written to files at a time
+BUFFER_SIZE = 1 << 20
+
+# errors rejecting a single row of an import
+ROW_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+
+
+def file_format(path, file_format=None):
+    """Returns file_format, or the format implied by the extension of path: csv or jsonl"""
+    if file_format is not None:
+        return file_format
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def _read_rows(source, row_format):
+    """Yields (line number, row) of source, rows of JSON lines are still to be decoded"""
+    if row_format == "csv":
+        # csv.DictReader does the same, at a multiple of the cost per row
+        reader = csv.reader(source)
+        columns = next(reader, [])
+        for row in reader:
+            if row:
+                yield reader.line_num, dict(zip(columns, row))
+    else:
+        for line_number, line in enumerate(source, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line_number, line
+
+
+def _text(row, key):
+    value = row.get(key)
+    if not isinstance(value, str) or not value:
+        raise ValueError("{0} is missing".format(key))
+    return value
+
+
+def _amount(row, key):
+    value = row.get(key)
+    return 0 if value is None or value == "" else parse_amount(value)
+
+
+def _customers(rows, counts):
+    """
+    Yields customers built from rows, each customer row followed by the account and service rows
+    of that customer. Invalid rows are reported and counted as rejected, so are the account and
+    service rows following a rejected customer.
+    """
+    pending = None  # first name, last name, address, accounts and services of the current customer
+    for line_number, row in rows:
+        finished = None
+        counts["rows"] += 1
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+            record = row.get("record")
+            if record == "customer":
+                finished, pending = pending, None
+                pending = (_text(row, "first_name"), _text(row, "last_name"),
+                           _text(row, "address"), [], [])
+            elif record in ("account", "service"):
+                if pending is None:
+                    raise ValueError("{0} without a customer".format(record))
+                if record == "account":
+                    pending[3].append(Account(_text(row, "type"), _amount(row, "balance")))
+                else:
+                    # statuses are taken as Service takes them, unknown ones are kept as given
+                    status = row.get("status") or ServiceStatus.APPLICATION
+                    pending[4].append(Service(parse_amount(row["limit"]),
+                                              Account("service", _amount(row, "balance")), status))
+                counts[record + "s"] += 1
+            else:
+                raise ValueError("unknown record {0!r}".format(record))
+        except ROW_ERRORS as err:
+            logging.error("line %s: rejected, %s", line_number, describe_error(err))
+            counts["rejected"] += 1
+        if finished is not None:
+            yield Customer(*finished)
+    if pending is not None:
+        yield Customer(*pending)
+
+
+def import_customers(storage, args):
+    """
+    import customers with their accounts, services and opening balances from args.source
+    (a file, or - for stdin) in one pass, appending them to storage and saving once.
+    Files are CSV with a header row or JSON lines, both with the columns record (customer,
+    account or service), first_name, last_name, address, type, balance, limit and status.
+    Invalid rows are reported and skipped.
+    """
+    row_format = file_format(args.source, args.format)
+    if args.source == "-":
+        source = sys.stdin
+    else:
+        source = open(args.source, "r", newline="", buffering=BUFFER_SIZE)
+
+    counts = {"rows": 0, "rejected": 0, "accounts": 0, "services": 0}
+    start = time.perf_counter()
+    with source:
+        imported = storage.add_customers(_customers(_read_rows(source, row_format), counts))
+    storage.save()
+    elapsed = time.perf_counter() - start
+
+    print("Imported {0} customers, {1} accounts and {2} services from {3} rows, {4} rejected".format(
+        imported, counts["accounts"], counts["services"], counts["rows"], counts["rejected"]))
+    print("{0:.2f}s, {1:.0f} rows/s".format(elapsed, counts["rows"] / elapsed if elapsed else 0.))
+
+
+# columns of each kind of exported record, amounts are in dollars
+AMOUNT_COLUMNS = ("total_balance", "total_limit", "balance", "limit")
+EXPORT_COLUMNS = {
+    "customers": ("index", "id", "first_name", "last_name", "address", "accounts", "services",
+                  "total_balance", "total_limit"),
+    "accounts": ("customer_index", "customer_id", "index", "id", "type", "balance"),
+    "services": ("customer_index", "customer_id", "index", "id", "status", "limit", "balance"),
+}
+
+
+def _customer_records(storage):
+    """
+    Yields (index, record) of every customer. Records are read as stored unless the customer was
+    built, so exporting does not build (and keep) every customer.
+    """
+    customers = storage.customers
+    for index in range(len(customers)):
+        customer = customers.loaded(index)
+        yield index, customer.to_dict() if customer is not None else customers.record(index)
+
+
+def _export_rows(storage, records, status=None):
+    """Yields a dict per customer, account or service (depending on records) of storage"""
+    for index, customer in _customer_records(storage):
+        services = customer["services"]
+        if status is not None:
+            services = [service for service in services if service["status"] == status]
+            if not services:
+                continue
+        if records == "customers":
+            yield {"index": index, "id": customer.get("id"), "first_name": customer["f_name"],
+                   "last_name": customer["l_name"], "address": customer["address"],
+                   "accounts": len(customer["accounts"]), "services": len(customer["services"]),
+                   "total_balance": (sum(account["balance"] for account in customer["accounts"])
+                                     + sum(service["account"]["balance"]
+                                           for service in customer["services"])),
+                   "total_limit": sum(service["limit"] for service in customer["services"]
+                                      if service["status"] == ServiceStatus.APPROVED)}
+        elif records == "accounts":
+            for account_index, account in enumerate(customer["accounts"]):
+                yield {"customer_index": index, "customer_id": customer.get("id"),
+                       "index": account_index, "id": account.get("id"),
+                       "type": account["type"], "balance": account["balance"]}
+        else:
+            for service_index, service in enumerate(customer["services"]):
+                if status is None or service["status"] == status:
+                    yield {"customer_index": index, "customer_id": customer.get("id"),
+                           "index": service_index, "id": service.get("id"),
+                           "status": service["status"], "limit": service["limit"],
+                           "balance": service["account"]["balance"]}
+
+
+def export_customers(storage, args):
+    """
+    export customers (with their totals), accounts or services, as chosen by args.records, to
+    args.output (a file, or - for stdout) as CSV with a header row or as JSON lines.
+    args.columns selects columns, rows are filtered by balance (args.min_balance and
+    args.max_balance, in cents) and by service status (args.status; customers are exported if
+    they have a service of that status).
+    """
+    available = EXPORT_COLUMNS[args.records]
+    columns = args.columns.split(",") if args.columns else list(available)
+    unknown = [column for column in columns if column not in available]
+    if unknown:
+        logging.error("Unknown columns %s, %s has %s", ", ".join(unknown), args.records,
+                      ", ".join(available))
+        sys.exit(1)
+    if args.status is not None and args.records == "accounts":
+        logging.error("Accounts can not be filtered by service status")
+        sys.exit(1)
+
+    row_format = file_format(args.output, args.format)
+    if args.output == "-":
+        # a large buffer rather than sys.stdout, which may flush on every line
+        sys.stdout.flush()
+        output = open(sys.stdout.fileno(), "w", newline="", buffering=BUFFER_SIZE, closefd=False)
+    else:
+        output = open(args.output, "w", newline="", buffering=BUFFER_SIZE)
+
+    count = 0
+    with output:
+        if row_format == "csv":
+            writer = csv.writer(output)
+            writer.writerow(columns)
+        for row in _export_rows(storage, args.records, args.status):
+            balance = row["total_balance" if args.records == "customers" else "balance"]
+            if ((args.min_balance is not None and balance < args.min_balance)
+                    or (args.max_balance is not None and balance > args.max_balance)):
+                continue
+            values = [row[column] for column in columns]
+            values = [format_amount(value) if column in AMOUNT_COLUMNS else value
+                      for column, value in zip(columns, values)]
+            if row_format == "csv":
+                writer.writerow(values)
+            else:
+                output.write(json.dumps(dict(zip(columns, values))))
+                output.write("\n")
+            count += 1
+
+    if args.output != "-":
+        print("Exported {0} {1} to {2}".format(count, args.records, args.output))
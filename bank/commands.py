@@ -0,0 +1,89 @@
+import argparse
+
+from bank.main import list_employees, add_employee, remove_employee
+from bank.main import list_applicaitons, approve_application, remove_application
+from bank.main import list_customers, find_customers, add_customer, remove_customer
+from bank.main import list_accounts, add_account, remove_account, deposit, withdraw, transfer
+from bank.main import statement
+from bank.main import list_services, apply_for_service, borrow_from_service, pay_to_service
+from bank.main import report_totals, report_memory, report_codecs
+from bank.money import parse_amount
+
+COMMANDS = {function.__name__: function for function in (
+    list_employees, add_employee, remove_employee,
+    list_applicaitons, approve_application, remove_application,
+    list_customers, find_customers, add_customer, remove_customer,
+    list_accounts, add_account, remove_account, deposit, withdraw, transfer,
+    statement,
+    list_services, apply_for_service, borrow_from_service, pay_to_service,
+    report_totals, report_memory, report_codecs
+)}
+
+# arguments each command can not do without
+REQUIRED_ARGUMENTS = {
+    "add_employee": ("first_name", "last_name"),
+    "remove_employee": ("employee_index",),
+    "approve_application": ("customer_index", "service_index"),
+    "remove_application": ("customer_index", "service_index"),
+    "find_customers": ("query",),
+    "add_customer": ("first_name", "last_name", "address"),
+    "remove_customer": ("customer_index",),
+    "list_accounts": ("customer_index",),
+    "add_account": ("customer_index", "type"),
+    "remove_account": ("customer_index", "account_index"),
+    "deposit": ("customer_index", "account_index", "amount"),
+    "withdraw": ("customer_index", "account_index", "amount"),
+    "transfer": ("customer_index", "source_account_index", "destination_account_index", "amount"),
+    "statement": ("customer_index", "account_index"),
+    "list_services": ("customer_index",),
+    "apply_for_service": ("customer_index", "limit"),
+    "borrow_from_service": ("customer_index", "service_index", "account_index", "amount"),
+    "pay_to_service": ("customer_index", "service_index", "account_index", "amount"),
+}
+
+# defaults of the arguments which may be left out, as on the command line
+OPTIONAL_ARGUMENTS = {
+    "statement": {"since": None, "limit": 50},
+}
+
+# arguments holding amounts, given in dollars like on the command line
+AMOUNT_ARGUMENTS = {
+    "deposit": ("amount",),
+    "withdraw": ("amount",),
+    "transfer": ("amount",),
+    "apply_for_service": ("limit",),
+    "borrow_from_service": ("amount",),
+    "pay_to_service": ("amount",),
+}
+
+# errors raised by bank/main.py functions for a single bad operation, SystemExit is raised
+# when a customer, account or service can not be found
+COMMAND_ERRORS = (SystemExit, ValueError, RuntimeError, IndexError, KeyError, TypeError)
+
+
+def command_from_dict(source):
+    """
+    Returns (function, args) for a command given as a dictionary such as
+    {"command": "deposit", "customer_index": 0, "account_index": 0, "amount": 10}
+    Amounts are dollars and are converted to cents.
+    Raises KeyError for an unknown command, ValueError if an argument is missing.
+    """
+    params = dict(source)
+    name = params.pop("command", None)
+    if name not in COMMANDS:
+        raise KeyError("Unknown command {0}".format(name))
+    for argument in REQUIRED_ARGUMENTS.get(name, ()):
+        if argument not in params:
+            raise ValueError("Command {0} is missing argument {1}".format(name, argument))
+    for argument, default in OPTIONAL_ARGUMENTS.get(name, {}).items():
+        params.setdefault(argument, default)
+    for argument in AMOUNT_ARGUMENTS.get(name, ()):
+        params[argument] = parse_amount(params[argument])
+    return COMMANDS[name], argparse.Namespace(**params)
+
+
+def describe_error(err):
+    """Returns a short description of an error raised by a command"""
+    if isinstance(err, SystemExit):
+        return "exited with status {0}".format(err.code)
+    return "{0}: {1}".format(type(err).__name__, err)
@@ -1,53 +1,179 @@
-from bank.service import Service
+import itertools
+import os
+
+from bank.service import Service, ServiceStatus
 from bank.account import Account
+from bank.tracking import TrackedList
+
+# set BANK_VERIFY_TOTALS to cross-check the cached totals against a full recalculation
+VERIFY_TOTALS = bool(os.environ.get("BANK_VERIFY_TOTALS"))
 
 
 class Customer:
-    """ Encapsulates customer information, accounts and services """
+    """
+    Encapsulates customer information, accounts and services
+    total_balance and total_limit are kept up to date as accounts and services change.
+    id is assigned by Storage when the customer is added and never changes afterwards.
+    The lists of accounts and services are only allocated once they are used or have items.
+    """
+    __slots__ = ("id", "f_name", "l_name", "address", "_accounts", "_services",
+                 "_total_balance", "_total_limit", "_dirty")
 
     def __init__(self, f_name, l_name, address, accounts=None, services=None):
-        self.f_name = f_name
-        self.l_name = l_name
-        self.address = address
-        self.accounts = accounts if accounts is not None else []
-        self.services = services if services is not None else []
+        # assigned without going through __setattr__, totals are calculated once at the end
+        set_attribute = super().__setattr__
+        set_attribute("id", None)
+        set_attribute("f_name", f_name)
+        set_attribute("l_name", l_name)
+        set_attribute("address", address)
+        set_attribute("_accounts", self._tracked(accounts) if accounts else None)
+        set_attribute("_services", self._tracked(services) if services else None)
+        set_attribute("_dirty", True)
+        self._recalculate_totals()
+
+    def __setattr__(self, name, value):
+        if name in ("accounts", "services"):
+            super().__setattr__("_" + name, self._tracked(value))
+            self._recalculate_totals()
+        else:
+            super().__setattr__(name, value)
+        if not name.startswith("_"):
+            super().__setattr__("_dirty", True)
+
+    @property
+    def accounts(self):
+        """ List of the customer's accounts """
+        if self._accounts is None:
+            super().__setattr__("_accounts", self._tracked(()))
+        return self._accounts
+
+    @property
+    def services(self):
+        """ List of the customer's services """
+        if self._services is None:
+            super().__setattr__("_services", self._tracked(()))
+        return self._services
+
+    def _items(self):
+        """ Accounts and services, without allocating missing lists """
+        return itertools.chain(self._accounts or (), self._services or ())
+
+    def _tracked(self, items):
+        """ Returns items as a TrackedList owned by the customer """
+        items = TrackedList(items, self)
+        for item in items:
+            item._owner = self
+        return items
+
+    def _items_changed(self, items, operation, _, item):
+        """ Keeps totals up to date when accounts or services are added or removed """
+        if operation == "append":
+            item._owner = self
+            sign = 1
+        elif operation == "delete":
+            item._owner = None
+            sign = -1
+        else:
+            for item in items:
+                item._owner = self
+            self._recalculate_totals()
+            return
+
+        self._total_balance += sign * item.balance
+        if items is self._services and item.status == ServiceStatus.APPROVED:
+            self._total_limit += sign * item.limit
+
+    def _balance_changed(self, delta):
+        """ Called by accounts and services when their balance changed """
+        self._total_balance += delta
+
+    def _limit_changed(self, delta):
+        """ Called by services when their approved limit changed """
+        self._total_limit += delta
+
+    def _calculate_totals(self):
+        """ Return (total_balance, total_limit) calculated from all accounts and services """
+        total_balance = sum(item.balance for item in self._items())
+        total_limit = sum(service.limit for service in self._services or ()
+                          if service.status == ServiceStatus.APPROVED)
+        return total_balance, total_limit
+
+    def _recalculate_totals(self):
+        self._total_balance, self._total_limit = self._calculate_totals()
+
+    def verify_totals(self):
+        """ Raises RuntimeError if the cached totals differ from a full recalculation """
+        total_balance, total_limit = self._calculate_totals()
+        if (total_balance, total_limit) != (self._total_balance, self._total_limit):
+            raise RuntimeError("Cached totals {0}, {1} do not match {2}, {3}".format(
+                self._total_balance, self._total_limit, total_balance, total_limit))
+
+    @property
+    def dirty(self):
+        """ True if the customer, its accounts or its services changed since they were last saved """
+        return (self._dirty
+                or any(items.dirty for items in (self._accounts, self._services)
+                       if items is not None)
+                or any(item.dirty for item in self._items()))
+
+    def mark_clean(self):
+        """ Mark the customer, its accounts and its services as saved """
+        self._dirty = False
+        for items in (self._accounts, self._services):
+            if items is not None:
+                items.mark_clean()
+        for item in self._items():
+            item.mark_clean()
+
+    def take_transactions(self):
+        """
+        Returns {id: transactions} of the accounts and services which had transactions since
+        the last call, see Account.take_transactions. They must have ids.
+        """
+        transactions = {}
+        for item in self._items():
+            taken = item.take_transactions()
+            if taken:
+                transactions[item.id] = taken
+        return transactions
 
     @property
     def total_balance(self):
         """ Return total worth of all accounts and services """
-        if len(self.accounts) > 0 or len(self.services) > 0:
-            accounts_total = sum([acct.balance for acct in self.accounts])
-            services_total = sum(
-                [service.balance for service in self.services])
-            return accounts_total + services_total
-        else:
-            return 0
+        if VERIFY_TOTALS:
+            self.verify_totals()
+        return self._total_balance
 
     @property
     def total_limit(self):
         """ Return total limit of all approved services """
-        if len(self.services) > 0:
-            return sum([service.limit for service in self.services if service.status == "approved"])
-        else:
-            return 0
+        if VERIFY_TOTALS:
+            self.verify_totals()
+        return self._total_limit
 
     def to_dict(self):
         """ Serialize class instance to dictionary """
-        return {
+        data = {
             "f_name": self.f_name,
             "l_name": self.l_name,
             "address": self.address,
-            "accounts": [account.to_dict() for account in self.accounts],
-            "services": [service.to_dict() for service in self.services]
+            "accounts": [account.to_dict() for account in self._accounts or ()],
+            "services": [service.to_dict() for service in self._services or ()]
         }
+        if self.id is not None:
+            data["id"] = self.id
+        return data
 
     @classmethod
     def from_dict(cls, source):
         """ Create instance of class from dictionary """
-        return cls(
+        customer = cls(
             source["f_name"],
             source["l_name"],
             source["address"],
             [Account.from_dict(account) for account in source["accounts"]],
             [Service.from_dict(service) for service in source["services"]]
         )
+        customer.id = source.get("id")
+        customer.mark_clean()
+        return customer
@@ -1,19 +1,44 @@
 class Employee:
     """
     class representing an employee
+    id is assigned by Storage when the employee is added
     """
+    __slots__ = ("id", "f_name", "l_name", "_dirty")
+
     def __init__(self, f_name, l_name):
+        self.id = None
         self.f_name = f_name
         self.l_name = l_name
+        self._dirty = True
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if not name.startswith("_"):
+            super().__setattr__("_dirty", True)
+
+    @property
+    def dirty(self):
+        """ True if the employee has changed since it was last saved """
+        return self._dirty
+
+    def mark_clean(self):
+        """ mark the employee as saved """
+        self._dirty = False
 
     def to_dict(self):
         """ Serializes class instance to dictionary """
-        return {
+        data = {
             "f_name": self.f_name,
             "l_name": self.l_name
         }
+        if self.id is not None:
+            data["id"] = self.id
+        return data
 
     @classmethod
     def from_dict(cls, source):
         """ Creates class instance from dict """
-        return cls(source["f_name"], source["l_name"])
+        employee = cls(source["f_name"], source["l_name"])
+        employee.id = source.get("id")
+        employee.mark_clean()
+        return employee
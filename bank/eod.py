@@ -0,0 +1,263 @@
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from bank.money import format_amount, parse_amount
+
+# customers handed to a worker process at a time
+CHUNK_SIZE = 5000
+# chunks handed out per worker before waiting for the oldest one
+PENDING_PER_WORKER = 2
+
+# key of storage.globals holding the rules used when none are given
+RULES_KEY = "eod_rules"
+
+
+def parse_rules(data):
+    """
+    Converts rules as configured, e.g.
+        {"accounts": {"savings": {"interest": 0.0001}},
+         "services": {"approved": {"interest": 0.0005, "fee": 1}}}
+    into {"accounts": {type: (interest, fee)}, "services": {status: (interest, fee)}}.
+    Interest is a daily rate, kept as an exact (numerator, denominator) pair, fees are cents.
+    Raises ValueError for malformed rules.
+    """
+    if not isinstance(data, dict) or not set(data) <= {"accounts", "services"}:
+        raise ValueError("Rules are an object of accounts and services")
+    rules = {"accounts": {}, "services": {}}
+    for group, keyed in data.items():
+        if not isinstance(keyed, dict):
+            raise ValueError("{0} rules are an object keyed by {1}".format(
+                group, "type" if group == "accounts" else "status"))
+        for key, rule in keyed.items():
+            if not isinstance(rule, dict) or not set(rule) <= {"interest", "fee"}:
+                raise ValueError("Rule of {0} {1} has interest and fee".format(group, key))
+            try:
+                interest = Decimal(str(rule.get("interest", 0)))
+            except InvalidOperation as err:
+                raise ValueError("Invalid interest rate {0}".format(rule["interest"])) from err
+            if not interest.is_finite() or interest < 0:
+                raise ValueError("Invalid interest rate {0}".format(rule["interest"]))
+            fee = parse_amount(rule.get("fee", 0))
+            if fee < 0:
+                raise ValueError("Fees can not be negative")
+            rules[group][key] = (interest.as_integer_ratio(), fee)
+    return rules
+
+
+def accrue(balance, rate):
+    """
+    Returns the interest in cents on balance for one day at rate, a (numerator, denominator)
+    pair, rounded half to even. Interest has the sign of balance.
+    """
+    numerator, denominator = rate
+    quotient, remainder = divmod(abs(balance) * numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient % 2):
+        quotient += 1
+    return quotient if balance >= 0 else -quotient
+
+
+# rule of accounts and services without one
+NO_RULE = ((0, 1), 0)
+
+
+def _changes(balance, rule):
+    """
+    Returns (kind, delta, total) of the transactions of one day applying rule to balance,
+    total being the key of the totals the delta is added to
+    """
+    interest_rate, fee = rule
+    changes = []
+    interest = accrue(balance, interest_rate)
+    if interest:
+        changes.append(("interest", interest, "paid" if interest > 0 else "charged"))
+    if fee and balance < 0:
+        changes.append(("fee", -fee, "fees"))
+    return changes
+
+
+def _totals():
+    return {"changed": 0, "paid": 0, "charged": 0, "fees": 0}
+
+
+def _accrue_record(record, rules, now, totals):
+    """
+    Returns a copy of a customer record with the day's interest and fees applied along with
+    {id: transactions} of its accounts and services, or (None, None) if nothing applies
+    """
+    account_rules, service_rules = rules["accounts"], rules["services"]
+    transactions = {}
+
+    def apply(account, item_id, rule):
+        """Returns account with the rule applied, the same dict if nothing changed"""
+        balance = account["balance"]
+        entries = []
+        for kind, delta, total in _changes(balance, rule):
+            balance += delta
+            entries.append((now, kind, delta, balance))
+            totals[total] += delta
+        if not entries:
+            return account
+        transactions[item_id] = entries
+        return dict(account, balance=balance)
+
+    accounts = [apply(account, account.get("id"), account_rules.get(account["type"], NO_RULE))
+                for account in record["accounts"]]
+    services = []
+    for service in record["services"]:
+        account = apply(service["account"], service.get("id"),
+                        service_rules.get(service["status"], NO_RULE))
+        services.append(service if account is service["account"]
+                        else dict(service, account=account))
+    if not transactions:
+        return None, None
+    return dict(record, accounts=accounts, services=services), transactions
+
+
+def _accrue_chunk(job):
+    """
+    Applies rules to a chunk of customer records in a worker process.
+    job is (rules, time, index of the first record, records), returns ([(index, record,
+    transactions)] of the records which changed, totals of interest paid and charged and of fees).
+    """
+    rules, now, first_index, records = job
+    totals = _totals()
+    changed = []
+    for index, record in enumerate(records, first_index):
+        updated, transactions = _accrue_record(record, rules, now, totals)
+        if updated is not None:
+            changed.append((index, updated, transactions))
+    totals["changed"] = len(changed)
+    return changed, totals
+
+
+def _accrue_customer(customer, rules, totals):
+    """Applies rules to a customer which was already built, through its accounts and services"""
+    account_rules, service_rules = rules["accounts"], rules["services"]
+    changed = False
+    for account in customer.accounts:
+        for kind, delta, total in _changes(account.balance,
+                                           account_rules.get(account.type, NO_RULE)):
+            if delta > 0:
+                account.deposit(delta, kind)
+            else:
+                account.withdrawl(-delta, kind)
+            totals[total] += delta
+            changed = True
+    for service in customer.services:
+        for kind, delta, total in _changes(service.balance,
+                                           service_rules.get(service.status, NO_RULE)):
+            service.post(delta, kind)
+            totals[total] += delta
+            changed = True
+    return changed
+
+
+def _jobs(storage, rules, now):
+    """Yields jobs of up to CHUNK_SIZE consecutive records of customers which were not built"""
+    customers = storage.customers
+    first_index, records = 0, []
+    for index in range(len(customers)):
+        if customers.loaded(index) is not None:
+            continue
+        if records and first_index + len(records) != index:
+            yield rules, now, first_index, records
+            records = []
+        if not records:
+            first_index = index
+            customers.prefetch(range(index, min(index + CHUNK_SIZE, len(customers))))
+        records.append(customers.record(index))
+        if len(records) == CHUNK_SIZE:
+            yield rules, now, first_index, records
+            records = []
+    if records:
+        yield rules, now, first_index, records
+
+
+def _load_rules(storage, path):
+    """
+    Returns (rules as configured, parsed rules) of the JSON file at path, or of storage.globals
+    if path is None
+    """
+    try:
+        if path is None:
+            if RULES_KEY not in storage.globals:
+                raise ValueError("No rules given and none stored under {0}".format(RULES_KEY))
+            data = storage.globals[RULES_KEY]
+        else:
+            with open(path, "r") as file:
+                data = json.load(file)
+        return data, parse_rules(data)
+    except (OSError, ValueError) as err:
+        logging.error("Unable to read rules: %s", err)
+        sys.exit(1)
+
+
+def _results(pool, jobs, workers):
+    """
+    Yields the results of jobs in order, computed by pool. Jobs are read here rather than by
+    the pool's feeder thread, so records are read in the thread which loaded storage and
+    only a few chunks per worker are in flight.
+    """
+    pending = collections.deque()
+    for job in jobs:
+        pending.append(pool.apply_async(_accrue_chunk, (job,)))
+        if len(pending) > PENDING_PER_WORKER * workers:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _merge(storage, results, totals):
+    """Hands the records changed by each chunk to storage, in order, and adds up the totals"""
+    for updates, chunk_totals in results:
+        storage.update_records(updates)
+        for key, value in chunk_totals.items():
+            totals[key] += value
+
+
+def end_of_day(storage, args):
+    """
+    apply a day's interest and fees to every account and service, as set by the rules in
+    args.rules (a JSON file, see parse_rules, kept for later runs with args.keep_rules) or
+    storage.globals["eod_rules"].
+    Accounts are matched by type and services by status, interest is credited to positive
+    and charged to negative balances, fees are charged to negative balances.
+    Records of customers which were not built are split into chunks accrued by args.workers
+    processes (all cores if 0), the changed records are merged back and saved once.
+    """
+    data, rules = _load_rules(storage, args.rules)
+    if args.keep_rules:
+        storage.globals = dict(storage.globals, **{RULES_KEY: data})
+    workers = args.workers or os.cpu_count() or 1
+    totals = _totals()
+
+    start = time.perf_counter()
+    # customers which were built may hold unsaved changes, so they are accrued here
+    # through their objects, before the workers get the records of all others
+    customers = storage.customers
+    for index in range(len(customers)):
+        customer = customers.loaded(index)
+        if customer is not None and _accrue_customer(customer, rules, totals):
+            totals["changed"] += 1
+
+    jobs = _jobs(storage, rules, time.time())
+    if workers == 1:
+        _merge(storage, map(_accrue_chunk, jobs), totals)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            _merge(storage, _results(pool, jobs, workers), totals)
+    storage.save()
+    elapsed = time.perf_counter() - start
+
+    print("Accrued {0} customers with {1} workers in {2:.2f}s".format(
+        len(customers), workers, elapsed))
+    print("changed: {0}".format(totals["changed"]))
+    print("interest_paid: {0}".format(format_amount(totals["paid"])))
+    print("interest_charged: {0}".format(format_amount(-totals["charged"])))
+    print("fees: {0}".format(format_amount(-totals["fees"])))
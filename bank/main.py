@@ -1,79 +1,123 @@
 import logging
+import os
 import sys
-from bank import Employee, Customer, Account, Service
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from bank import Employee, Customer, Account, Service, ServiceStatus
+from bank import Storage, FileUtils, BinaryFileUtils
+from bank.money import format_amount
+from bank.storage.compression import COMPRESSIONS, NONE
+
+
+def _item_position(items, reference, position_of_id=None):
+    """
+    helper function turning a reference into the position of an item, None if there is no such item
+    references are positions (negative ones count from the end) or ids written as "@<id>"
+    """
+    if isinstance(reference, str) and reference.startswith("@"):
+        item_id = int(reference[1:])
+        if position_of_id is not None:
+            return position_of_id(item_id)
+        return next((i for i, item in enumerate(items) if item.id == item_id), None)
+    position = reference + len(items) if reference < 0 else reference
+    return position if 0 <= position < len(items) else None
+
+
+def _customer_position(storage, reference):
+    """ helper function to find the position of a customer, ids are looked up in storage.ids """
+    # storage.ids is only read for ids, plain positions never need the index
+    position = _item_position(storage.customers, reference,
+                              lambda customer_id: storage.ids.position(customer_id))
+    if position is None:
+        logging.critical("Could not find customer %s", reference)
+        sys.exit(1)
+    return position
 
 
 def _get_customer(storage, index):
     """ helper function to retrieve customer from storage """
-    try:
-        customer = storage.customers[index]
-    except IndexError:
-        logging.critical("Could not find customer %s", index)
-        sys.exit(1)
-
-    return customer
+    return storage.customers[_customer_position(storage, index)]
 
 
 def _get_customer_account(storage, customer_index, account_index):
     """ helper function to retrieve account from storage """
     customer = _get_customer(storage, customer_index)
-    try:
-        account = customer.accounts[account_index]
-    except IndexError:
+    position = _item_position(customer.accounts, account_index)
+    if position is None:
         logging.critical(
             "Could not find account %s belonging to customer %s", account_index, customer_index)
         sys.exit(1)
 
-    return (customer, account)
+    return (customer, customer.accounts[position])
 
 
 def _get_customer_service(storage, customer_index, service_index):
     """ helper function to retrieve service from storage """
     customer = _get_customer(storage, customer_index)
-    try:
-        service = customer.services[service_index]
-    except IndexError:
+    position = _item_position(customer.services, service_index)
+    if position is None:
         logging.critical(
             "Could not find service %s belonging to customer %s", service_index, customer_index)
         sys.exit(1)
 
-    return (customer, service)
+    return (customer, customer.services[position])
+
+
+def _application_key(customer, service):
+    """ helper function to turn a customer and one of its services into an application index key """
+    return (customer.id, customer.services.index(service))
 
 
 def list_employees(storage, _):
     """ print list of employees """
     print("Listing {0} employees".format(len(storage.employees)))
     for i, emp in enumerate(storage.employees):
-        print("{0}:, {1}, {2}".format(i, emp.f_name, emp.l_name))
+        print("{0} @{1}:, {2}, {3}".format(i, emp.id, emp.f_name, emp.l_name))
 
 
 def add_employee(storage, args):
     """ add new employee """
     emp = Employee(args.first_name, args.last_name)
-    storage.employees.append(emp)
+    storage.add_employee(emp)
 
 
 def remove_employee(storage, args):
     """ remove an employee """
-    try:
-        del storage.employees[args.employee_index]
-    except IndexError:
+    position = _item_position(storage.employees, args.employee_index)
+    if position is None:
         logging.critical(
             "Could not find an employee with index %s", args.employee_index)
+    else:
+        storage.remove_employee(position)
 
 
 def list_customers(storage, _):
     """ list customers """
+    storage.customers.prefetch(range(len(storage.customers)))
     print("Listing {0} customers".format(len(storage.customers)))
     for i, cust in enumerate(storage.customers):
-        print("{0}: {1}, {2}, {3}, ${4:.2f}".format(
-            i, cust.f_name, cust.l_name, cust.address, cust.total_balance))
+        print("{0} @{1}: {2}, {3}, {4}, ${5}".format(
+            i, cust.id, cust.f_name, cust.l_name, cust.address, format_amount(cust.total_balance)))
+
+
+def find_customers(storage, args):
+    """ list customers with a name or address word starting with each word of the query """
+    indices = sorted(storage.ids.position(customer_id)
+                     for customer_id in storage.names.find(args.query))
+    storage.customers.prefetch(indices)
+    print("Found {0} customers".format(len(indices)))
+    for i in indices:
+        cust = storage.customers[i]
+        print("{0} @{1}: {2}, {3}, {4}, ${5}".format(
+            i, cust.id, cust.f_name, cust.l_name, cust.address, format_amount(cust.total_balance)))
 
 
 def add_customer(storage, args):
     """ add a new customer """
     cust = Customer(args.first_name, args.last_name, args.address)
-    storage.customers.append(cust)
+    storage.add_customer(cust)
 
 
 def remove_customer(storage, args):
@@ -81,16 +125,17 @@ def remove_customer(storage, args):
     cust = _get_customer(storage, args.customer_index)
     if cust.total_balance != 0:
         logging.error("Could not remove customer %s, total balance is $%s, not $0.00",
-                      args.customer_index, cust.total_balance)
+                      args.customer_index, format_amount(cust.total_balance))
     else:
-        del storage.customers[args.customer_index]
+        storage.remove_customer(_customer_position(storage, args.customer_index))
 
 
 def list_accounts(storage, args):
     cust = _get_customer(storage, args.customer_index)
     print("Listing {0} accounts".format(len(cust.accounts)))
     for i, account in enumerate(cust.accounts):
-        print("{0}: {1}, ${2:.2f}".format(i, account.type, account.balance))
+        print("{0} @{1}: {2}, ${3}".format(
+            i, account.id, account.type, format_amount(account.balance)))
 
 
 def add_account(storage, args):
@@ -105,9 +150,9 @@ def remove_account(storage, args):
         storage, args.customer_index, args.account_index)
     if acct.balance != 0:
         logging.error("Could not remove customer %s account %s, account balance is $%s not $0.00",
-                      args.customer_index, args.account_index, acct.balance)
+                      args.customer_index, args.account_index, format_amount(acct.balance))
     else:
-        del cust.accounts[args.account_index]
+        cust.accounts.remove(acct)
 
 
 def deposit(storage, args):
@@ -131,8 +176,42 @@ def transfer(storage, args):
     _, destination_account = _get_customer_account(
         storage, args.customer_index, args.destination_account_index)
 
-    source_account.withdrawl(args.amount)
-    destination_account.deposit(args.amount)
+    source_account.withdrawl(args.amount, "transfer")
+    destination_account.deposit(args.amount, "transfer")
+
+
+def parse_since(value):
+    """
+    helper function turning the start of a statement into (sequence number, time)
+    value is a transaction's sequence number or an ISO date or date and time, None for the first transaction
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, int) or value.isdigit():
+        return int(value), None
+    return None, datetime.fromisoformat(value).timestamp()
+
+
+def statement(storage, args):
+    """ print a page of an account's transactions from the ledger """
+    _, account = _get_customer_account(
+        storage, args.customer_index, args.account_index)
+    since_seq, since_time = parse_since(args.since)
+    opening, entries, next_seq = None, [], None
+    if account.id is not None and storage.ledger is not None:
+        opening, entries, next_seq = storage.ledger.statement(
+            account.id, since_seq, since_time, args.limit)
+
+    print("Listing {0} transactions".format(len(entries)))
+    if len(entries) > 0:
+        print("opening balance ${0}".format(format_amount(opening)))
+        print("#seq, time, kind, amount, balance")
+    for entry in entries:
+        print("#{0}, {1}, {2}, ${3}, ${4}".format(
+            entry["seq"], datetime.fromtimestamp(entry["time"]).isoformat(" ", "seconds"),
+            entry["kind"], format_amount(entry["amount"]), format_amount(entry["balance"])))
+    if next_seq is not None:
+        print("more transactions follow, continue with --since {0}".format(next_seq))
 
 
 def list_services(storage, args):
@@ -140,17 +219,20 @@ def list_services(storage, args):
     cust = _get_customer(storage, args.customer_index)
     print("Listing {0} services".format(len(cust.services)))
     if len(cust.services) > 0:
-        print("index: status, limit, balance")
+        print("index @id: status, limit, balance")
     for i, service in enumerate(cust.services):
-        print("{0}: {1} ${2} ${3}".format(
-            i, service.status, service.limit, service.balance))
+        print("{0} @{1}: {2} ${3} ${4}".format(
+            i, service.id, service.status, format_amount(service.limit),
+            format_amount(service.balance)))
 
 
 def apply_for_service(storage, args):
     """ apply for a new service """
     cust = _get_customer(storage, args.customer_index)
+    applications = storage.applications
     service = Service(args.limit)
     cust.services.append(service)
+    applications.add(cust.id, len(cust.services) - 1)
 
 
 def borrow_from_service(storage, args):
@@ -173,18 +255,22 @@ def pay_to_service(storage, args):
 
 def list_applicaitons(storage, _):
     """ list all pending applications """
+    pending = [(storage.ids.position(customer_id), service_index)
+               for customer_id, service_index in storage.applications]
+    # sharded stores read the shards holding the applicants in parallel
+    storage.customers.prefetch(customer_index for customer_index, _ in pending)
     applications = []
-    for customer_index, customer in enumerate(storage.customers):
-        for service_index, service in enumerate(customer.services):
-            if service.status == "application":
-                applications.append((
-                    customer_index,
-                    customer.f_name,
-                    customer.l_name,
-                    customer.total_balance,
-                    customer.total_limit,
-                    service_index,
-                    service.limit))
+    for customer_index, service_index in pending:
+        customer = storage.customers[customer_index]
+        service = customer.services[service_index]
+        applications.append((
+            customer_index,
+            customer.f_name,
+            customer.l_name,
+            format_amount(customer.total_balance),
+            format_amount(customer.total_limit),
+            service_index,
+            format_amount(service.limit)))
 
     print("Listing {0} applications".format(len(applications)))
     if len(applications) > 0:
@@ -200,11 +286,12 @@ def approve_application(storage, args):
     if cust.total_balance < (cust.total_limit + service.limit):
         logging.warning("Customer %s's total balance %s is less than total limit after approval %s",
                         args.customer_index,
-                        cust.total_balance,
-                        cust.total_limit + service.limit
+                        format_amount(cust.total_balance),
+                        format_amount(cust.total_limit + service.limit)
                         )
     else:
         service.approve()
+        storage.applications.discard(*_application_key(cust, service))
 
 
 def remove_application(storage, args):
@@ -212,8 +299,63 @@ def remove_application(storage, args):
     cust, service = _get_customer_service(
         storage, args.customer_index, args.service_index)
     print(service.status)
-    if service.status != "application":
+    if service.status != ServiceStatus.APPLICATION:
         logging.warning(
             "cannot remove customer %s's service %s as it is not an application")
     else:
-        del cust.services[args.service_index]
+        key = _application_key(cust, service)
+        del cust.services[key[1]]
+        storage.applications.service_removed(*key)
+
+
+def report_totals(storage, _):
+    """ print bank wide totals """
+    for name, value in storage.balances.bank_totals().items():
+        if name not in ("customers", "accounts", "services"):
+            value = format_amount(value)
+        print("{0}: {1}".format(name, value))
+
+
+def report_memory(storage, _):
+    """ print memory taken by building every customer from its record, measured with tracemalloc """
+    records = []
+    for i in range(len(storage.customers)):
+        record = storage.customers.record(i)
+        records.append(record if record is not None else storage.customers[i].to_dict())
+
+    tracemalloc.start()
+    customers = [Customer.from_dict(record) for record in records]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("customers: {0}".format(len(customers)))
+    print("accounts: {0}".format(sum(len(cust.accounts) for cust in customers)))
+    print("services: {0}".format(sum(len(cust.services) for cust in customers)))
+    print("bytes: {0}".format(size))
+    print("peak_bytes: {0}".format(peak))
+    print("bytes_per_customer: {0:.1f}".format(size / len(customers) if customers else 0.))
+
+
+def report_codecs(storage, _):
+    """ print size, save time and load time of the store written in each format and compression """
+    data = storage.snapshot()
+    formats = {"json": FileUtils, "binary": BinaryFileUtils}
+    directory = os.path.dirname(os.path.abspath(storage.utils.path))
+    baseline = None
+    with tempfile.TemporaryDirectory(dir=directory) as temp_directory:
+        for format_name, utils_class in formats.items():
+            for compression in (NONE, *COMPRESSIONS):
+                utils = utils_class(os.path.join(temp_directory, "bank"), compression)
+                start = time.perf_counter()
+                utils.write_dict(data)
+                save_time = time.perf_counter() - start
+                size = os.path.getsize(utils.path)
+
+                start = time.perf_counter()
+                Storage(utils_class, utils.path).load()
+                load_time = time.perf_counter() - start
+
+                baseline = baseline or size
+                name = compression if utils.level is None else "{0}:{1}".format(compression, utils.level)
+                print("{0} {1}: {2} bytes ({3:.1%}), save {4:.3f}s, load {5:.3f}s".format(
+                    format_name, name, size, size / baseline, save_time, load_time))
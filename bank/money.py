@@ -0,0 +1,39 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# amounts are integer cents throughout the domain and the stored data, so sums are exact,
+# dollars only appear when parsing user input and formatting output
+CENTS_PER_DOLLAR = 100
+
+
+def cents(value):
+    """
+    Returns value, an amount in cents, as an int.
+    Floats without a fraction are accepted, e.g. as read back from a REAL sqlite column.
+    """
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    raise TypeError("Amounts are integer cents, got {0!r}".format(value))
+
+
+def parse_amount(value):
+    """Converts an amount in dollars (a string or number) to cents, rejecting fractions of a cent"""
+    try:
+        amount = Decimal(str(value)) * CENTS_PER_DOLLAR
+    except InvalidOperation as err:
+        raise ValueError("Invalid amount {0}".format(value)) from err
+    if not amount.is_finite() or amount != amount.to_integral_value():
+        raise ValueError("Amount {0} is not a whole number of cents".format(value))
+    return int(amount)
+
+
+def dollars_to_cents(value):
+    """Converts a float amount in dollars from data written before amounts were cents"""
+    return int((Decimal(repr(value)) * CENTS_PER_DOLLAR).quantize(Decimal(1), ROUND_HALF_UP))
+
+
+def format_amount(amount):
+    """Formats an amount in cents as dollars, e.g. -1005 as -10.05"""
+    sign = "-" if amount < 0 else ""
+    return "{0}{1}.{2:02d}".format(sign, *divmod(abs(amount), CENTS_PER_DOLLAR))
@@ -0,0 +1,203 @@
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+
+from bank.commands import AMOUNT_ARGUMENTS, COMMAND_ERRORS, command_from_dict, describe_error
+from bank.money import format_amount
+from bank.storage import ConcurrentModificationError
+
+# arguments of the command line which configure the client rather than the command
+CLIENT_ARGUMENTS = ("func", "file", "backend", "connect")
+
+
+class _CapturingHandler(logging.Handler):
+    """Collects log messages emitted while a command runs"""
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append("{0}: {1}".format(record.levelname, record.getMessage()))
+
+
+def execute(storage, request):
+    """Runs a single request against storage, returns the response dictionary"""
+    output = io.StringIO()
+    handler = _CapturingHandler()
+    logger = logging.getLogger()
+    logger.addHandler(handler)
+    try:
+        with contextlib.redirect_stdout(output):
+            func, args = command_from_dict(request)
+            func(storage, args)
+        error = None
+    except COMMAND_ERRORS as err:
+        error = describe_error(err)
+    finally:
+        logger.removeHandler(handler)
+
+    return {"ok": error is None, "output": output.getvalue(), "log": handler.messages,
+            "error": error}
+
+
+class BankServer:
+    """
+    Serves requests against a storage which stays loaded for the lifetime of the server.
+    Modifications are saved once save_every requests were handled or save_interval
+    seconds after the first unsaved request, whichever comes first.
+    If durable, responses are only sent once the save covering their request completed,
+    so the requests of a group share one save (and fsync) and wait at most save_interval.
+    When another process saved the store in the meantime, the changes of the unsaved requests
+    are dropped (durable responses report the failure) and the store is loaded again.
+    While serving, the store is also checked every save_interval seconds and loaded again
+    if another process saved it, so a server which only reads sees the changes.
+    """
+    def __init__(self, storage, save_every=1000, save_interval=1.0, durable=False):
+        self.storage = storage
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self.durable = durable
+        self._unsaved = 0
+        self._save_timer = None
+        self._check_timer = None
+        self._saved = None
+
+    def handle_request(self, request):
+        """Executes request and schedules saving of its changes"""
+        response = execute(self.storage, request)
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+        elif self._save_timer is None:
+            self._save_timer = asyncio.get_running_loop().call_later(self.save_interval, self.save)
+        return response
+
+    def next_save(self):
+        """Returns a future which is done once the next save completed"""
+        if self._saved is None:
+            self._saved = asyncio.get_running_loop().create_future()
+        return self._saved
+
+    def save(self):
+        """Saves storage if there were requests since the last save"""
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+        saved, self._saved = self._saved, None
+        try:
+            if self._unsaved:
+                self.storage.save()
+                self._unsaved = 0
+        except ConcurrentModificationError as err:
+            # the changes were made to stale data, later requests start from what was saved
+            logging.error("Dropping the changes of %s requests: %s", self._unsaved, err)
+            self._unsaved = 0
+            self.storage.load()
+            if saved is not None:
+                saved.set_exception(err)
+            return
+        except Exception as err:
+            if saved is not None:
+                saved.set_exception(err)
+            raise
+        if saved is not None:
+            saved.set_result(None)
+
+    def check(self):
+        """Loads storage again if another process saved it and nothing is unsaved, repeats every save_interval"""
+        self._check_timer = asyncio.get_running_loop().call_later(self.save_interval, self.check)
+        # unsaved changes are saved first, a conflicting save reloads as well
+        if not self._unsaved and self.storage.modified_elsewhere():
+            logging.info("Store was saved by another process, loading it again")
+            self.storage.load()
+
+    async def _respond(self, request):
+        """Handles request, waiting for its changes to be saved if the server is durable"""
+        saved = self.next_save() if self.durable else None
+        response = self.handle_request(request)
+        if saved is not None:
+            try:
+                await saved
+            except Exception as err:
+                response = dict(response, ok=False,
+                                error="changes were not saved: {0}".format(err))
+        return response
+
+    async def _serve_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self._respond(json.loads(line))
+                except ValueError as err:
+                    response = {"ok": False, "output": "", "log": [],
+                                "error": "invalid request: {0}".format(err)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, address):
+        """Accepts connections on address until SIGINT or SIGTERM is received"""
+        host, port = parse_address(address)
+        if port is None:
+            server = await asyncio.start_unix_server(self._serve_client, path=host)
+        else:
+            server = await asyncio.start_server(self._serve_client, host=host, port=port)
+
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+        logging.info("Serving on %s", address)
+        if self.save_interval > 0:
+            self._check_timer = loop.call_later(self.save_interval, self.check)
+        async with server:
+            await stopped.wait()
+        if self._check_timer is not None:
+            self._check_timer.cancel()
+        if port is None:
+            os.unlink(host)
+        self.save()
+
+
+def parse_address(address):
+    """Splits host:port, an address without a numeric port is the path of a unix socket"""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address, None
+
+
+def serve(storage, args):
+    """ serve requests against storage until interrupted """
+    server = BankServer(storage, args.save_every, args.save_interval, args.durable)
+    asyncio.run(server.serve(args.address))
+
+
+def send_command(address, args):
+    """Forwards the command described by args to a server, returns the response dictionary"""
+    request = {key: value for key, value in vars(args).items() if key not in CLIENT_ARGUMENTS}
+    request["command"] = args.func.__name__
+    # the command line parsed amounts to cents, requests give them in dollars
+    for name in AMOUNT_ARGUMENTS.get(request["command"], ()):
+        if isinstance(request.get(name), int):
+            request[name] = format_amount(request[name])
+
+    host, port = parse_address(address)
+    if port is None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(host)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(request).encode() + b"\n")
+        stream.flush()
+        return json.loads(stream.readline())
@@ -1,17 +1,63 @@
+import sys
+from enum import Enum
+
 from bank.account import Account
+from bank.money import cents
+
+
+class ServiceStatus(str, Enum):
+    """Known service statuses, members compare equal to (and serialize as) their strings"""
+    APPLICATION = "application"
+    APPROVED = "approved"
+
+    def __str__(self):
+        return self.value
+
+    @classmethod
+    def of(cls, value):
+        """Returns the member for value, or value interned if it is not a known status"""
+        try:
+            return cls(value)
+        except ValueError:
+            return sys.intern(value)
+
 
 class Service:
-    """ Class representing a lending service """
-    def __init__(self, limit, account=None, status="application"):
+    """
+    Class representing a lending service, limit and balance are integer cents
+    Balance and approved limit changes are reported to the owning Customer if it has one.
+    id is assigned by Storage when the owning customer is saved.
+    """
+    __slots__ = ("id", "_account", "_owner", "_limit", "_status", "_dirty")
+
+    def __init__(self, limit, account=None, status=ServiceStatus.APPLICATION):
+        limit = cents(limit)
         if limit < 0:
             raise ValueError("limit must cannot be negative")
 
         if account is None:
-            self._account = Account("service", 0.)
+            self._account = Account("service", 0)
         else:
             self._account = account
-        self.limit = limit
-        self._status = status
+        self._account._owner = self
+        self._owner = None
+        self.id = None
+        self._limit = limit
+        self._status = ServiceStatus.of(status)
+        self._dirty = True
+
+    @property
+    def limit(self):
+        """Maximum amount which can be borrowed from the service"""
+        return self._limit
+
+    @limit.setter
+    def limit(self, value):
+        value = cents(value)
+        if self._owner is not None and self._status == ServiceStatus.APPROVED:
+            self._owner._limit_changed(value - self._limit)
+        self._limit = value
+        self._dirty = True
 
     @property
     def status(self):
@@ -23,41 +69,78 @@ class Service:
         """Returns balance of """
         return self._account.balance
 
+    @property
+    def dirty(self):
+        """True if the service or its account has changed since it was last saved"""
+        return self._dirty or self._account.dirty
+
+    def mark_clean(self):
+        """Marks the service and its account as saved"""
+        self._dirty = False
+        self._account.mark_clean()
+
+    def _balance_changed(self, delta):
+        """Called by the service's account when its balance changed"""
+        if self._owner is not None:
+            self._owner._balance_changed(delta)
+
     def approve(self):
         """Sets status to approved"""
-        self._status = "approved"
+        if self._owner is not None and self._status != ServiceStatus.APPROVED:
+            self._owner._limit_changed(self._limit)
+        self._status = ServiceStatus.APPROVED
+        self._dirty = True
 
     def collect(self, amount, from_account):
         """Credit service account from from_account"""
-        if self._status != 'approved':
+        if self._status != ServiceStatus.APPROVED:
             raise RuntimeError("Service not approved")
 
         try:
-            from_account.withdrawl(amount)
-            self._account.deposit(amount)
+            from_account.withdrawl(amount, "collect")
+            self._account.deposit(amount, "collect")
         except ValueError as err:
             raise RuntimeError("Unable to collect funds") from err
 
     def lend(self, amount, to_account):
         """Lend balance from service account to to_account"""
-        if self._status != 'approved':
+        if self._status != ServiceStatus.APPROVED:
             raise RuntimeError("Service not approved")
 
+        amount = cents(amount)
         if (self._account.balance - amount) < -self.limit:
             raise ValueError("Requested amount exceeds credit limit")
 
-        self._account.withdrawl(amount)
-        to_account.deposit(amount)
+        self._account.withdrawl(amount, "lend")
+        to_account.deposit(amount, "lend")
+
+    def post(self, amount, kind):
+        """Adds amount to the service balance (charges it if negative), e.g. interest or fees"""
+        amount = cents(amount)
+        if amount >= 0:
+            self._account.deposit(amount, kind)
+        else:
+            self._account.withdrawl(-amount, kind)
+
+    def take_transactions(self):
+        """Returns the transactions of the service's account since the last call"""
+        return self._account.take_transactions()
 
     def to_dict(self):
         """ Serialize class instance to dictionary """
-        return {
+        data = {
             "account": self._account.to_dict(),
             "limit": self.limit,
-            "status": self._status
+            "status": str(self._status)
         }
+        if self.id is not None:
+            data["id"] = self.id
+        return data
 
     @classmethod
     def from_dict(cls, source):
         """ Create class instance from dictionary"""
-        return cls(source["limit"], Account.from_dict(source["account"]), source["status"])
+        service = cls(source["limit"], Account.from_dict(source["account"]), source["status"])
+        service.id = source.get("id")
+        service.mark_clean()
+        return service
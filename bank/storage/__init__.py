@@ -1,2 +1,7 @@
-from bank.storage.file_utils import FileUtils
+from bank.storage.file_utils import FileUtils, BinaryFileUtils
+from bank.storage.journal import JournalFileUtils
+from bank.storage.indexed import IndexedFileUtils
+from bank.storage.sharded import ShardedFileUtils
+from bank.storage.sqlite_utils import SqliteUtils
 from bank.storage.storage import Storage
+from bank.storage.locking import ConcurrentModificationError
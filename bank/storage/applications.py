@@ -0,0 +1,119 @@
+def pending_of(customer):
+    """Positions of the services of customer (a Customer object or its raw record) which are applications"""
+    if isinstance(customer, dict):
+        return [index for index, service in enumerate(customer["services"])
+                if service["status"] == "application"]
+    return [index for index, service in enumerate(customer.services)
+            if service.status == "application"]
+
+
+class ApplicationIndex:
+    """
+    Pending service applications in order of submission, keyed by (customer_id, service_index).
+    Kept up to date by Storage and bank/main.py so the queue can be listed without scanning
+    every customer. Modifications are recorded in changes, see NameIndex.
+    """
+    OPERATIONS = ("add", "discard", "customer_removed", "service_removed")
+
+    def __init__(self, entries=()):
+        # key -> number in order of submission, so keys can change without losing their place
+        self._entries = {}
+        self._services = {}  # customer id -> service indexes with a pending application
+        self._next = 0
+        self.changes = []
+        for customer, service in entries:
+            self._insert(customer, service)
+
+    @classmethod
+    def from_list(cls, entries):
+        """Creates index from the result of to_list"""
+        return cls(entries)
+
+    @classmethod
+    def build(cls, customers):
+        """
+        Creates index by scanning all services of customers, a list of Customer objects or a
+        LazyList. Customers of a LazyList which were not built yet are read from their raw records.
+        """
+        loaded = getattr(customers, "loaded", None)
+        entries = []
+        for index in range(len(customers)):
+            customer = loaded(index) if loaded is not None else customers[index]
+            if customer is None:
+                customer = customers.record(index)
+                customer_id = customer.get("id")
+            else:
+                customer_id = customer.id
+            entries.extend((customer_id, service) for service in pending_of(customer))
+        return cls(entries)
+
+    @staticmethod
+    def changes_added(customers):
+        """Changes appending the pending applications of (id, customer) pairs"""
+        return [["add", customer_id, service_index] for customer_id, customer in customers
+                for service_index in pending_of(customer)]
+
+    @staticmethod
+    def changes_removed(customer_id, _):
+        """Changes dropping the applications of a removed customer"""
+        return [["customer_removed", customer_id]]
+
+    def apply(self, change):
+        """Applies a change, a list of an operation and its arguments"""
+        if change[0] not in self.OPERATIONS:
+            raise ValueError("Unknown index operation {0}".format(change[0]))
+        getattr(self, change[0])(*change[1:])
+
+    def __iter__(self):
+        return iter(sorted(self._entries, key=self._entries.get))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _insert(self, customer_id, service_index, number=None):
+        if number is None:
+            number, self._next = self._next, self._next + 1
+        self._entries[(customer_id, service_index)] = number
+        self._services.setdefault(customer_id, set()).add(service_index)
+
+    def _remove(self, customer_id, service_index):
+        number = self._entries.pop((customer_id, service_index))
+        services = self._services[customer_id]
+        services.discard(service_index)
+        if not services:
+            del self._services[customer_id]
+        return number
+
+    def add(self, customer_id, service_index):
+        """Appends an application to the queue"""
+        if (customer_id, service_index) not in self._entries:
+            self._insert(customer_id, service_index)
+            self.changes.append(["add", customer_id, service_index])
+
+    def discard(self, customer_id, service_index):
+        """Removes an application from the queue if it is in it"""
+        if (customer_id, service_index) in self._entries:
+            self._remove(customer_id, service_index)
+            self.changes.append(["discard", customer_id, service_index])
+
+    def customer_removed(self, customer_id):
+        """Drops the applications of a removed customer"""
+        for service_index in list(self._services.get(customer_id, ())):
+            self._remove(customer_id, service_index)
+        self.changes.append(["customer_removed", customer_id])
+
+    def service_removed(self, customer_id, service_index):
+        """Drops a removed service and renumbers the later services of the same customer"""
+        if (customer_id, service_index) in self._entries:
+            self._remove(customer_id, service_index)
+        for later in sorted(service for service in self._services.get(customer_id, ())
+                            if service > service_index):
+            self._insert(customer_id, later - 1, self._remove(customer_id, later))
+        self.changes.append(["service_removed", customer_id, service_index])
+
+    def to_list(self):
+        """Serializes index to a list of [customer_id, service_index] pairs in order of submission"""
+        return [list(key) for key in self]
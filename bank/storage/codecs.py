@@ -0,0 +1,340 @@
+import codecs
+import json
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from itertools import accumulate
+
+# length of the magic every binary format starts with
+MAGIC_LENGTH = 8
+
+# characters read from a JSON file at a time
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\n\r"
+
+
+class JsonReader:
+    """
+    Incremental parser over a JSON text file object, only the value being decoded
+    and one chunk of text are held in memory
+    """
+    def __init__(self, file):
+        self._file = file
+        self._text = ""
+        self._position = 0
+        self._end = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size=CHUNK_SIZE):
+        """Reads size more characters, returns False at the end of the file"""
+        if self._end:
+            return False
+        chunk = self._file.read(size)
+        self._text = self._text[self._position:] + chunk
+        self._position = 0
+        self._end = not chunk
+        return not self._end
+
+    def peek(self):
+        """Returns the next character which is not whitespace without consuming it"""
+        while True:
+            while self._position < len(self._text) and self._text[self._position] in WHITESPACE:
+                self._position += 1
+            if self._position < len(self._text):
+                return self._text[self._position]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, characters):
+        """Consumes the next character, which has to be one of characters, and returns it"""
+        character = self.peek()
+        if character not in characters:
+            raise ValueError("Expected one of {0!r} in JSON document, got {1!r}".format(
+                characters, character))
+        self._position += 1
+        return character
+
+    def value(self):
+        """Decodes the next value"""
+        return self._decode()[0]
+
+    def text(self):
+        """Returns the text of the next value, after checking that it is valid JSON"""
+        _, start, end = self._decode()
+        return self._text[start:end]
+
+    def _decode(self):
+        """Decodes the next value, returns it with its start and end in the buffered text"""
+        self.peek()
+        while True:
+            start = self._position
+            try:
+                value, end = self._decoder.raw_decode(self._text, start)
+            except json.JSONDecodeError:
+                # read at least as much again as is buffered, so a large value is only
+                # decoded a logarithmic number of times
+                if not self._fill(max(CHUNK_SIZE, len(self._text))):
+                    raise
+                continue
+            # a number running up to the end of the text may continue in the next chunk
+            if end == len(self._text) and self._fill():
+                continue
+            self._position = end
+            return value, start, end
+
+    def items(self):
+        """Yields the text of each element of the next value, an array, one at a time"""
+        self.expect("[")
+        if self.peek() == "]":
+            self._position += 1
+            return
+        while True:
+            yield self.text()
+            if self.expect(",]") == "]":
+                return
+
+    def members(self):
+        """Yields the keys of the next value, an object, the caller reads each member's value"""
+        self.expect("{")
+        if self.peek() == "}":
+            self._position += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+
+class JsonRecords(Sequence):
+    """
+    Records of a JSON array kept as their UTF-8 text in a single buffer, each record is
+    decoded on access
+    """
+    def __init__(self, texts=()):
+        self._text = bytearray()
+        self._ends = array("Q", [0])
+        for text in texts:
+            self._text += text.encode()
+            self._ends.append(len(self._text))
+
+    def __len__(self):
+        return len(self._ends) - 1
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        return json.loads(self._text[self._ends[index]:self._ends[index + 1]])
+
+
+class JsonCodec:
+    """
+    Whole store as a single JSON document, the interchange format.
+    Customers are written one record at a time, so the text of the document is never held
+    in memory when saving. Reading parses the document a chunk at a time and keeps each
+    customer record as its text, which is only decoded when the record is accessed.
+    """
+    @staticmethod
+    def matches(head):
+        """JSON is read when no other codec recognizes the file"""
+        return True
+
+    @staticmethod
+    def encode(data, file):
+        """Writes data to file, a binary file object, customers may be any iterable"""
+        file.write(b'{"customers": [')
+        for position, record in enumerate(data.get("customers", ())):
+            if position:
+                file.write(b", ")
+            file.write(json.dumps(record).encode())
+        file.write(b"]")
+        for key, value in data.items():
+            if key != "customers":
+                file.write(", {0}: {1}".format(json.dumps(key), json.dumps(value)).encode())
+        file.write(b"}")
+
+    @staticmethod
+    def decode(file):
+        """Reads data from file, a binary file object, customers as JsonRecords"""
+        reader = JsonReader(codecs.getreader("utf-8")(file))
+        data = {}
+        for key in reader.members():
+            data[key] = JsonRecords(reader.items()) if key == "customers" else reader.value()
+        return data
+
+
+# magic, string count, customer count, account count, service count, length of the JSON remainder
+BINARY_HEADER = struct.Struct("<8sQQQQQ")
+NO_ID = -1
+# columns are stored little-endian, hosts of the other byte order swap them
+SWAP = sys.byteorder != "little"
+
+
+def _column(typecode, content=()):
+    return array(typecode, content)
+
+
+def _column_bytes(column):
+    """Returns the little-endian bytes of column"""
+    if SWAP:
+        column = _column(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+class BinaryRecords(Sequence):
+    """Customer records of a binary snapshot, each record is built from the columns on access"""
+    def __init__(self, strings, customers, accounts, services):
+        self._strings = strings
+        (self._ids, self._f_names, self._l_names, self._addresses,
+         self._account_counts, self._service_counts) = customers
+        self._account_ids, self._account_types, self._account_balances = accounts
+        (self._service_ids, self._service_limits, self._service_statuses,
+         self._service_balances, self._service_types) = services
+        self._first_account = array("q", accumulate(self._account_counts, initial=0))
+        self._first_service = array("q", accumulate(self._service_counts, initial=0))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        strings = self._strings
+
+        accounts = []
+        for position in range(self._first_account[index], self._first_account[index + 1]):
+            account = {"type": strings[self._account_types[position]],
+                       "balance": self._account_balances[position]}
+            if self._account_ids[position] != NO_ID:
+                account["id"] = self._account_ids[position]
+            accounts.append(account)
+
+        services = []
+        for position in range(self._first_service[index], self._first_service[index + 1]):
+            service = {"account": {"type": strings[self._service_types[position]],
+                                   "balance": self._service_balances[position]},
+                       "limit": self._service_limits[position],
+                       "status": strings[self._service_statuses[position]]}
+            if self._service_ids[position] != NO_ID:
+                service["id"] = self._service_ids[position]
+            services.append(service)
+
+        record = {"f_name": strings[self._f_names[index]],
+                  "l_name": strings[self._l_names[index]],
+                  "address": strings[self._addresses[index]],
+                  "accounts": accounts,
+                  "services": services}
+        if self._ids[index] != NO_ID:
+            record["id"] = self._ids[index]
+        return record
+
+
+class BinaryCodec:
+    """
+    Compact snapshot: customers, accounts and services are stored as fixed width columns
+    (ids and cents as int64, strings as positions into a table of distinct strings), written
+    and read with array.tobytes/frombytes, little-endian whatever the host. Everything but the customers follows as JSON.
+    Customer records are only built when accessed. Fields other than the known ones of
+    customers, accounts and services are not kept.
+    """
+    MAGIC = b"BANKBIN\x01"
+
+    @classmethod
+    def matches(cls, head):
+        """Returns True if head, the first bytes of a file, start a binary snapshot"""
+        return head[:MAGIC_LENGTH] == cls.MAGIC
+
+    @classmethod
+    def encode(cls, data, file):
+        """Writes data to file, a binary file object"""
+        records = data["customers"]
+        if not isinstance(records, list):
+            records = list(records)
+        account_records = [account for record in records for account in record["accounts"]]
+        service_records = [service for record in records for service in record["services"]]
+
+        strings = {}
+
+        def strings_of(items, *keys):
+            # setdefault hands out the next index to strings seen for the first time
+            column = _column("I")
+            for item in items:
+                for key in keys:
+                    item = item[key]
+                column.append(strings.setdefault(item, len(strings)))
+            return column
+
+        def ids_of(items):
+            return _column("q", [item.get("id", NO_ID) for item in items])
+
+        customers = [
+            ids_of(records),
+            strings_of(records, "f_name"),
+            strings_of(records, "l_name"),
+            strings_of(records, "address"),
+            _column("I", [len(record["accounts"]) for record in records]),
+            _column("I", [len(record["services"]) for record in records])]
+        accounts = [
+            ids_of(account_records),
+            strings_of(account_records, "type"),
+            _column("q", [account["balance"] for account in account_records])]
+        services = [
+            ids_of(service_records),
+            _column("q", [service["limit"] for service in service_records]),
+            strings_of(service_records, "status"),
+            _column("q", [service["account"]["balance"] for service in service_records]),
+            strings_of(service_records, "account", "type")]
+
+        encoded = [value.encode() for value in strings]
+        offsets = _column("Q", accumulate((len(value) for value in encoded), initial=0))
+        remainder = json.dumps({key: value for key, value in data.items()
+                                if key != "customers"}).encode()
+
+        file.write(BINARY_HEADER.pack(cls.MAGIC, len(encoded), len(customers[0]),
+                                      len(accounts[0]), len(services[0]), len(remainder)))
+        file.write(_column_bytes(offsets))
+        file.write(b"".join(encoded))
+        for column in customers + accounts + services:
+            file.write(_column_bytes(column))
+        file.write(remainder)
+
+    @classmethod
+    def decode(cls, file):
+        """Reads data from file, a binary file object"""
+        content = memoryview(file.read())
+        _, string_count, customer_count, account_count, service_count, remainder_length = \
+            BINARY_HEADER.unpack_from(content, 0)
+        position = BINARY_HEADER.size
+
+        def read(typecode, count):
+            nonlocal position
+            column = _column(typecode)
+            column.frombytes(content[position:position + count * column.itemsize])
+            if SWAP:
+                column.byteswap()
+            position += count * column.itemsize
+            return column
+
+        offsets = read("Q", string_count + 1)
+        string_data = bytes(content[position:position + offsets[-1]])
+        strings = [str(string_data[start:end], "utf-8")
+                   for start, end in zip(offsets, offsets[1:])]
+        position += offsets[-1]
+        customers = [read(code, customer_count) for code in "qIIIII"]
+        accounts = [read(code, account_count) for code in "qIq"]
+        services = [read(code, service_count) for code in "qqIqI"]
+        data = json.loads(bytes(content[position:position + remainder_length]))
+        data["customers"] = BinaryRecords(strings, customers, accounts, services)
+        return data
+
+
+# codecs tried in order when reading, the first one matching the start of the file is used
+CODECS = (BinaryCodec, JsonCodec)
+
+
+def detect(head):
+    """Returns the codec of a file starting with head"""
+    return next(codec for codec in CODECS if codec.matches(head))
@@ -0,0 +1,153 @@
+import itertools
+from array import array
+
+from bank.money import cents
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _row(customer):
+    """
+    Returns (account balances, service balances, approved limits) of customer, a Customer or
+    its raw record
+    """
+    if isinstance(customer, dict):
+        services = customer["services"]
+        return ([cents(account["balance"]) for account in customer["accounts"]],
+                [cents(service["account"]["balance"]) for service in services],
+                [cents(service["limit"]) if service["status"] == "approved" else 0
+                 for service in services])
+    services = customer.services
+    return ([account.balance for account in customer.accounts],
+            [service.balance for service in services],
+            [service.limit if service.status == "approved" else 0 for service in services])
+
+
+class BalanceColumns:
+    """
+    Balances of all accounts and services of the customers held in contiguous int64 columns
+    of cents, with the number of accounts and services of each customer, so per customer and
+    bank wide sums are computed exactly in one pass over the columns. The columns are built
+    once, customers are appended to them, and changed or removed rows are replaced with update
+    in a single copy of the columns. Sums use numpy when it is installed, plain loops over the
+    arrays otherwise.
+    """
+    def __init__(self):
+        self.account_counts = array("q")
+        self.account_balances = array("q")
+        self.service_counts = array("q")
+        self.service_balances = array("q")
+        # limits of the services which are not approved are held as 0
+        self.approved_limits = array("q")
+
+    @classmethod
+    def build(cls, customers):
+        """
+        Builds columns for customers, a list of Customer objects or a LazyList.
+        Customers of a LazyList which were not built yet are read from their raw records.
+        """
+        columns = cls()
+        loaded = getattr(customers, "loaded", None)
+        for index in range(len(customers)):
+            customer = loaded(index) if loaded is not None else customers[index]
+            columns.append(customer if customer is not None else customers.record(index))
+        return columns
+
+    def __len__(self):
+        return len(self.account_counts)
+
+    def append(self, customer):
+        """Appends the row of customer, a Customer or its raw record"""
+        accounts, services, limits = _row(customer)
+        self.account_counts.append(len(accounts))
+        self.account_balances.extend(accounts)
+        self.service_counts.append(len(services))
+        self.service_balances.extend(services)
+        self.approved_limits.extend(limits)
+
+    def update(self, changes):
+        """
+        Replaces the rows of customers in one pass over the columns, changes being (index,
+        customer) pairs with customer a Customer, its raw record, or None to remove the row
+        """
+        changes = sorted(dict(changes).items())
+        if not changes:
+            return
+        columns = BalanceColumns()
+        previous = account_start = service_start = 0
+        for index, customer in changes + [(len(self), None)]:
+            # rows up to index are kept as they are
+            account_end = account_start + sum(self.account_counts[previous:index])
+            service_end = service_start + sum(self.service_counts[previous:index])
+            columns.account_counts.extend(self.account_counts[previous:index])
+            columns.account_balances.extend(self.account_balances[account_start:account_end])
+            columns.service_counts.extend(self.service_counts[previous:index])
+            columns.service_balances.extend(self.service_balances[service_start:service_end])
+            columns.approved_limits.extend(self.approved_limits[service_start:service_end])
+            if index == len(self):
+                break
+            if customer is not None:
+                columns.append(customer)
+            account_start = account_end + self.account_counts[index]
+            service_start = service_end + self.service_counts[index]
+            previous = index + 1
+        self.__dict__.update(columns.__dict__)
+
+    @staticmethod
+    def _per_customer(counts, values):
+        """Returns the sums of values for each customer, counts being the values each one has"""
+        if numpy is not None:
+            # views of the arrays, they must not outlive the call as arrays with views can
+            # not be resized
+            counts = numpy.asarray(memoryview(counts))
+            sums = numpy.zeros(len(values) + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.asarray(memoryview(values)), out=sums[1:])
+            ends = numpy.cumsum(counts)
+            return sums[ends] - sums[ends - counts]
+
+        sums = list(itertools.accumulate(values, initial=0))
+        totals = []
+        end = 0
+        for count in counts:
+            start, end = end, end + count
+            totals.append(sums[end] - sums[start])
+        return totals
+
+    def total_balances(self):
+        """Total balance of accounts and services of each customer, see Customer.total_balance"""
+        accounts = self._per_customer(self.account_counts, self.account_balances)
+        services = self._per_customer(self.service_counts, self.service_balances)
+        if numpy is not None:
+            return accounts + services
+        return [account + service for account, service in zip(accounts, services)]
+
+    def total_limits(self):
+        """Total limit of the approved services of each customer, see Customer.total_limit"""
+        return self._per_customer(self.service_counts, self.approved_limits)
+
+    def bank_totals(self):
+        """Returns bank wide sums as a dictionary"""
+        if numpy is not None:
+            balances = numpy.asarray(memoryview(self.account_balances))
+            deposits = int(balances[balances > 0].sum())
+            account_balance = int(balances.sum())
+            del balances
+            service_balance = int(numpy.asarray(memoryview(self.service_balances)).sum())
+            approved_limit = int(numpy.asarray(memoryview(self.approved_limits)).sum())
+        else:
+            deposits = sum(balance for balance in self.account_balances if balance > 0)
+            account_balance = sum(self.account_balances)
+            service_balance = sum(self.service_balances)
+            approved_limit = sum(self.approved_limits)
+        return {
+            "customers": len(self),
+            "accounts": len(self.account_balances),
+            "services": len(self.service_balances),
+            "account_balance": account_balance,
+            "deposits": deposits,
+            "service_balance": service_balance,
+            "approved_limit": approved_limit,
+        }
@@ -0,0 +1,83 @@
+import bz2
+import gzip
+import lzma
+
+
+class Compression:
+    """A compression format of the standard library, wrapping file objects in its module's file class"""
+    def __init__(self, name, magic, extension, levels, default_level, opener):
+        self.name = name
+        self.magic = magic
+        self.extension = extension
+        self.levels = levels
+        self.default_level = default_level
+        self._opener = opener
+
+    def matches(self, head):
+        """Returns True if head, the first bytes of a file, start data of this format"""
+        return head.startswith(self.magic)
+
+    def open(self, file, mode, level=None):
+        """
+        Wraps file, a binary file object, for reading (mode 'rb') or writing ('wb') compressed data.
+        Closing the returned object does not close file.
+        """
+        return self._opener(file, mode, self.level(level))
+
+    def level(self, level=None):
+        """Returns level, or the default level if it is None, raises ValueError if it is out of range"""
+        if level is None:
+            return self.default_level
+        if level not in self.levels:
+            raise ValueError("{0} level must be within {1}-{2}".format(
+                self.name, self.levels[0], self.levels[-1]))
+        return level
+
+
+COMPRESSIONS = {compression.name: compression for compression in (
+    Compression("gzip", b"\x1f\x8b", ".gz", range(0, 10), 6,
+                lambda file, mode, level: gzip.GzipFile(fileobj=file, mode=mode,
+                                                        compresslevel=level, mtime=0)),
+    Compression("bz2", b"BZh", ".bz2", range(1, 10), 9,
+                lambda file, mode, level: bz2.BZ2File(file, mode, compresslevel=level)),
+    Compression("lzma", b"\xfd7zXZ\x00", ".xz", range(0, 10), 6,
+                lambda file, mode, level: lzma.LZMAFile(
+                    file, mode, preset=level if mode.startswith("w") else None)),
+)}
+
+# name selecting uncompressed files where a compression may be given
+NONE = "none"
+
+
+def detect(head):
+    """Returns the compression of a file starting with head, None if it is not compressed"""
+    return next((compression for compression in COMPRESSIONS.values()
+                 if compression.matches(head)), None)
+
+
+def from_extension(path):
+    """Returns the compression implied by the extension of path, None for other extensions"""
+    return next((compression for compression in COMPRESSIONS.values()
+                 if path.endswith(compression.extension)), None)
+
+
+def parse_location(value):
+    """
+    Splits a store location given as path[:compression[:level]], e.g. bank.json:lzma:9,
+    into (path, compression name, level). Compression and level are None when not given.
+    """
+    path, compression, level = value, None, None
+    parts = value.rsplit(":", 2)
+    if len(parts) == 3 and parts[1] in COMPRESSIONS.keys() | {NONE}:
+        path, compression, level = parts
+        try:
+            level = int(level)
+        except ValueError as err:
+            raise ValueError("Invalid compression level {0}".format(level)) from err
+    elif len(parts) >= 2 and parts[-1] in COMPRESSIONS.keys() | {NONE}:
+        path, compression = value.rsplit(":", 1)
+    if compression == NONE and level is not None:
+        raise ValueError("Uncompressed files have no level")
+    if compression in COMPRESSIONS:
+        COMPRESSIONS[compression].level(level)
+    return path, compression, level
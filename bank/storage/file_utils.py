@@ -1,27 +1,118 @@
+import contextlib
+import io
 import logging
-import json
+import os
+
+from bank.storage.codecs import JsonCodec, BinaryCodec, MAGIC_LENGTH, detect
+from bank.storage.compression import COMPRESSIONS, NONE, from_extension
+from bank.storage.compression import detect as detect_compression
+from bank.storage.locking import FileLock
+
+# bytes collected before they are handed to a compressor
+WRITE_BUFFER_SIZE = 1 << 16
+
+
+def sync(file):
+    """Flushes file and waits until its content reached the disk"""
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def sync_directory(path):
+    """Waits until the directory entries of the directory containing path reached the disk"""
+    descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """
+    Opens a temporary file next to path for writing in binary mode, which replaces path once
+    the with block completed and its content is on disk. A crash or error part way through
+    leaves path as it was.
+    """
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            yield file
+            sync(file)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_path)
+        raise
+    sync_directory(path)
+
 
 class FileUtils:
-    """Class handling writing dicts to disk"""
-    def __init__(self, path):
+    """
+    Class handling writing dicts to disk.
+    Files are written with codec and read with whichever codec recognizes them.
+    Files are compressed with compression (a name of COMPRESSIONS, by default implied by the
+    extension of path, "none" for uncompressed files) at level, and compressed files of any
+    format are recognized when reading.
+    Writes replace the file atomically and return once the data is on disk.
+    """
+    codec = JsonCodec
+    # write_dict reads the customers of data once, in order, so they may be a generator
+    streaming = True
+    # whether compression can be chosen, False for formats which are read in place
+    compressible = True
+
+    def __init__(self, path, compression=None, level=None):
         self.path = path
+        self.lock = FileLock(path + ".lock")
+        if compression is None:
+            self.compression = from_extension(path)
+        else:
+            self.compression = None if compression == NONE else COMPRESSIONS[compression]
+        self.level = self.compression.level(level) if self.compression is not None else None
 
     def read_dict(self):
         """Reads file at self.path, returns dict"""
         try:
-            with open(self.path, 'r') as file:
-                data = json.load(file)
+            with open(self.path, 'rb') as file:
+                return self.read_file(file)
         except FileNotFoundError as err:
             logging.warning("File not found at %s", self.path)
             raise err
 
-        return data
+    @classmethod
+    def read_file(cls, file):
+        """Reads file, a binary file object of any codec and compression, returns dict"""
+        compression = detect_compression(file.read(MAGIC_LENGTH))
+        file.seek(0)
+        if compression is None:
+            return cls._decode(file)
+        with compression.open(file, 'rb') as stream:
+            return cls._decode(stream)
+
+    @staticmethod
+    def _decode(file):
+        codec = detect(file.read(MAGIC_LENGTH))
+        file.seek(0)
+        return codec.decode(file)
 
     def write_dict(self, data):
         """Writes contents of data to file at self.path"""
         try:
-            with open(self.path, 'w') as file:
-                json.dump(data, file)
+            with atomic_write(self.path) as file:
+                if self.compression is None:
+                    self.codec.encode(data, file)
+                else:
+                    with self.compression.open(file, 'wb', self.level) as stream:
+                        # compressors take a while per call, codecs write many small pieces
+                        buffered = io.BufferedWriter(stream, WRITE_BUFFER_SIZE)
+                        self.codec.encode(data, buffered)
+                        buffered.detach()
         except OSError as err:
             logging.critical("Unable to write to disk:%s", err)
             raise err
+
+
+class BinaryFileUtils(FileUtils):
+    """FileUtils variant writing the compact binary snapshot format"""
+    codec = BinaryCodec
@@ -0,0 +1,87 @@
+from bisect import bisect_left, insort
+
+
+class IdIndex:
+    """
+    Maps customer ids to their current position, so a customer is found by id without
+    scanning. Each customer keeps the slot it was added at, its position is its slot less
+    the removed slots before it, so removing a customer does not renumber later ones.
+    Kept up to date by Storage as customers are added and removed, and persisted as the
+    list of ids in customer order. Modifications are recorded in changes, see NameIndex.
+    """
+    OPERATIONS = ("add", "remove")
+    COMPACT_FRACTION = 8
+
+    def __init__(self, entries=()):
+        # slots only grow, so the dict is ordered by slot and by position
+        self._slots = {customer_id: slot for slot, customer_id in enumerate(entries)}
+        self._next_slot = len(self._slots)
+        self._removed = []
+        self.changes = []
+
+    @classmethod
+    def from_list(cls, entries):
+        """Creates index from the result of to_list"""
+        return cls(entries)
+
+    @classmethod
+    def build(cls, customers):
+        """
+        Creates index from all customers, a list of Customer objects or a LazyList.
+        Customers of a LazyList which were not built yet are read from their raw records.
+        """
+        loaded = getattr(customers, "loaded", None)
+        ids = []
+        for index in range(len(customers)):
+            customer = loaded(index) if loaded is not None else customers[index]
+            ids.append(customer.id if customer is not None else customers.record(index).get("id"))
+        return cls(ids)
+
+    @staticmethod
+    def changes_added(customers):
+        """Changes recording the ids of customers appended after all others, (id, customer) pairs"""
+        return [["add", [customer_id for customer_id, _ in customers]]]
+
+    @staticmethod
+    def changes_removed(customer_id, _):
+        """Changes forgetting a removed customer"""
+        return [["remove", customer_id]]
+
+    def apply(self, change):
+        """Applies a change, a list of an operation and its arguments"""
+        if change[0] not in self.OPERATIONS:
+            raise ValueError("Unknown index operation {0}".format(change[0]))
+        getattr(self, change[0])(*change[1:])
+
+    def __len__(self):
+        return len(self._slots)
+
+    def position(self, customer_id):
+        """Returns position of the customer with customer_id, None if there is no such customer"""
+        slot = self._slots.get(customer_id)
+        if slot is None:
+            return None
+        return slot - bisect_left(self._removed, slot)
+
+    def add(self, customer_ids):
+        """Records the ids of customers appended after all others"""
+        for customer_id in customer_ids:
+            self._slots[customer_id] = self._next_slot
+            self._next_slot += 1
+        self.changes.append(["add", customer_ids])
+
+    def remove(self, customer_id):
+        """Forgets a removed customer, later customers move down by one"""
+        slot = self._slots.pop(customer_id, None)
+        if slot is not None:
+            insort(self._removed, slot)
+            # slots are given out again once many were removed, as by LazyList
+            if len(self._removed) * self.COMPACT_FRACTION > self._next_slot:
+                self._slots = {customer_id: slot for slot, customer_id in enumerate(self._slots)}
+                self._next_slot = len(self._slots)
+                self._removed = []
+        self.changes.append(["remove", customer_id])
+
+    def to_list(self):
+        """Serializes index to the list of ids in customer order"""
+        return list(self._slots)
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+
+from bank.storage.file_utils import atomic_write, sync, sync_directory
+
+# bytes an index log grows to, and past the size of its snapshot, before the index is
+# written out whole again
+COMPACT_BYTES = 1 << 20
+
+
+class IndexFiles:
+    """
+    Secondary indexes kept in directory next to the store rather than in it: per index a
+    snapshot <name>.json of its entries and a log <name>.log of the changes saved since, a
+    JSON line per save. The store holds a mark per index, [sequence number, log length],
+    naming the state it goes with: a reader only applies the log up to the length of its
+    mark, and a writer cuts the log back to its mark before appending, so changes written
+    before a crash or by a newer store than the one loaded are never applied.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _paths(self, name):
+        base = os.path.join(self.directory, name)
+        return base + ".json", base + ".log"
+
+    def read(self, name, mark):
+        """
+        Returns (entries, changes) of the index called name as of mark: the entries of its
+        snapshot and the changes to apply to them, or None if the files no longer hold that
+        state because the index was written out again since.
+        """
+        seq, length = mark
+        snapshot_path, log_path = self._paths(name)
+        try:
+            with open(snapshot_path, "rb") as file:
+                snapshot = json.load(file)
+            with open(log_path, "rb") as file:
+                content = file.read(length)
+        except (OSError, ValueError) as err:
+            logging.warning("Unable to read index %s:%s", name, err)
+            return None
+        if snapshot["seq"] > seq or len(content) != length:
+            return None
+
+        last, changes = snapshot["seq"], []
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return None
+            if not last < record["seq"] <= seq:
+                return None
+            last = record["seq"]
+            changes.extend(record["changes"])
+        return (snapshot["entries"], changes) if last == seq else None
+
+    def should_compact(self, name, mark):
+        """Returns True once the log of the index called name is due to be folded into its snapshot"""
+        snapshot_path, _ = self._paths(name)
+        try:
+            return mark[1] > max(COMPACT_BYTES, os.path.getsize(snapshot_path))
+        except OSError:
+            return True
+
+    def append(self, name, mark, changes):
+        """Appends changes to the log of the index called name, saved as of mark, returns the new mark"""
+        seq, length = mark
+        _, log_path = self._paths(name)
+        line = json.dumps({"seq": seq + 1, "changes": changes}).encode() + b"\n"
+        try:
+            with open(log_path, "r+b") as file:
+                file.truncate(length)
+                file.seek(length)
+                file.write(line)
+                sync(file)
+        except OSError as err:
+            logging.critical("Unable to write index %s:%s", name, err)
+            raise err
+        return [seq + 1, length + len(line)]
+
+    def write(self, name, mark, entries):
+        """
+        Writes entries as the snapshot of the index called name and empties its log, returns
+        the new mark. mark is the one the store holds, None if it has none.
+        """
+        seq = mark[0] + 1 if mark is not None else 1
+        snapshot_path, log_path = self._paths(name)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+                sync_directory(self.directory)
+            with atomic_write(snapshot_path) as file:
+                file.write(json.dumps({"seq": seq, "entries": entries}).encode())
+            with open(log_path, "wb") as file:
+                sync(file)
+        except OSError as err:
+            logging.critical("Unable to write index %s:%s", name, err)
+            raise err
+        return [seq, 0]
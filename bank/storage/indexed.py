@@ -0,0 +1,287 @@
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+from collections.abc import Sequence
+
+from bank.storage.compression import NONE
+from bank.storage.file_utils import FileUtils, atomic_write, sync
+from bank.storage.locking import ConcurrentModificationError
+
+MAGIC = b"BANKIDX\x02"
+# magic, table offset, entry count, table capacity (entries), bytes held by live records,
+# offset of the journal of table patches of the last save (0 if there is none)
+HEADER = struct.Struct("<8sQQQQQ")
+# files written before journals, their records were rewritten in place
+LEGACY_MAGIC = b"BANKIDX\x01"
+LEGACY_HEADER = struct.Struct("<8sQQQQ")
+# record offset, record length, space taken by the record
+ENTRY = struct.Struct("<QII")
+# journal: patch count, then per patch its offset into the table and length, and its bytes
+PATCH_COUNT = struct.Struct("<I")
+PATCH = struct.Struct("<QI")
+
+
+def _encode(data):
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _capacity(count):
+    """Table entries reserved for count records, leaves room to add some before the table moves"""
+    return count + max(32, count // 4)
+
+
+def _read_patches(view, offset):
+    """Returns the [(table offset, bytes)] patches of the journal at offset of view"""
+    count, = PATCH_COUNT.unpack_from(view, offset)
+    offset += PATCH_COUNT.size
+    patches = []
+    for _ in range(count):
+        start, length = PATCH.unpack_from(view, offset)
+        offset += PATCH.size
+        patches.append((start, bytes(view[offset:offset + length])))
+        offset += length
+    return patches
+
+
+class IndexedRecords(Sequence):
+    """
+    Read only view of the customer records of an indexed file, decodes a record per access.
+    Records are rewritten in place, so each is read holding the shared lock, and only while
+    nobody but this process wrote the file since it was loaded.
+    """
+    def __init__(self, view, table, lock):
+        self._view = view
+        self._table = table
+        self._lock = lock
+        self._fetched = {}
+
+    def __len__(self):
+        return len(self._table) // ENTRY.size - 1
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        record = self._fetched.pop(index, None)
+        if record is None:
+            with self._lock.hold() as lock:
+                record = self._read(lock, index)
+        return json.loads(record)
+
+    def _read(self, lock, index):
+        if lock.generation() != lock.seen:
+            raise ConcurrentModificationError("Records were modified since they were loaded")
+        offset, length, _ = ENTRY.unpack_from(self._table, (index + 1) * ENTRY.size)
+        return self._view[offset:offset + length]
+
+    def prefetch(self, indexes):
+        """Copies the records at indexes holding the lock once, they are decoded on access"""
+        with self._lock.hold() as lock:
+            for index in indexes:
+                if 0 <= index < len(self):
+                    self._fetched[index] = self._read(lock, index)
+
+
+class IndexedFileUtils(FileUtils):
+    """
+    Stores one JSON record per customer plus a table of record offsets.
+    Records are read through mmap on demand, and on save modified records are appended,
+    so a command touching one customer reads and writes one record.
+    Entry 0 of the table holds everything but the customers (employees, globals and indexes).
+    A save commits by rewriting the header: records and a journal of the table entries to
+    update are appended and synced first, the header then names the journal, and the entries
+    are copied into the table last. Readers apply the journal the header names, so a crash
+    leaves the old or the new state and records are never overwritten.
+    A JSON document (or an empty file) is read as well, it is converted on the first save.
+    Records are read in place, so the file is never compressed.
+    """
+    compressible = False
+
+    def __init__(self, path):
+        super().__init__(path, NONE)
+        self._table = None
+        self._table_offset = 0
+        self._capacity = 0
+        self._live = 0
+        self._meta = None
+        self._legacy = False
+        self._patches = []  # of the journal the header names
+
+    def read_dict(self):
+        """Reads the file at self.path, customer records are returned as a lazy sequence"""
+        try:
+            with open(self.path, 'rb') as file:
+                magic = file.read(len(MAGIC))
+                if magic not in (MAGIC, LEGACY_MAGIC):
+                    self._table = None
+                    return super().read_dict() if magic.strip() else {}
+                view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError as err:
+            logging.warning("File not found at %s", self.path)
+            raise err
+
+        self._legacy = magic == LEGACY_MAGIC
+        if self._legacy:
+            _, self._table_offset, count, self._capacity, self._live = \
+                LEGACY_HEADER.unpack_from(view, 0)
+            journal = 0
+        else:
+            _, self._table_offset, count, self._capacity, self._live, journal = \
+                HEADER.unpack_from(view, 0)
+        self._table = bytearray(view[self._table_offset:self._table_offset + count * ENTRY.size])
+        self._patches = _read_patches(view, journal) if journal else []
+        # the patches may not have been copied into the table before a crash
+        for start, patch in self._patches:
+            self._table[start:start + len(patch)] = patch
+        table = bytes(self._table)
+
+        offset, length, _ = ENTRY.unpack_from(table, 0)
+        self._meta = json.loads(view[offset:offset + length])
+        return dict(self._meta, customers=IndexedRecords(view, table, self.lock))
+
+    def should_compact(self):
+        """Returns True if the file was not written in the current indexed format or is mostly garbage"""
+        if self._table is None or self._legacy:
+            return True
+        garbage = os.path.getsize(self.path) - HEADER.size - self._capacity * ENTRY.size - self._live
+        return garbage > max(self._live, 1 << 20)
+
+    def _header(self, journal=0):
+        return HEADER.pack(MAGIC, self._table_offset, len(self._table) // ENTRY.size,
+                           self._capacity, self._live, journal)
+
+    def write_dict(self, data):
+        """Writes all records and a fresh table to a new file which replaces self.path"""
+        meta = {key: value for key, value in data.items() if key != "customers"}
+        self._table = bytearray()
+        self._live = 0
+        # the employees are modified in place by write_changes, the caller's list is not
+        self._meta = dict(meta, employees=list(meta["employees"]))
+        self._legacy = False
+        self._patches = []
+
+        try:
+            with atomic_write(self.path) as file:
+                file.write(bytes(HEADER.size))
+                for record in itertools.chain([meta], data["customers"]):
+                    encoded = _encode(record)
+                    self._table += ENTRY.pack(file.tell(), len(encoded), len(encoded))
+                    file.write(encoded)
+                    self._live += len(encoded)
+                self._capacity = _capacity(len(self._table) // ENTRY.size)
+                self._table_offset = file.tell()
+                file.write(self._table.ljust(self._capacity * ENTRY.size, b"\0"))
+                file.seek(0)
+                file.write(self._header())
+        except OSError as err:
+            logging.critical("Unable to write to disk:%s", err)
+            raise err
+
+    def write_changes(self, records):
+        """
+        Applies change records, appending the affected records and a journal of the table
+        entries to update, then commits them by pointing the header at the journal
+        """
+        try:
+            with open(self.path, 'r+b') as file:
+                # the last save copied its patches into the table unsynced, they are
+                # synced with this save's records before its header stops naming them
+                self._patch_table(file, self._patches)
+                journal, patches = self._write_changes(file, records)
+                sync(file)
+                file.seek(0)
+                file.write(self._header(journal))
+                sync(file)
+                self._patches = patches
+                self._patch_table(file, patches)
+        except OSError as err:
+            logging.critical("Unable to write to disk:%s", err)
+            raise err
+
+    def _patch_table(self, file, patches):
+        for start, patch in patches:
+            file.seek(self._table_offset + start)
+            file.write(patch)
+
+    def _write_changes(self, file, records):
+        """Appends records and the journal, returns (journal offset, patches of the journal)"""
+        end = file.seek(0, os.SEEK_END)
+        first_moved = None  # entries from here on shifted position
+        changed = set()     # entries which point to a new record
+        meta_modified = False
+
+        def put(entry_index, data):
+            nonlocal end
+            encoded = _encode(data)
+            if entry_index < len(self._table) // ENTRY.size:
+                self._live -= ENTRY.unpack_from(self._table, entry_index * ENTRY.size)[2]
+            else:
+                self._table += bytes(ENTRY.size)
+            file.seek(end)
+            file.write(encoded)
+            ENTRY.pack_into(self._table, entry_index * ENTRY.size, end, len(encoded), len(encoded))
+            end += len(encoded)
+            self._live += len(encoded)
+
+        for record in records:
+            if record["op"] == "replace":
+                self._meta[record["table"]] = record["data"]
+                meta_modified = True
+                continue
+            if record["table"] == "employees":
+                employees = self._meta["employees"]
+                if record["op"] == "append":
+                    employees.append(record["data"])
+                elif record["op"] == "update":
+                    employees[record["index"]] = record["data"]
+                else:
+                    del employees[record["index"]]
+                meta_modified = True
+                continue
+            if record["op"] == "append":
+                entry_index = len(self._table) // ENTRY.size
+                put(entry_index, record["data"])
+                first_moved = entry_index if first_moved is None else first_moved
+            elif record["op"] == "update":
+                entry_index = record["index"] + 1
+                put(entry_index, record["data"])
+                changed.add(entry_index)
+            elif record["op"] == "delete":
+                entry_index = record["index"] + 1
+                start = entry_index * ENTRY.size
+                self._live -= ENTRY.unpack_from(self._table, start)[2]
+                del self._table[start:start + ENTRY.size]
+                first_moved = entry_index if first_moved is None else min(first_moved, entry_index)
+            else:
+                raise ValueError("Unknown change operation {0}".format(record["op"]))
+
+        if meta_modified:
+            put(0, self._meta)
+            changed.add(0)
+
+        count = len(self._table) // ENTRY.size
+        if count > self._capacity:
+            # the table outgrew its reserved space, it is written whole to free space
+            self._capacity = _capacity(count)
+            self._table_offset = end
+            file.seek(self._table_offset)
+            file.write(self._table.ljust(self._capacity * ENTRY.size, b"\0"))
+            return 0, []
+
+        patches = []
+        if first_moved is not None:
+            patches.append((first_moved * ENTRY.size, bytes(self._table[first_moved * ENTRY.size:])))
+        for entry_index in sorted(changed):
+            if first_moved is None or entry_index < first_moved:
+                start = entry_index * ENTRY.size
+                patches.append((start, bytes(self._table[start:start + ENTRY.size])))
+        if not patches:
+            return 0, []
+        file.seek(end)
+        file.write(PATCH_COUNT.pack(len(patches)))
+        for start, patch in patches:
+            file.write(PATCH.pack(start, len(patch)))
+            file.write(patch)
+        return end, patches
@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+
+from bank.storage.file_utils import FileUtils, sync
+
+
+class JournalFileUtils(FileUtils):
+    """
+    FileUtils variant which appends changes to a journal next to the snapshot.
+    The snapshot is only rewritten once the journal grows past compact_after records.
+    The snapshot may be compressed, the journal is not.
+    """
+    def __init__(self, path, compact_after=1000, compression=None, level=None):
+        super().__init__(path, compression, level)
+        self.journal_path = path + ".journal"
+        self.compact_after = compact_after
+        self.journal_length = 0
+        self.seq = 0
+
+    def read_dict(self):
+        """Reads snapshot at self.path, returns dict"""
+        data = super().read_dict()
+        self.seq = data.pop("journal_seq", 0)
+        self.journal_length = 0
+        return data
+
+    def read_records(self):
+        """Yields journal records which are newer than the snapshot"""
+        try:
+            file = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return
+
+        offset = 0
+        with file:
+            for line in file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning("Discarding truncated journal record at %s:%s",
+                                    self.journal_path, offset)
+                    os.truncate(self.journal_path, offset)
+                    break
+                offset += len(line)
+                self.journal_length += 1
+                if record["seq"] > self.seq:
+                    self.seq = record["seq"]
+                    yield record
+
+    def write_changes(self, records):
+        """Appends records to the journal, numbering them sequentially"""
+        if not records:
+            return
+
+        lines = []
+        for record in records:
+            self.seq += 1
+            lines.append(json.dumps(dict(record, seq=self.seq)) + "\n")
+
+        try:
+            with open(self.journal_path, 'a') as file:
+                file.writelines(lines)
+                sync(file)
+        except OSError as err:
+            logging.critical("Unable to write to disk:%s", err)
+            raise err
+        self.journal_length += len(lines)
+
+    def should_compact(self):
+        """Returns True once the journal is long enough to be folded into the snapshot"""
+        return self.journal_length >= self.compact_after
+
+    def write_dict(self, data):
+        """Writes a full snapshot and empties the journal"""
+        super().write_dict(dict(data, journal_seq=self.seq))
+        try:
+            with open(self.journal_path, 'w'):
+                pass
+        except OSError as err:
+            logging.critical("Unable to write to disk:%s", err)
+            raise err
+        self.journal_length = 0
@@ -0,0 +1,210 @@
+from bisect import bisect_right, insort
+from collections.abc import MutableSequence, Sequence
+
+# record of a slot whose item was removed
+REMOVED = object()
+
+
+class LazyList(MutableSequence):
+    """
+    List of objects built from raw records on first access.
+    Keeps the raw record of each item so unmodified items never need to be serialized again,
+    and reports modifications through on_change(operation, index, item), see TrackedList.
+    The item of a "delete" is the removed item, or its raw record if it was never built.
+    records may be any sequence, if it is not a list records are only read from it on demand.
+    Items are held in slots, removing an item only marks its slot as removed rather than
+    moving every later item, positions skip the removed slots. The slots are compacted once
+    more than a COMPACT_FRACTION of them were removed.
+    """
+    COMPACT_FRACTION = 8
+
+    def __init__(self, records, factory, on_change=None):
+        if isinstance(records, list):
+            self._source = None
+            self._records = list(records)
+        else:
+            # positions into self._source stand in for records which were not read yet
+            self._source = records
+            self._records = list(range(len(records)))
+        self._items = [None] * len(self._records)
+        # sorted slots of removed items, and the last (index, slot) found among them
+        self._removed = []
+        self._last = (0, 0)
+        self._factory = factory
+        self._on_change = on_change
+        self.dirty = False
+
+    @classmethod
+    def from_items(cls, items, factory, on_change=None):
+        """Creates instance holding already built items without raw records"""
+        lazy_list = cls([None] * len(items), factory, on_change)
+        lazy_list._items = list(items)
+        return lazy_list
+
+    def __len__(self):
+        return len(self._records) - len(self._removed)
+
+    def _slot(self, index):
+        """Returns the slot of the item at index, 0 <= index < len(self)"""
+        removed = self._removed
+        if not removed or index < removed[0]:
+            return index
+        # the slot is index plus the removed slots up to it, which it is approached from
+        # below, starting after the last slot found when reading on from there
+        last_index, last_slot = self._last
+        slot = last_slot + index - last_index if index >= last_index else index
+        while True:
+            next_slot = index + bisect_right(removed, slot)
+            if next_slot == slot:
+                self._last = (index, slot)
+                return slot
+            slot = next_slot
+
+    def _slots(self):
+        """Yields the slots of all items in order"""
+        records = self._records
+        for slot in range(len(records)):
+            if records[slot] is not REMOVED:
+                yield slot
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("list index out of range")
+        return self._item(self._slot(index))
+
+    def _item(self, slot):
+        item = self._items[slot]
+        if item is None:
+            item = self._factory(self._record(slot))
+            self._items[slot] = item
+        return item
+
+    def __iter__(self):
+        for slot in self._slots():
+            yield self._item(slot)
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "LazyList({0} items, {1} loaded)".format(
+            len(self), sum(item is not None for item in self._items))
+
+    def __setitem__(self, index, item):
+        items = self[:]
+        items[index] = item
+        self._records = [None] * len(items)
+        self._items = items
+        self._removed = []
+        self._last = (0, 0)
+        self._changed("reset")
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            self._compact()
+            del self._records[index]
+            del self._items[index]
+            self._changed("reset")
+            return
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("list assignment index out of range")
+        slot = self._slot(index)
+        removed = self._items[slot]
+        if removed is None:
+            removed = self._record(slot)
+        self._records[slot] = REMOVED
+        self._items[slot] = None
+        insort(self._removed, slot)
+        self._last = (0, 0)
+        if len(self._removed) * self.COMPACT_FRACTION > len(self._records):
+            self._compact()
+        self._changed("delete", index, removed)
+
+    def _compact(self):
+        """Drops the slots of removed items"""
+        if self._removed:
+            slots = list(self._slots())
+            self._records = [self._records[slot] for slot in slots]
+            self._items = [self._items[slot] for slot in slots]
+            self._removed = []
+            self._last = (0, 0)
+
+    def insert(self, index, item):
+        append = index >= len(self)
+        if not append:
+            self._compact()
+        self._records.insert(len(self._records) if append else index, None)
+        self._items.insert(len(self._items) if append else index, item)
+        if append:
+            self._changed("append", len(self) - 1, item)
+        else:
+            self._changed("reset")
+
+    def append(self, item):
+        self.insert(len(self), item)
+
+    def _changed(self, operation, index=None, item=None):
+        self.dirty = True
+        if self._on_change is not None:
+            self._on_change(operation, index, item)
+
+    def mark_clean(self):
+        """Forget about modifications to the list itself made so far"""
+        self.dirty = False
+
+    def loaded(self, index):
+        """Returns the item at index if it was already built, otherwise None"""
+        return self._items[self._slot(index)]
+
+    def modified(self):
+        """Yields (index, item) for loaded items which are dirty or were never serialized"""
+        items, records = self._items, self._records
+        for index, slot in enumerate(self._slots()):
+            item = items[slot]
+            if item is not None and (item.dirty or records[slot] is None):
+                yield index, item
+
+    def record(self, index):
+        """Returns raw record of the item at index"""
+        return self._record(self._slot(index))
+
+    def _record(self, slot):
+        record = self._records[slot]
+        if isinstance(record, int):
+            record = self._source[record]
+        return record
+
+    def prefetch(self, indexes):
+        """Has the source read the records at indexes ahead of access, if it can read in bulk"""
+        prefetch = getattr(self._source, "prefetch", None)
+        if prefetch is not None:
+            records = [self._records[self._slot(index)] for index in indexes]
+            prefetch([record for record in records if isinstance(record, int)])
+
+    def set_record(self, index, record):
+        """Replaces raw record of the item at index, e.g. after it was serialized"""
+        self._records[self._slot(index)] = record
+
+    def records(self):
+        """Returns all raw records, every loaded item must have been serialized beforehand"""
+        self._compact()
+        if self._source is not None:
+            self._records = [self._record(slot) for slot in range(len(self._records))]
+            self._source = None
+        return self._records
+
+    def iter_records(self):
+        """
+        Yields all raw records one at a time, every loaded item must have been serialized
+        beforehand. Records read from the source are not kept.
+        """
+        for slot in self._slots():
+            yield self._record(slot)
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import struct
+
+from bank.storage.file_utils import sync, sync_directory
+
+# a run of consecutive entries of one id in a segment: id, sequence number of its first
+# entry, entry count, time of its last entry, segment number, offset and length of its
+# lines, balance before its first entry
+RUN = struct.Struct("<qQIdIQIq")
+# entries of one id a run covers at most, so a statement reads little before its first entry
+CHECKPOINT_INTERVAL = 64
+# files the runs are spread over by id, a statement only reads the file of its id
+CHECKPOINT_BUCKETS = 64
+# bytes a segment grows to before the next one is started
+SEGMENT_BYTES = 64 << 20
+# a line of the log, formatted directly as json.dumps of each entry dominated large appends
+ENTRY = '{{"id": {0:d}, "seq": {1:d}, "time": {2!r}, "kind": {3}, "amount": {4:d}, "balance": {5:d}}}\n'
+
+
+class Run:
+    """Location of a run of entries of one id, see RUN"""
+    __slots__ = ("item_id", "seq", "count", "time", "segment", "offset", "length", "opening")
+
+    def __init__(self, item_id, seq, count, time, segment, offset, length, opening):
+        self.item_id = item_id
+        self.seq = seq
+        self.count = count
+        self.time = time
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.opening = opening
+
+    @property
+    def last_seq(self):
+        """Sequence number of the last entry of the run"""
+        return self.seq + self.count - 1
+
+
+class Ledger:
+    """
+    Append-only transaction history of every account and service, kept in directory next to
+    the store rather than in it. Entries of all ids are appended as JSON lines to one log,
+    split into segments of about SEGMENT_BYTES, and numbered from 1 per id.
+    The entries of an id written by one append are consecutive, each run of up to
+    CHECKPOINT_INTERVAL of them is recorded in a checkpoint file together with its sequence
+    numbers, location and opening balance, so a statement reads only the runs of its page.
+    Neither the log nor the checkpoint files are ever overwritten, a line or record a crash
+    cut short is left behind and never referred to. Runs are recorded once their lines are
+    on disk, and only used when the lines hold the entries they name.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, "{0:06d}.log".format(segment))
+
+    def _bucket_path(self, bucket):
+        return os.path.join(self.directory, "checkpoints-{0:02d}".format(bucket))
+
+    def _last_segment(self):
+        """Returns the number of the segment appends go to, 0 if there is none"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        return max((int(name[:-4]) for name in names
+                    if name.endswith(".log") and name[:-4].isdigit()), default=0)
+
+    def _runs(self, bucket, item_ids=None):
+        """Returns {id: [Run]} of the runs recorded in bucket, of item_ids if given, in order"""
+        try:
+            with open(self._bucket_path(bucket), "rb") as file:
+                content = file.read()
+        except FileNotFoundError:
+            return {}
+        # a record cut short by a crash is ignored, and dropped by the next append
+        content = content[:len(content) - len(content) % RUN.size]
+        runs = {}
+        for fields in RUN.iter_unpack(content):
+            if item_ids is None or fields[0] in item_ids:
+                runs.setdefault(fields[0], []).append(Run(*fields))
+        return runs
+
+    def _read_run(self, run):
+        """Returns the entries of run, or None if its lines do not hold them"""
+        try:
+            with open(self._segment_path(run.segment), "rb") as segment:
+                content = os.pread(segment.fileno(), run.length, run.offset)
+        except FileNotFoundError:
+            return None
+        lines = content.split(b"\n")
+        if len(lines) != run.count + 1 or lines[-1]:
+            return None
+        entries = []
+        for seq, line in enumerate(lines[:-1], run.seq):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                return None
+            if entry.pop("id", None) != run.item_id or entry.get("seq") != seq:
+                return None
+            entries.append(entry)
+        return entries
+
+    def append(self, transactions):
+        """
+        Appends transactions, a dict of id to lists of (time, kind, amount, balance) tuples.
+        The entries are written to the log before their runs are recorded, and only the
+        segment and the checkpoint files written to are synced.
+        """
+        if not transactions:
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+                sync_directory(self.directory)
+            segment = max(self._last_segment(), 1)
+            segment_path = self._segment_path(segment)
+            created = not os.path.exists(segment_path)
+            if not created and os.path.getsize(segment_path) >= SEGMENT_BYTES:
+                segment += 1
+                segment_path = self._segment_path(segment)
+                created = True
+
+            with open(segment_path, "ab") as log:
+                offset = log.tell()
+                lines, runs = self._encode(transactions, segment, offset)
+                log.write(b"".join(lines))
+                sync(log)
+            if created:
+                sync_directory(segment_path)
+
+            by_bucket = {}
+            for item_id, run in runs:
+                by_bucket.setdefault(item_id % CHECKPOINT_BUCKETS, []).append(run)
+            for bucket, bucket_runs in by_bucket.items():
+                self._write_runs(bucket, bucket_runs)
+        except OSError as err:
+            logging.critical("Unable to write to ledger at %s:%s", self.directory, err)
+            raise err
+
+    def _tails(self, item_ids):
+        """Returns {id: (sequence number, time)} of the last entries of those of item_ids with any"""
+        buckets = {}
+        for item_id in item_ids:
+            buckets.setdefault(item_id % CHECKPOINT_BUCKETS, set()).add(item_id)
+        tails = {}
+        for bucket, wanted in buckets.items():
+            try:
+                with open(self._bucket_path(bucket), "rb") as file:
+                    content = file.read()
+            except FileNotFoundError:
+                continue
+            content = content[:len(content) - len(content) % RUN.size]
+            # runs are only recorded once their lines are on disk, so the last one is complete;
+            # only the fields needed are kept, an append of a whole day reads every bucket
+            for item_id, seq, count, last_time, *_ in RUN.iter_unpack(content):
+                if item_id in wanted:
+                    tails[item_id] = seq + count - 1, last_time
+        return tails
+
+    def _encode(self, transactions, segment, offset):
+        """
+        Returns (lines, runs) of the entries of transactions written at offset of segment,
+        runs being (id, packed RUN) pairs
+        """
+        tails = self._tails(transactions)
+        kinds = {}
+        lines, runs = [], []
+        for item_id, entries in transactions.items():
+            seq, last_time = tails.get(item_id, (0, 0.))
+            for start in range(0, len(entries), CHECKPOINT_INTERVAL):
+                chunk = entries[start:start + CHECKPOINT_INTERVAL]
+                run_offset = offset
+                opening = chunk[0][3] - chunk[0][2]
+                for entry_time, kind, amount, balance in chunk:
+                    seq += 1
+                    # times never go backwards, so statements can search the log by time
+                    last_time = max(entry_time, last_time)
+                    encoded_kind = kinds.get(kind)
+                    if encoded_kind is None:
+                        encoded_kind = kinds[kind] = json.dumps(kind)
+                    line = ENTRY.format(item_id, seq, last_time, encoded_kind, amount,
+                                        balance).encode()
+                    lines.append(line)
+                    offset += len(line)
+                runs.append((item_id, RUN.pack(item_id, seq - len(chunk) + 1, len(chunk),
+                                               last_time, segment, run_offset,
+                                               offset - run_offset, opening)))
+        return lines, runs
+
+    def _write_runs(self, bucket, runs):
+        """Appends runs, packed RUN records, to the checkpoint file of bucket"""
+        path = self._bucket_path(bucket)
+        created = not os.path.exists(path)
+        with open(path, "ab") as file:
+            size = file.tell()
+            if size % RUN.size:
+                # a record cut short by a crash
+                file.truncate(size - size % RUN.size)
+            file.write(b"".join(runs))
+            sync(file)
+        if created:
+            sync_directory(path)
+
+    def statement(self, item_id, since_seq=None, since_time=None, limit=50):
+        """
+        Returns (opening balance, entries, next sequence number) for up to limit entries of
+        item_id, starting with sequence number since_seq or at time since_time (seconds since
+        the epoch), or with the first entry. Entries are dicts of seq, time, kind, amount and
+        balance. The next sequence number is None when there are no further entries.
+        The opening balance is None when there are no entries at all.
+        """
+        # the run recorded last wins where two start with the same entry
+        runs = {run.seq: run for run in
+                self._runs(item_id % CHECKPOINT_BUCKETS, {item_id}).get(item_id, [])}
+        runs = [runs[seq] for seq in sorted(runs)]
+        if not runs:
+            return None, [], None
+        # only the runs from the one holding the first entry of the page on are read
+        first = 0
+        for index, run in enumerate(runs):
+            if ((since_seq is not None and run.last_seq < since_seq)
+                    or (since_time is not None and run.time < since_time)):
+                first = index + 1
+        first = min(first, len(runs) - 1)
+
+        opening, entries, last_seq = None, [], 0
+        for run in runs[first:]:
+            run_entries = self._read_run(run)
+            if run_entries is None:
+                logging.warning("Ledger entries %s to %s of %s are damaged",
+                                run.seq, run.last_seq, item_id)
+                continue
+            if opening is None:
+                opening = run.opening
+            for entry in run_entries:
+                if entry["seq"] <= last_seq:
+                    continue
+                last_seq = entry["seq"]
+                if ((since_seq is not None and entry["seq"] < since_seq)
+                        or (since_time is not None and entry["time"] < since_time)):
+                    opening = entry["balance"]
+                elif len(entries) < limit:
+                    entries.append(entry)
+                else:
+                    return opening, entries, entry["seq"]
+        return opening, entries, None
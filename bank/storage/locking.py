@@ -0,0 +1,57 @@
+import contextlib
+import fcntl
+import os
+
+
+class ConcurrentModificationError(RuntimeError):
+    """Raised when saving data which was modified by someone else since it was loaded"""
+
+
+class FileLock:
+    """
+    Advisory lock on a file next to the data, shared by readers and exclusive for writers.
+    The lock file also holds the generation of the data, which is incremented by every write.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self.seen = None  # generation of the data this process last loaded or wrote
+
+    @contextlib.contextmanager
+    def hold(self, exclusive=False):
+        """Holds the lock for the duration of the with block, within a with block holding it already as well"""
+        if self._fd is not None:
+            yield self
+            return
+        # a raw descriptor, records of the indexed backend are each read holding the lock
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._fd = fd
+            try:
+                yield self
+            finally:
+                self._fd = None
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def generation(self):
+        """Returns the current generation, the lock must be held"""
+        content = os.pread(self._fd, 32, 0).strip()
+        return int(content) if content else 0
+
+    def observe(self):
+        """Returns the current generation and records it as seen, the lock must be held"""
+        self.seen = self.generation()
+        return self.seen
+
+    def bump(self):
+        """Increments and returns the generation, the lock must be held exclusively"""
+        generation = self.generation() + 1
+        content = str(generation).encode()
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, content, 0)
+        os.fsync(self._fd)
+        self.seen = generation
+        return generation
@@ -0,0 +1,114 @@
+from bisect import bisect_left, insort
+
+
+def _terms(f_name, l_name, address):
+    """Lower cased words of a customer's names and address"""
+    return {word for field in (f_name, l_name, address) for word in field.lower().split()}
+
+
+def terms_of(customer):
+    """Sorted terms of customer, a Customer object or its raw record"""
+    if isinstance(customer, dict):
+        return sorted(_terms(customer["f_name"], customer["l_name"], customer["address"]))
+    return sorted(_terms(customer.f_name, customer.l_name, customer.address))
+
+
+class NameIndex:
+    """
+    Sorted (term, customer_id) pairs over the words of each customer's first name,
+    last name and address, so customers are found by word prefixes with a binary search.
+    Kept up to date by Storage as customers are added and removed. Modifications are
+    recorded in changes, which apply replays on a copy read back from disk.
+    """
+    # operations of changes, see apply
+    OPERATIONS = ("add", "remove")
+
+    def __init__(self, entries=()):
+        self._entries = sorted((term, customer) for term, customer in entries)
+        self.changes = []
+
+    @classmethod
+    def from_list(cls, entries):
+        """Creates index from the result of to_list, which is sorted already"""
+        index = cls()
+        index._entries = [(term, customer) for term, customer in entries]
+        return index
+
+    @classmethod
+    def build(cls, customers):
+        """
+        Creates index from all customers, a list of Customer objects or a LazyList.
+        Customers of a LazyList which were not built yet are read from their raw records.
+        """
+        loaded = getattr(customers, "loaded", None)
+        entries = []
+        for index in range(len(customers)):
+            customer = loaded(index) if loaded is not None else customers[index]
+            if customer is None:
+                customer = customers.record(index)
+                customer_id = customer.get("id")
+            else:
+                customer_id = customer.id
+            entries.extend((term, customer_id) for term in terms_of(customer))
+        return cls(entries)
+
+    @staticmethod
+    def changes_added(customers):
+        """Changes adding the terms of customers, (id, Customer object or raw record) pairs"""
+        return [["add", [[customer_id, terms_of(customer)] for customer_id, customer in customers]]]
+
+    @staticmethod
+    def changes_removed(customer_id, customer):
+        """Changes dropping the terms of a removed customer, a Customer object or raw record"""
+        return [["remove", customer_id, terms_of(customer)]]
+
+    def apply(self, change):
+        """Applies a change, a list of an operation and its arguments"""
+        if change[0] not in self.OPERATIONS:
+            raise ValueError("Unknown index operation {0}".format(change[0]))
+        getattr(self, change[0])(*change[1:])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _prefixed(self, prefix):
+        """(start, end) positions of the entries whose term starts with prefix"""
+        after = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return bisect_left(self._entries, (prefix,)), bisect_left(self._entries, (after,))
+
+    def find(self, query):
+        """Ids of the customers having a term starting with each word of query, in no particular order"""
+        ranges = sorted((self._prefixed(word) for word in query.lower().split()),
+                        key=lambda bounds: bounds[1] - bounds[0])
+        customers = None
+        # intersect starting with the most selective word
+        for start, end in ranges:
+            matches = {customer for _, customer in self._entries[start:end]}
+            customers = matches if customers is None else customers & matches
+            if not customers:
+                return []
+        return list(customers) if customers is not None else []
+
+    def add(self, customers):
+        """Adds the terms of customers, [customer_id, terms] pairs"""
+        added = [(term, customer_id) for customer_id, terms in customers for term in terms]
+        if len(added) < 64:
+            for entry in added:
+                insort(self._entries, entry)
+        else:
+            # many terms at once are merged by a single sort
+            self._entries.extend(added)
+            self._entries.sort()
+        self.changes.append(["add", customers])
+
+    def remove(self, customer_id, terms):
+        """Drops the terms of a removed customer"""
+        for term in terms:
+            position = bisect_left(self._entries, (term, customer_id))
+            if position < len(self._entries) and self._entries[position] == (term, customer_id):
+                del self._entries[position]
+        self.changes.append(["remove", customer_id, terms])
+
+    def to_list(self):
+        """Serializes index to a list of [term, customer_id] pairs"""
+        return [list(entry) for entry in self._entries]
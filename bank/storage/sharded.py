@@ -0,0 +1,294 @@
+import bisect
+import json
+import logging
+import os
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+from bank.storage.compression import NONE
+from bank.storage.file_utils import FileUtils, atomic_write
+from bank.storage.locking import ConcurrentModificationError
+
+# customers a shard is filled with before the next one is started
+SHARD_SIZE = 10000
+
+
+class Shard:
+    """A shard file and its customer count, records are only held once they are needed"""
+    def __init__(self, file, count, records=None):
+        self.file = file
+        self.count = count
+        self.records = records
+        self.dirty = False
+
+
+def _starts(shards):
+    """Returns the index of the first customer of each shard, followed by the customer count"""
+    starts = [0]
+    for shard in shards:
+        starts.append(starts[-1] + shard.count)
+    return starts
+
+
+class ShardedRecords(Sequence):
+    """
+    Read only view of the customer records of the shards listed by a manifest, a shard is
+    read when one of its records is first accessed and then kept
+    """
+    def __init__(self, utils, shards):
+        self._utils = utils
+        self._files = [shard.file for shard in shards]
+        self._starts = _starts(shards)
+        self._records = {}
+        # shards which were replaced on disk before being read, see keep
+        self._open = {}
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        position = bisect.bisect_right(self._starts, index) - 1
+        return self._shard(position)[index - self._starts[position]]
+
+    def _shard(self, position):
+        records = self._records.get(position)
+        if records is None:
+            records = self._records[position] = self._read(self._files[position])
+        return records
+
+    def _read(self, file):
+        handle = self._open.pop(file, None)
+        if handle is None:
+            return self._utils.read_shard(file)
+        with handle:
+            return FileUtils.read_file(handle)["customers"]
+
+    def shard_records(self, file):
+        """Returns the records of file if it is one of the shards of this view, otherwise None"""
+        try:
+            return self._shard(self._files.index(file))
+        except ValueError:
+            return None
+
+    def keep(self, file):
+        """Keeps file open if its shard was not read yet, so it can be read after it is removed"""
+        if (file in self._files and self._files.index(file) not in self._records
+                and file not in self._open):
+            self._open[file] = open(self._utils.shard_path(file), 'rb')
+
+    def release(self, file):
+        """Closes file if it was kept open"""
+        handle = self._open.pop(file, None)
+        if handle is not None:
+            handle.close()
+
+    def prefetch(self, indexes):
+        """
+        Reads the shards holding the records at indexes which were not read yet, in parallel.
+        Reads and decompression overlap, decoding itself is held up by the GIL.
+        """
+        positions = {bisect.bisect_right(self._starts, index) - 1 for index in indexes}
+        positions = [position for position in positions if position not in self._records]
+        if len(positions) < 2:
+            return
+        with ThreadPoolExecutor(min(len(positions), os.cpu_count() or 1)) as executor:
+            for position, records in zip(positions, executor.map(
+                    self._read, [self._files[position] for position in positions])):
+                self._records[position] = records
+
+
+class ShardedFileUtils(FileUtils):
+    """
+    Stores customers in shard files of up to shard_size customers each, listed in order by
+    a manifest at path which also holds everything but the customers (employees, globals
+    and indexes). Shards are read when a customer in them is first accessed, and a save
+    only rewrites the shards it changed, splitting shards grown past twice shard_size and
+    merging shrunk ones into a neighbour.
+    Changed shards are written to new files in <path>.shards/ and the manifest is replaced
+    atomically, so a crash leaves the old or the new state; replaced files are removed after.
+    Shards are compressed with compression at level, the manifest never is.
+    A single store file (e.g. a JSON document) is read as well, it is split into shards on
+    the first save.
+    """
+    def __init__(self, path, shard_size=SHARD_SIZE, compression=None, level=None):
+        super().__init__(path, compression, level)
+        self.shard_size = shard_size
+        self.directory = path + ".shards"
+        self._shards = None
+        self._meta = None
+        self._view = None
+        self._next_shard = 1
+
+    def shard_path(self, file):
+        """Returns the path of the shard file called file"""
+        return os.path.join(self.directory, file)
+
+    def read_shard(self, file):
+        """Reads the customer records of the shard file called file"""
+        try:
+            return FileUtils(self.shard_path(file)).read_dict()["customers"]
+        except FileNotFoundError as err:
+            raise ConcurrentModificationError(
+                "Shard {0} was replaced since the manifest was read".format(file)) from err
+
+    def read_dict(self):
+        """Reads the manifest at self.path, customer records are returned as a lazy sequence"""
+        data = super().read_dict()
+        if "shards" not in data:
+            self._shards = None
+            return data
+
+        self._shards = [Shard(shard["file"], shard["count"]) for shard in data.pop("shards")]
+        self._next_shard = data.pop("next_shard")
+        self._meta = data
+        self._view = ShardedRecords(self, self._shards)
+        return dict(data, customers=self._view)
+
+    def should_compact(self):
+        """Returns True if the file was not written in the sharded format"""
+        return self._shards is None
+
+    def write_dict(self, data):
+        """Writes all customers to new shards and a manifest listing them"""
+        meta = {key: value for key, value in data.items() if key != "customers"}
+        shards = []
+        records = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for record in data["customers"]:
+                records.append(record)
+                if len(records) == self.shard_size:
+                    shards.append(self._write_shard(records))
+                    # written shards are read back when needed rather than kept
+                    shards[-1].records = None
+                    records = []
+            if records:
+                shards.append(self._write_shard(records))
+        except OSError as err:
+            logging.critical("Unable to write to disk:%s", err)
+            raise err
+        self._replace(shards, meta)
+
+    def write_changes(self, records):
+        """Applies change records, rewriting only the shards holding affected customers"""
+        shards = list(self._shards)
+        starts = None
+        for record in records:
+            if record["op"] == "replace":
+                self._meta[record["table"]] = record["data"]
+            elif record["table"] == "employees":
+                self._apply_employee(record)
+            elif record["op"] == "append":
+                if not shards or shards[-1].count >= self.shard_size:
+                    shards.append(Shard(None, 0, []))
+                self._modify(shards[-1]).append(record["data"])
+                shards[-1].count += 1
+                starts = None
+            elif record["op"] in ("update", "delete"):
+                if starts is None:
+                    starts = _starts(shards)
+                position = bisect.bisect_right(starts, record["index"]) - 1
+                shard = shards[position]
+                offset = record["index"] - starts[position]
+                if record["op"] == "update":
+                    self._modify(shard)[offset] = record["data"]
+                else:
+                    del self._modify(shard)[offset]
+                    shard.count -= 1
+                    starts = None
+            else:
+                raise ValueError("Unknown change operation {0}".format(record["op"]))
+
+        shards = self._rebalance(shards)
+        os.makedirs(self.directory, exist_ok=True)
+        shards = [self._write_shard(shard.records) if shard.dirty else shard for shard in shards]
+        self._replace(shards, self._meta)
+
+    def _modify(self, shard):
+        """Returns the records of shard for modification, a copy of those read from disk"""
+        if shard.records is None:
+            records = self._view.shard_records(shard.file) if self._view is not None else None
+            shard.records = list(records if records is not None else self.read_shard(shard.file))
+        shard.dirty = True
+        return shard.records
+
+    def _rebalance(self, shards):
+        """
+        Drops empty shards, splits changed shards of more than twice shard_size customers and
+        merges changed shards of less than a quarter of shard_size into a neighbour with room
+        """
+        result = []
+        for shard in shards:
+            if shard.dirty and shard.count > 2 * self.shard_size:
+                pieces = -(-shard.count // self.shard_size)
+                size = -(-shard.count // pieces)
+                for start in range(0, shard.count, size):
+                    piece = shard.records[start:start + size]
+                    result.append(Shard(None, len(piece), piece))
+                    result[-1].dirty = True
+            elif shard.count:
+                result.append(shard)
+
+        merged = []
+        for shard in result:
+            previous = merged[-1] if merged else None
+            if (previous is not None and (shard.dirty or previous.dirty)
+                    and min(shard.count, previous.count) < self.shard_size // 4
+                    and previous.count + shard.count <= self.shard_size):
+                self._modify(previous).extend(self._modify(shard))
+                previous.count += shard.count
+            else:
+                merged.append(shard)
+        return merged
+
+    def _write_shard(self, records):
+        """Writes records to a new shard file, returns its Shard"""
+        file = "{0:06d}.json{1}".format(
+            self._next_shard, self.compression.extension if self.compression else "")
+        self._next_shard += 1
+        FileUtils(self.shard_path(file), self.compression.name if self.compression else NONE,
+                  self.level).write_dict({"customers": records})
+        return Shard(file, len(records), records)
+
+    def _replace(self, shards, meta):
+        """Writes a manifest listing shards, then removes shard files which are no longer listed"""
+        manifest = dict(meta, shards=[{"file": shard.file, "count": shard.count}
+                                      for shard in shards],
+                        next_shard=self._next_shard)
+        try:
+            with atomic_write(self.path) as file:
+                file.write(json.dumps(manifest).encode())
+
+            listed = {shard.file for shard in shards}
+            for file in os.listdir(self.directory):
+                if file not in listed:
+                    if self._view is not None:
+                        self._view.keep(file)
+                    try:
+                        os.unlink(self.shard_path(file))
+                    except OSError:
+                        # the file is still there to be read, the handle is not needed
+                        if self._view is not None:
+                            self._view.release(file)
+                        raise
+        except OSError as err:
+            logging.critical("Unable to write to disk:%s", err)
+            raise err
+        self._shards = shards
+        # the employees are modified in place by write_changes, the caller's list is not
+        self._meta = dict(meta)
+        if "employees" in meta:
+            self._meta["employees"] = list(meta["employees"])
+
+    def _apply_employee(self, record):
+        employees = self._meta.setdefault("employees", [])
+        if record["op"] == "append":
+            employees.append(record["data"])
+        elif record["op"] == "update":
+            employees[record["index"]] = record["data"]
+        elif record["op"] == "delete":
+            del employees[record["index"]]
+        else:
+            raise ValueError("Unknown change operation {0}".format(record["op"]))
@@ -0,0 +1,303 @@
+import json
+import logging
+import sqlite3
+from collections.abc import Sequence
+
+from bank.storage.locking import ConcurrentModificationError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id INTEGER PRIMARY KEY,
+    f_name TEXT NOT NULL,
+    l_name TEXT NOT NULL,
+    address TEXT NOT NULL,
+    uid INTEGER
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL REFERENCES customers(id),
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    balance INTEGER NOT NULL,
+    uid INTEGER
+);
+CREATE INDEX IF NOT EXISTS accounts_customer ON accounts(customer_id, position);
+CREATE TABLE IF NOT EXISTS services (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL REFERENCES customers(id),
+    position INTEGER NOT NULL,
+    "limit" INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    balance INTEGER NOT NULL,
+    uid INTEGER
+);
+CREATE INDEX IF NOT EXISTS services_customer ON services(customer_id, position);
+CREATE TABLE IF NOT EXISTS employees (
+    id INTEGER PRIMARY KEY,
+    f_name TEXT NOT NULL,
+    l_name TEXT NOT NULL,
+    uid INTEGER
+);
+CREATE TABLE IF NOT EXISTS globals (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS indexes (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# tables which gained the uid column (Storage ids) after databases were first created
+UID_TABLES = ("customers", "accounts", "services", "employees")
+
+
+def _with_id(record, uid):
+    """Adds the Storage id to record if it has one"""
+    if uid is not None:
+        record["id"] = uid
+    return record
+
+
+class SqliteRecords(Sequence):
+    """Customer records of a database, each access reads one customer with its accounts and services"""
+    def __init__(self, utils, ids):
+        self._utils = utils
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        return self._utils.read_customer(self._ids[index])
+
+
+class SqliteUtils:
+    """
+    Class storing customers, accounts, services and employees in an sqlite database.
+    Customers are read one at a time when first accessed and changes are written as
+    row level statements within a single transaction.
+    Every write increments the generation held in PRAGMA user_version, and a write whose
+    generation is out of date raises ConcurrentModificationError, see FileLock.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._customer_ids = []
+        self._employee_ids = []
+        self._generation = None
+
+    @property
+    def connection(self):
+        """Connection to the database, created with the schema on first use"""
+        if self._connection is None:
+            try:
+                self._connection = sqlite3.connect(self.path)
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.executescript(SCHEMA)
+                for table in UID_TABLES:
+                    columns = [row[1] for row in
+                               self._connection.execute("PRAGMA table_info({0})".format(table))]
+                    if "uid" not in columns:
+                        self._connection.execute(
+                            "ALTER TABLE {0} ADD COLUMN uid INTEGER".format(table))
+            except sqlite3.Error as err:
+                logging.critical("Unable to open database at %s:%s", self.path, err)
+                raise err
+        return self._connection
+
+    def read_dict(self):
+        """Reads database, customers are returned as a lazy sequence"""
+        connection = self.connection
+        # read first, a write in between makes the next write fail rather than go through
+        self._generation = connection.execute("PRAGMA user_version").fetchone()[0]
+        self._customer_ids = [row[0] for row in
+                              connection.execute("SELECT id FROM customers ORDER BY id")]
+        employees = connection.execute(
+            "SELECT id, f_name, l_name, uid FROM employees ORDER BY id")
+        self._employee_ids = []
+        employee_dicts = []
+        for employee_id, f_name, l_name, uid in employees:
+            self._employee_ids.append(employee_id)
+            employee_dicts.append(_with_id({"f_name": f_name, "l_name": l_name}, uid))
+
+        data = {
+            "customers": SqliteRecords(self, list(self._customer_ids)),
+            "employees": employee_dicts,
+            "globals": {key: json.loads(value) for key, value in
+                        connection.execute("SELECT key, value FROM globals")}
+        }
+        for name, value in connection.execute("SELECT name, value FROM indexes"):
+            data[name] = json.loads(value)
+        return data
+
+    def modified_elsewhere(self):
+        """Returns True if someone else wrote since the database was read or written here"""
+        if self._generation is None:
+            return False
+        return self.connection.execute("PRAGMA user_version").fetchone()[0] != self._generation
+
+    def read_customer(self, customer_id):
+        """Reads a single customer record"""
+        connection = self.connection
+        f_name, l_name, address, uid = connection.execute(
+            "SELECT f_name, l_name, address, uid FROM customers WHERE id = ?",
+            (customer_id,)).fetchone()
+        accounts = connection.execute(
+            "SELECT type, balance, uid FROM accounts WHERE customer_id = ? ORDER BY position",
+            (customer_id,))
+        services = connection.execute(
+            'SELECT "limit", status, balance, uid FROM services WHERE customer_id = ? '
+            'ORDER BY position', (customer_id,))
+        return _with_id({
+            "f_name": f_name,
+            "l_name": l_name,
+            "address": address,
+            "accounts": [_with_id({"type": account_type, "balance": balance}, account_uid)
+                         for account_type, balance, account_uid in accounts],
+            "services": [_with_id({"account": {"type": "service", "balance": balance},
+                                   "limit": limit,
+                                   "status": status}, service_uid)
+                         for limit, status, balance, service_uid in services]
+        }, uid)
+
+    def should_compact(self):
+        """The database never needs to be rewritten as a whole"""
+        return False
+
+    def write_dict(self, data):
+        """Replaces the whole content of the database with data"""
+        try:
+            with self.connection as connection:
+                generation = self._begin()
+                for table in ("services", "accounts", "customers", "employees", "globals",
+                              "indexes"):
+                    connection.execute("DELETE FROM {0}".format(table))
+                self._customer_ids = []
+                self._employee_ids = []
+                for customer in data["customers"]:
+                    self._customer_ids.append(self._insert_customer(customer))
+                for employee in data["employees"]:
+                    self._employee_ids.append(self._insert_employee(employee))
+                connection.executemany(
+                    "INSERT INTO globals (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(value)) for key, value in data["globals"].items()])
+                for name, value in data.items():
+                    if name not in ("customers", "employees", "globals"):
+                        self._replace_index(name, value)
+        except sqlite3.Error as err:
+            logging.critical("Unable to write to database:%s", err)
+            raise err
+        self._generation = generation
+
+    def write_changes(self, records):
+        """Applies change records in a single transaction"""
+        try:
+            with self.connection:
+                generation = self._begin()
+                for record in records:
+                    if record["op"] == "replace":
+                        self._replace_index(record["table"], record["data"])
+                    elif record["table"] == "customers":
+                        self._apply_customer(record)
+                    else:
+                        self._apply_employee(record)
+        except sqlite3.Error as err:
+            logging.critical("Unable to write to database:%s", err)
+            raise err
+        self._generation = generation
+
+    def _begin(self):
+        """
+        Starts a write transaction incrementing the generation, returns the new generation.
+        Raises ConcurrentModificationError if someone else wrote since the database was read.
+        """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        generation = connection.execute("PRAGMA user_version").fetchone()[0]
+        if self._generation is not None and generation != self._generation:
+            raise ConcurrentModificationError("Database was modified since it was read")
+        connection.execute("PRAGMA user_version = {0:d}".format(generation + 1))
+        return generation + 1
+
+    def _replace_index(self, name, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO indexes (name, value) VALUES (?, ?)", (name, json.dumps(value)))
+
+    def _apply_customer(self, record):
+        if record["op"] == "append":
+            self._customer_ids.append(self._insert_customer(record["data"]))
+        elif record["op"] == "update":
+            self._update_customer(self._customer_ids[record["index"]], record["data"])
+        elif record["op"] == "delete":
+            customer_id = self._customer_ids.pop(record["index"])
+            for table in ("services", "accounts"):
+                self.connection.execute(
+                    "DELETE FROM {0} WHERE customer_id = ?".format(table), (customer_id,))
+            self.connection.execute("DELETE FROM customers WHERE id = ?", (customer_id,))
+        else:
+            raise ValueError("Unknown change operation {0}".format(record["op"]))
+
+    def _apply_employee(self, record):
+        if record["op"] == "append":
+            self._employee_ids.append(self._insert_employee(record["data"]))
+        elif record["op"] == "update":
+            self.connection.execute(
+                "UPDATE employees SET f_name = ?, l_name = ?, uid = ? WHERE id = ?",
+                (record["data"]["f_name"], record["data"]["l_name"], record["data"].get("id"),
+                 self._employee_ids[record["index"]]))
+        elif record["op"] == "delete":
+            self.connection.execute(
+                "DELETE FROM employees WHERE id = ?", (self._employee_ids.pop(record["index"]),))
+        else:
+            raise ValueError("Unknown change operation {0}".format(record["op"]))
+
+    def _insert_employee(self, employee):
+        return self.connection.execute(
+            "INSERT INTO employees (f_name, l_name, uid) VALUES (?, ?, ?)",
+            (employee["f_name"], employee["l_name"], employee.get("id"))).lastrowid
+
+    def _insert_customer(self, customer):
+        customer_id = self.connection.execute(
+            "INSERT INTO customers (f_name, l_name, address, uid) VALUES (?, ?, ?, ?)",
+            (customer["f_name"], customer["l_name"], customer["address"],
+             customer.get("id"))).lastrowid
+        self._sync_rows(customer_id, customer)
+        return customer_id
+
+    def _update_customer(self, customer_id, customer):
+        self.connection.execute(
+            "UPDATE customers SET f_name = ?, l_name = ?, address = ?, uid = ? WHERE id = ?",
+            (customer["f_name"], customer["l_name"], customer["address"], customer.get("id"),
+             customer_id))
+        self._sync_rows(customer_id, customer)
+
+    def _sync_rows(self, customer_id, customer):
+        """Updates only the account and service rows which differ from customer"""
+        accounts = [(account["type"], account["balance"], account.get("id"))
+                    for account in customer["accounts"]]
+        services = [(service["limit"], service["status"], service["account"]["balance"],
+                     service.get("id")) for service in customer["services"]]
+        self._sync_table("accounts", ("type", "balance", "uid"), customer_id, accounts)
+        self._sync_table("services", ('"limit"', "status", "balance", "uid"), customer_id,
+                         services)
+
+    def _sync_table(self, table, columns, customer_id, rows):
+        connection = self.connection
+        existing = connection.execute(
+            "SELECT id, {0} FROM {1} WHERE customer_id = ? ORDER BY position".format(
+                ", ".join(columns), table), (customer_id,)).fetchall()
+        assignments = ", ".join("{0} = ?".format(column) for column in columns)
+        for position, row in enumerate(rows):
+            if position < len(existing):
+                if tuple(existing[position][1:]) != row:
+                    connection.execute(
+                        "UPDATE {0} SET {1} WHERE id = ?".format(table, assignments),
+                        row + (existing[position][0],))
+            else:
+                connection.execute(
+                    "INSERT INTO {0} (customer_id, position, {1}) VALUES (?, ?, {2})".format(
+                        table, ", ".join(columns), ", ".join("?" * len(columns))),
+                    (customer_id, position) + row)
+        for row in existing[len(rows):]:
+            connection.execute("DELETE FROM {0} WHERE id = ?".format(table), (row[0],))
@@ -1,33 +1,521 @@
+import contextlib
+import itertools
+import logging
+from functools import partial
+
 from bank.customer import Customer
 from bank.employee import Employee
+from bank.money import dollars_to_cents
+from bank.storage.applications import ApplicationIndex
+from bank.storage.columnar import BalanceColumns
+from bank.storage.ids import IdIndex
+from bank.storage.index_files import IndexFiles
+from bank.storage.ledger import Ledger
+from bank.storage.lazy import LazyList
+from bank.storage.locking import ConcurrentModificationError
+from bank.storage.names import NameIndex
+
+# version of the stored data, 2: amounts are integer cents rather than float dollars
+FORMAT_VERSION = 2
 
 class Storage:
-    """Class responsible for managing persisent storage"""
+    """
+    Class responsible for managing persisent storage.
+    Customers and employees are only built from their records when first accessed, only
+    objects which changed since load are serialized on save, and nothing is written at all
+    if nothing changed.
+    If the backend provides a lock, data is read under a shared lock and written under an
+    exclusive lock, and save raises ConcurrentModificationError if someone else saved since
+    this instance loaded.
+    Customers, employees, accounts and services get ids from a single counter which is
+    saved with the data, so ids are never reused. Data saved before ids existed gets them
+    all on load.
+    Secondary indexes over the customers (see INDEXES) are kept in IndexFiles in
+    <path>.indexes rather than in the data, which only holds a mark of the state of each
+    index it goes with. An index is read when it is first used, or built when it has not
+    been saved with the data, and a save appends only its changes.
+    Data of an older FORMAT_VERSION is upgraded on load and rewritten on the next save.
+    Transactions of accounts and services are appended to a Ledger in <path>.ledger when
+    the backend has a path, before the data itself is written.
+    The balances of all customers are held in BalanceColumns once they are first used, and
+    kept up to date as customers are added, removed and changed.
+    """
+    INDEXES = {"applications": ApplicationIndex, "names": NameIndex, "ids": IdIndex}
+
     def __init__(self, utils_class, *args, **kwargs):
         self.utils = utils_class(*args, **kwargs)
+        path = getattr(self.utils, "path", None)
+        self.ledger = Ledger(path + ".ledger") if path is not None else None
+        self.index_files = IndexFiles(path + ".indexes") if path is not None else None
+        self._legacy_indexes = False
+        self._changes = []
+        self._transactions = {}
+        self._generation = None
+        self._next_id = 1
+        self._ids_assigned = False
+        self._version_missing = True
+        self._adding_customers = False
+        self._balances = None
         self.customers = []
         self.employees = []
         self.globals = {}
 
+    @property
+    def customers(self):
+        """List of customers, modifications are recorded for the next save"""
+        return self._customers
+
+    @customers.setter
+    def customers(self, customers):
+        self._customers = LazyList.from_items(
+            customers, Customer.from_dict, partial(self._list_changed, "customers"))
+        for customer in customers:
+            self._assign_ids(customer)
+        self._reset_indexes()
+        self._balances = None
+        self._rewrite = True
+
+    @property
+    def employees(self):
+        """List of employees, modifications are recorded for the next save"""
+        return self._employees
+
+    @employees.setter
+    def employees(self, employees):
+        self._employees = LazyList.from_items(
+            employees, Employee.from_dict, partial(self._list_changed, "employees"))
+        for employee in employees:
+            self._assign_ids(employee)
+        self._rewrite = True
+
+    @property
+    def applications(self):
+        """ApplicationIndex of pending applications"""
+        return self._index("applications")
+
+    @property
+    def ids(self):
+        """IdIndex of customer positions by id"""
+        return self._index("ids")
+
+    @property
+    def balances(self):
+        """
+        BalanceColumns of all customers, built from their records when first used and
+        updated with the customers which changed since
+        """
+        if self._balances is None:
+            self._balances = BalanceColumns.build(self.customers)
+        else:
+            self._balances.update(self.customers.modified())
+        return self._balances
+
+    @property
+    def names(self):
+        """NameIndex over customer names and addresses"""
+        return self._index("names")
+
+    def _index(self, name):
+        """
+        Returns the index called name, read from its files, or built by scanning all
+        customers if it was not saved with the data. Building an index is not a change of
+        its own, it is saved along with the next one.
+        """
+        if name not in self._indexes:
+            index = self._read_index(name)
+            pending = self._index_pending.pop(name, [])
+            if index is None:
+                index = self.INDEXES[name].build(self.customers)
+                self._built_indexes.add(name)
+            else:
+                # changes made before the index was read, they are saved with it
+                for change in pending:
+                    index.apply(change)
+            self._indexes[name] = index
+        return self._indexes[name]
+
+    def _read_index(self, name):
+        """Returns the index called name as saved with the loaded data, None if it was not"""
+        mark = self._index_marks.get(name)
+        if self.index_files is None or mark is None:
+            return None
+        saved = self.index_files.read(name, mark)
+        if saved is None:
+            logging.warning("Index %s does not match the data, rebuilding it", name)
+            return None
+        entries, changes = saved
+        index = self.INDEXES[name].from_list(entries)
+        for change in changes:
+            index.apply(change)
+        index.changes = []
+        return index
+
+    def _reset_indexes(self):
+        """Forgets all indexes, e.g. when the customers were replaced"""
+        self._indexes = {}
+        self._built_indexes = set()
+        self._index_marks = {}
+        self._index_pending = {}
+
+    def _update_indexes(self, event, *args):
+        """
+        Applies the changes returned by event (changes_added or changes_removed) of each index
+        class to the index, or keeps them to be applied when a saved index is first read
+        """
+        for name, index_class in self.INDEXES.items():
+            changes = getattr(index_class, event)(*args)
+            index = self._indexes.get(name)
+            if index is not None:
+                for change in changes:
+                    index.apply(change)
+            elif name in self._index_marks:
+                self._index_pending.setdefault(name, []).extend(changes)
+
+    @property
+    def globals(self):
+        """Free-form settings, replace rather than mutate so the change is saved"""
+        return self._globals
+
+    @globals.setter
+    def globals(self, value):
+        self._globals = value
+        self._rewrite = True
+
     def load(self):
-        """Retrieves data from storage"""
-        data = self.utils.read_dict()
+        """
+        Retrieves data from storage, replaying any journaled changes.
+        Customers and employees are decoded when they are first accessed.
+        """
+        with self._lock(exclusive=False) as lock:
+            data = self.utils.read_dict()
+            if hasattr(self.utils, "read_records"):
+                for record in self.utils.read_records():
+                    self._apply_record(data, record)
+            self._generation = lock.observe() if lock is not None else None
+
+        self._version_missing = "version" not in data
+        migrated = self._migrate(data)
         customers = data.get("customers", [])
         employees = data.get("employees", [])
         self.globals = data.get("globals", {})
 
-        self.customers = [Customer.from_dict(source_dict) for source_dict in customers]
-        self.employees = [Employee.from_dict(source_dict) for source_dict in employees]
+        self._customers = LazyList(
+            customers, Customer.from_dict, partial(self._list_changed, "customers"))
+        self._employees = LazyList(
+            employees, Employee.from_dict, partial(self._list_changed, "employees"))
+        self._reset_indexes()
+        self._balances = None
+        self._index_marks = data.get("indexes", {})
+        # indexes held by data written before they had files of their own are dropped by
+        # the next save, which writes everything
+        self._legacy_indexes = any(name in data for name in self.INDEXES)
+        self._changes = []
+        self._transactions = {}
+        self._rewrite = migrated
+        self._ids_assigned = False
+
+        self._next_id = data.get("next_id")
+        if self._next_id is None:
+            self._next_id = 1
+            for item in itertools.chain(self._customers, self._employees):
+                self._assign_ids(item)
+
+    def modified_elsewhere(self):
+        """Returns True if another process saved the store since it was loaded or saved here"""
+        with self._lock(exclusive=False) as lock:
+            if lock is not None:
+                return self._generation is not None and lock.generation() != self._generation
+        modified = getattr(self.utils, "modified_elsewhere", None)
+        return modified is not None and modified()
 
     def save(self):
-        """Saves data to storage"""
+        """
+        Saves data to storage, writing only the changes when the backend supports it.
+        Does nothing if nothing changed since the last load or save.
+        """
+        dirty_customers = list(self.customers.modified())
+        dirty_employees = list(self.employees.modified())
+        for _, item in dirty_customers + dirty_employees:
+            self._assign_ids(item)
+        transactions = self._transactions
+        for _, customer in dirty_customers:
+            transactions.update(customer.take_transactions())
+        indexes_changed = (any(index.changes for index in self._indexes.values())
+                           or any(self._index_pending.values()))
+        if not (self._rewrite or self._changes or dirty_customers or dirty_employees
+                or indexes_changed or self._ids_assigned):
+            return
+
+        for items, dirty in ((self.customers, dirty_customers), (self.employees, dirty_employees)):
+            for index, item in dirty:
+                items.set_record(index, item.to_dict())
+
+        with self._lock(exclusive=True) as lock:
+            if lock is not None and self._generation is not None:
+                if lock.generation() != self._generation:
+                    raise ConcurrentModificationError(
+                        "Storage was modified since it was loaded")
+
+            if self.ledger is not None:
+                self.ledger.append(transactions)
+
+            # the indexes are written first, the data only refers to their new state once
+            # written itself, so a failed save leaves the marks it was loaded with
+            marks = self._write_indexes()
+
+            if (not self._rewrite
+                    and not self._legacy_indexes
+                    and hasattr(self.utils, "write_changes")
+                    and not self.utils.should_compact()):
+                records = self._change_records(dirty_customers, dirty_employees)
+                if marks != self._index_marks:
+                    records.append({"op": "replace", "table": "indexes", "data": marks})
+                if self._ids_assigned:
+                    records.append({"op": "replace", "table": "next_id", "data": self._next_id})
+                if self._version_missing:
+                    records.append({"op": "replace", "table": "version", "data": FORMAT_VERSION})
+                self.utils.write_changes(records)
+            else:
+                # customers are handed over one record at a time when the backend streams
+                # them to disk, instead of being read into a single list first
+                streaming = getattr(self.utils, "streaming", False)
+                self.utils.write_dict(self._data(
+                    self.customers.iter_records() if streaming else self.customers.records(),
+                    self.employees.records(), marks))
+
+            if lock is not None:
+                self._generation = lock.bump()
+
+        # saved customers are no longer modified, their changes must reach the columns now
+        if self._balances is not None:
+            self._balances.update(dirty_customers)
+        for _, item in dirty_customers + dirty_employees:
+            item.mark_clean()
+        self.customers.mark_clean()
+        self.employees.mark_clean()
+        for index in self._indexes.values():
+            index.changes = []
+        self._built_indexes = set()
+        self._index_marks = marks
+        self._index_pending = {}
+        self._legacy_indexes = False
+        self._changes = []
+        self._transactions = {}
+        self._rewrite = False
+        self._ids_assigned = False
+        self._version_missing = False
+
+    def _write_indexes(self):
+        """
+        Writes the changes of each index to its files: appended to its log, or the whole
+        index when it was built or its log is due to be compacted. Returns the marks the
+        data is to hold.
+        """
+        marks = dict(self._index_marks)
+        if self.index_files is None:
+            return marks
+        for name in self.INDEXES:
+            mark = marks.get(name)
+            index = self._indexes.get(name)
+            if index is None or name not in self._built_indexes:
+                changes = index.changes if index is not None else self._index_pending.get(name)
+                if not changes:
+                    continue
+                if not self.index_files.should_compact(name, mark):
+                    marks[name] = self.index_files.append(name, mark, changes)
+                    continue
+                index = self._index(name)
+            marks[name] = self.index_files.write(name, mark, index.to_list())
+        return marks
+
+    def _data(self, customers, employees, indexes=None):
+        """
+        Everything a full write stores, with the given customer and employee records and
+        index marks, by default those of the loaded data
+        """
         data = {
-            "customers": [customer.to_dict() for customer in self.customers],
-            "employees": [employee.to_dict() for employee in self.employees],
-            "globals": self.globals
+            "customers": customers,
+            "employees": employees,
+            "globals": self.globals,
+            "next_id": self._next_id,
+            "version": FORMAT_VERSION
         }
+        indexes = indexes if indexes is not None else self._index_marks
+        # stores without index files carry no marks
+        if indexes:
+            data["indexes"] = indexes
+        return data
+
+    def snapshot(self):
+        """
+        Returns everything a full write stores, customers as a list of raw records.
+        Unsaved modifications are included, customers which were not built yet are not built.
+        """
+        modified = dict(self.customers.modified())
+        customers = [modified[index].to_dict() if index in modified else self.customers.record(index)
+                     for index in range(len(self.customers))]
+        return self._data(customers, [employee.to_dict() for employee in self.employees])
+
+    def add_customer(self, customer):
+        """Appends customer to storage, giving it an id"""
+        self.customers.append(customer)
+
+    def add_customers(self, customers):
+        """
+        Appends customers, any iterable, to storage, giving them ids. Secondary indexes are
+        updated once for all of them rather than for each one. Returns the number appended.
+        """
+        first_index = len(self.customers)
+        self._adding_customers = True
+        try:
+            for customer in customers:
+                self.customers.append(customer)
+        finally:
+            self._adding_customers = False
+            added = [self.customers.loaded(index)
+                     for index in range(first_index, len(self.customers))]
+            self._update_indexes("changes_added", [(customer.id, customer) for customer in added])
+        return len(added)
+
+    def update_records(self, updates):
+        """
+        Replaces the records of customers which were not built, e.g. by a job computing new
+        records in other processes. updates is an iterable of (index, record, transactions),
+        transactions being {id: [(time, kind, amount, balance)]} for the ledger.
+        Raises ValueError if a customer was built, its changes go through the object instead.
+        """
+        for index, record, transactions in updates:
+            if self.customers.loaded(index) is not None:
+                raise ValueError("Customer {0} was built, change its object".format(index))
+            self.customers.set_record(index, record)
+            if self._balances is not None:
+                self._balances.update([(index, record)])
+            self._changes.append(("update", "customers", index, record))
+            self._transactions.update(transactions)
+
+    def remove_customer(self, index):
+        """Removes the customer at index, raises IndexError if there is no such customer"""
+        del self.customers[index]
+
+    def add_employee(self, employee):
+        """Appends employee to storage, giving it an id"""
+        self.employees.append(employee)
+
+    def remove_employee(self, index):
+        """Removes the employee at index, raises IndexError if there is no such employee"""
+        del self.employees[index]
+
+    def _assign_ids(self, item):
+        """Gives item, and the accounts and services of a customer, ids if they have none"""
+        for owned in itertools.chain((item,), getattr(item, "accounts", ()),
+                                     getattr(item, "services", ())):
+            if owned.id is None:
+                owned.id = self._next_id
+                self._next_id += 1
+                self._ids_assigned = True
+
+    def _lock(self, exclusive):
+        """Holds the lock of the backend, if it has one"""
+        if hasattr(self.utils, "lock"):
+            return self.utils.lock.hold(exclusive)
+        return contextlib.nullcontext()
+
+    def _list_changed(self, table, operation, index, item):
+        """Records a modification of the customers or employees list"""
+        if operation == "append":
+            self._assign_ids(item)
+        if operation == "reset":
+            self._rewrite = True
+        else:
+            self._changes.append((operation, table, index, item))
+
+        if table == "customers" and self._balances is not None:
+            if operation == "reset":
+                self._balances = None
+            elif operation == "append":
+                self._balances.append(item)
+            elif operation == "delete":
+                self._balances.update([(index, None)])
+
+        if table == "customers" and not self._adding_customers:
+            if operation == "reset":
+                self._reset_indexes()
+            elif operation == "append":
+                self._update_indexes("changes_added", [(item.id, item)])
+            elif operation == "delete":
+                # a removed customer which was never built is given as its raw record
+                customer_id = item.get("id") if isinstance(item, dict) else item.id
+                self._update_indexes("changes_removed", customer_id, item)
+
+    def _change_records(self, dirty_customers, dirty_employees):
+        """
+        Serializes pending changes. Appends and deletes are replayed in order, afterwards
+        the remaining modified objects are updated at their final index.
+        """
+        records = []
+        appended = set()
+        for operation, table, index, item in self._changes:
+            record = {"op": operation, "table": table}
+            if index is not None and operation != "append":
+                record["index"] = index
+            if operation == "update":
+                # a record given to update_records
+                record["data"] = item
+            elif operation == "append":
+                record["data"] = item.to_dict()
+                appended.add(id(item))
+            records.append(record)
+
+        for table, dirty in (("customers", dirty_customers), ("employees", dirty_employees)):
+            items = getattr(self, table)
+            for index, item in dirty:
+                if id(item) not in appended:
+                    records.append({"op": "update", "table": table, "index": index,
+                                    "data": items.record(index)})
+        return records
+
+    @staticmethod
+    def _migrate(data):
+        """
+        Upgrades raw data read from a store of an older FORMAT_VERSION in place.
+        Returns True if any record changed, in which case all records were read.
+        """
+        if data.get("version", 1) >= FORMAT_VERSION:
+            return False
+
+        def account(record):
+            return dict(record, balance=dollars_to_cents(record["balance"]))
+
+        def service(record):
+            return dict(record, account=account(record["account"]),
+                        limit=dollars_to_cents(record["limit"]))
+
+        customers = [dict(customer,
+                          accounts=[account(record) for record in customer["accounts"]],
+                          services=[service(record) for record in customer["services"]])
+                     for customer in data.get("customers", [])]
+        data["customers"] = customers
+        data["version"] = FORMAT_VERSION
+        return bool(customers)
+
+    @staticmethod
+    def _apply_record(data, record):
+        """Applies a single journal record to the raw data read from the snapshot"""
+        if record["op"] == "replace":
+            data[record["table"]] = record["data"]
+            return
 
-        self.utils.write_dict(data)
+        table = data.setdefault(record["table"], [])
+        if not isinstance(table, list):
+            table = data[record["table"]] = list(table)
+        if record["op"] == "append":
+            table.append(record["data"])
+        elif record["op"] == "update":
+            table[record["index"]] = record["data"]
+        elif record["op"] == "delete":
+            del table[record["index"]]
+        else:
+            raise ValueError("Unknown journal operation {0}".format(record["op"]))
 
     def __enter__(self):
         self.load()
@@ -0,0 +1,76 @@
+class TrackedList(list):
+    """
+    list which remembers whether it has been modified since it was last marked clean.
+    owner, if given, has its _items_changed called with (list, operation, index, item) for
+    each modification: "append" and "delete" describe the change exactly (item being the
+    added or removed item), "reset" means the list was reordered or replaced in a way which
+    is not described further. The owner is kept rather than a callback, a bound method per
+    list would take more memory than the list itself.
+    """
+    __slots__ = ("dirty", "_owner")
+
+    def __init__(self, iterable=(), owner=None):
+        super().__init__(iterable)
+        self.dirty = False
+        self._owner = owner
+
+    def mark_clean(self):
+        """ Forget about modifications made so far """
+        self.dirty = False
+
+    def _changed(self, operation, index=None, item=None):
+        self.dirty = True
+        if self._owner is not None:
+            self._owner._items_changed(self, operation, index, item)
+
+    def append(self, item):
+        super().append(item)
+        self._changed("append", len(self) - 1, item)
+
+    def extend(self, iterable):
+        for item in iterable:
+            self.append(item)
+
+    def __iadd__(self, iterable):
+        self.extend(iterable)
+        return self
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            super().__delitem__(index)
+            self._changed("reset")
+            return
+        if index < 0:
+            index += len(self)
+        item = self[index]
+        super().__delitem__(index)
+        self._changed("delete", index, item)
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self)
+        item = super().pop(index)
+        self._changed("delete", index, item)
+        return item
+
+    def remove(self, item):
+        del self[self.index(item)]
+
+    def _resetting(name):  # pylint: disable=no-self-argument
+        method = getattr(list, name)
+
+        def wrapper(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            self._changed("reset")
+            return result
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    insert = _resetting("insert")
+    clear = _resetting("clear")
+    sort = _resetting("sort")
+    reverse = _resetting("reverse")
+    __setitem__ = _resetting("__setitem__")
+    __imul__ = _resetting("__imul__")
+    del _resetting
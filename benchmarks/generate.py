@@ -0,0 +1,116 @@
+import argparse
+import random
+
+from bank import FileUtils, BinaryFileUtils, JournalFileUtils, IndexedFileUtils
+from bank import ShardedFileUtils, SqliteUtils
+from bank.storage.storage import FORMAT_VERSION
+
+# backends by their name on the command line, see bank/__main__.py
+BACKENDS = {
+    "json": FileUtils,
+    "binary": BinaryFileUtils,
+    "journal": JournalFileUtils,
+    "indexed": IndexedFileUtils,
+    "sharded": ShardedFileUtils,
+    "sqlite": SqliteUtils
+}
+
+FIRST_NAMES = ("James", "Richard", "Jeremy", "Mary", "Anna", "Jürgen", "Olivia", "Noah", "Emma",
+               "Liam", "Sophia", "Lucas", "Mia", "Amelia", "Ethan", "Chloe", "Oscar", "Grace")
+LAST_NAMES = ("May", "Hammond", "Clarkson", "Smith", "Jones", "Taylor", "Brown", "Williams",
+              "Wilson", "Klopp", "Evans", "Thomas", "Roberts", "Walker", "Wright", "Green")
+STREETS = ("Downing Street", "High Street", "Station Road", "Main Street", "Park Road",
+           "Church Lane", "Anfield Road", "Trekking Way", "Mill Lane", "Victoria Road")
+ACCOUNT_TYPES = ("checking", "savings", "savings", "checking", "business")
+# accounts of a customer at most, each customer gets a block of ids large enough for
+# itself, its accounts and its service, so the ids used are known before generating
+MAX_ACCOUNTS = 62
+IDS_PER_CUSTOMER = MAX_ACCOUNTS + 2
+
+
+def _skewed(rng, mean, skew):
+    """
+    Returns a non negative number with the given mean, every value equals mean when skew is 0
+    and the values get more lopsided (log-normal with sigma skew) as it grows
+    """
+    if skew <= 0:
+        return mean
+    return mean * rng.lognormvariate(-skew * skew / 2, skew)
+
+
+def generate_records(customers, accounts=2.0, services=0.3, skew=0.0, seed=0, first_id=1):
+    """
+    Yields customer records (as stored, amounts in cents, with ids counting from first_id) of
+    a synthetic bank. The same arguments always yield the same records.
+    customers is the number of customers, accounts the mean number of accounts per customer
+    (at most MAX_ACCOUNTS), services the share of customers with a lending service. skew makes account counts and
+    balances lopsided: a few customers hold many accounts and most of the money.
+    """
+    rng = random.Random(seed)
+    for index in range(customers):
+        next_id = first_id + index * IDS_PER_CUSTOMER
+        record = {"id": next_id,
+                  "f_name": rng.choice(FIRST_NAMES),
+                  "l_name": rng.choice(LAST_NAMES),
+                  "address": "{0} {1}".format(rng.randrange(1, 1000), rng.choice(STREETS)),
+                  "accounts": [],
+                  "services": []}
+        next_id += 1
+        for _ in range(min(int(round(_skewed(rng, accounts, skew))), MAX_ACCOUNTS)):
+            record["accounts"].append({
+                "id": next_id,
+                "type": rng.choice(ACCOUNT_TYPES),
+                "balance": int(_skewed(rng, 250000, skew) * rng.random() * 2)})
+            next_id += 1
+        if rng.random() < services:
+            limit = rng.randrange(1000, 1000000, 100)
+            approved = rng.random() < 0.7
+            record["services"].append({
+                "id": next_id,
+                "account": {"type": "service",
+                            "balance": -rng.randrange(limit) if approved else 0},
+                "limit": limit,
+                "status": "approved" if approved else "application"})
+            next_id += 1
+        yield record
+
+
+def generate_data(customers, accounts=2.0, services=0.3, skew=0.0, seed=0, employees=10):
+    """
+    Returns a whole store as written by backends, customers as a generator of records.
+    Indexes are left out and built by Storage on first use.
+    """
+    rng = random.Random(seed)
+    employee_records = [{"id": index + 1, "f_name": rng.choice(FIRST_NAMES),
+                         "l_name": rng.choice(LAST_NAMES)} for index in range(employees)]
+    return {
+        "customers": generate_records(customers, accounts, services, skew, seed,
+                                      first_id=employees + 1),
+        "employees": employee_records,
+        "globals": {},
+        "next_id": employees + 1 + customers * IDS_PER_CUSTOMER,
+        "version": FORMAT_VERSION
+    }
+
+
+def write_store(utils, customers, accounts=2.0, services=0.3, skew=0.0, seed=0):
+    """Writes a synthetic store with utils, a backend instance such as FileUtils(path)"""
+    utils.write_dict(generate_data(customers, accounts, services, skew, seed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="write a deterministic synthetic bank")
+    parser.add_argument("path", type=str)
+    parser.add_argument("-b", "--backend", choices=BACKENDS.keys(), default="json")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--accounts", type=float, default=2.0)
+    parser.add_argument("--services", type=float, default=0.3)
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_store(BACKENDS[args.backend](args.path), args.customers, args.accounts,
+                args.services, args.skew, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import bank.main
+from bank import Account, Customer, Service, Storage
+from benchmarks.generate import BACKENDS, generate_records, write_store
+
+SIZES = (1000, 100000, 1000000)
+# records converted by the from_dict and to_dict benchmarks
+SAMPLE_SIZE = 10000
+# relative slow down --compare reports as a regression
+THRESHOLD = 0.1
+
+# bank/main.py commands in the order they are run against one loaded store, each followed
+# by a save. -1 is the probe customer appended by _prepare, with two accounts, an approved
+# service (0) and an application (1)
+COMMANDS = (
+    ("list_employees", {}),
+    ("add_employee", {"first_name": "Richard", "last_name": "Feynman"}),
+    ("remove_employee", {"employee_index": -1}),
+    ("list_customers", {}),
+    ("find_customers", {"query": "probe"}),
+    ("add_customer", {"first_name": "James", "last_name": "May", "address": "1 Downing Street"}),
+    ("remove_customer", {"customer_index": -1}),
+    ("list_accounts", {"customer_index": -1}),
+    ("add_account", {"customer_index": -1, "type": "savings"}),
+    ("remove_account", {"customer_index": -1, "account_index": -1}),
+    ("deposit", {"customer_index": -1, "account_index": 0, "amount": 1000}),
+    ("withdraw", {"customer_index": -1, "account_index": 0, "amount": 500}),
+    ("transfer", {"customer_index": -1, "source_account_index": 0,
+                  "destination_account_index": 1, "amount": 100}),
+    ("statement", {"customer_index": -1, "account_index": 0, "since": None, "limit": 50}),
+    ("list_services", {"customer_index": -1}),
+    ("apply_for_service", {"customer_index": -1, "limit": 10000}),
+    ("list_applicaitons", {}),
+    ("approve_application", {"customer_index": -1, "service_index": 2}),
+    ("remove_application", {"customer_index": -1, "service_index": 1}),
+    ("borrow_from_service", {"customer_index": -1, "service_index": 0, "account_index": 0,
+                             "amount": 100}),
+    ("pay_to_service", {"customer_index": -1, "service_index": 0, "account_index": 0,
+                        "amount": 100}),
+    ("report_totals", {}),
+    ("report_memory", {}),
+    ("report_codecs", {}),
+)
+
+
+def _max_rss():
+    """Peak resident set size of this process in bytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _load_peak(backend, path):
+    """
+    Bytes allocated at the peak of loading the store at path, measured with tracemalloc so
+    generating the store before does not count
+    """
+    storage = Storage(BACKENDS[backend], path)
+    tracemalloc.start()
+    storage.load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def _prepare(path, backend, size, options):
+    """Writes a synthetic store with a probe customer and its indexes, returns seconds taken"""
+    start = time.perf_counter()
+    write_store(BACKENDS[backend](path), size, options.accounts, options.services,
+                options.skew, options.seed)
+    with Storage(BACKENDS[backend], path) as storage:
+        storage.add_customer(Customer(
+            "Probe", "Customer", "1 Benchmark Road",
+            [Account("checking", 10 ** 9), Account("savings", 0)],
+            [Service(10 ** 6, Account("service", 0), "approved"), Service(5000)]))
+        for name in Storage.INDEXES:
+            getattr(storage, name)
+    return time.perf_counter() - start
+
+
+def _conversions(options):
+    """Returns microseconds per Customer.from_dict and per Customer.to_dict of sample records"""
+    records = list(generate_records(SAMPLE_SIZE, options.accounts, options.services,
+                                    options.skew, options.seed))
+    start = time.perf_counter()
+    customers = [Customer.from_dict(record) for record in records]
+    from_dict = time.perf_counter() - start
+    start = time.perf_counter()
+    for customer in customers:
+        customer.to_dict()
+    to_dict = time.perf_counter() - start
+    return from_dict / len(records) * 1e6, to_dict / len(records) * 1e6
+
+
+def run_size(size, options):
+    """
+    Runs every benchmark against a synthetic store of size customers, returns a dict of
+    seconds (and bytes for memory), run in a process of its own so the peak memory is its own
+    """
+    results = {"customers": size}
+    results["from_dict_us"], results["to_dict_us"] = _conversions(options)
+
+    with tempfile.TemporaryDirectory(dir=options.directory) as directory:
+        path = os.path.join(directory, "bank.json")
+        results["generate"] = _prepare(path, options.backend, size, options)
+
+        storage = Storage(BACKENDS[options.backend], path)
+        start = time.perf_counter()
+        storage.load()
+        results["load"] = time.perf_counter() - start
+        results["load_peak_bytes"] = _load_peak(options.backend, path)
+
+        # replacing globals has the next save write the whole store
+        storage.globals = dict(storage.globals)
+        start = time.perf_counter()
+        storage.save()
+        results["save"] = time.perf_counter() - start
+
+        commands = {}
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for name, args in COMMANDS:
+                if name in options.skip:
+                    continue
+                start = time.perf_counter()
+                getattr(bank.main, name)(storage, SimpleNamespace(**args))
+                storage.save()
+                commands[name] = time.perf_counter() - start
+        results["commands"] = commands
+    results["max_rss_bytes"] = _max_rss()
+    return results
+
+
+def _flatten(results, prefix=""):
+    """Yields (name, value) of every number in results, names of nested values joined by dots"""
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, "{0}{1}.".format(prefix, key))
+        elif isinstance(value, (int, float)) and key != "customers":
+            yield prefix + key, value
+
+
+def compare(previous, current, threshold=THRESHOLD):
+    """
+    Prints every measurement of current next to the one of previous (both results as written
+    by main), returns the names of those which grew by more than threshold
+    """
+    regressions = []
+    for size, results in current["results"].items():
+        old = dict(_flatten(previous["results"].get(size, {})))
+        for name, value in _flatten(results):
+            if name not in old:
+                continue
+            ratio = value / old[name] if old[name] else 1.
+            regressed = ratio > 1 + threshold
+            print("{0:>8} {1:<40} {2:>14.6g} {3:>14.6g} {4:>7.2f}x{5}".format(
+                size, name, old[name], value, ratio, "  REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append("{0}:{1}".format(size, name))
+    return regressions
+
+
+def _commit():
+    """Returns the checked out git commit, None outside a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="time storage and commands against synthetic banks, write results as JSON")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=list(SIZES), help="customer counts, comma separated")
+    parser.add_argument("-b", "--backend", choices=BACKENDS.keys(), default="json")
+    parser.add_argument("--accounts", type=float, default=2.0)
+    parser.add_argument("--services", type=float, default=0.3)
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", type=lambda value: value.split(","), default=[],
+                        help="commands not to run, comma separated")
+    parser.add_argument("--directory", type=str, default=None,
+                        help="where stores are written, a temporary directory by default")
+    parser.add_argument("--output", type=str, default=None,
+                        help="results file, benchmarks/results/<time>.json by default")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="earlier results file, exits with 1 if anything got slower")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    options = parser.parse_args()
+
+    now = datetime.datetime.now()
+    report = {"meta": {"time": now.isoformat(timespec="seconds"),
+                       "commit": _commit(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "cpus": os.cpu_count(),
+                       "options": vars(options)},
+              "results": {}}
+    context = multiprocessing.get_context("spawn")
+    for size in options.sizes:
+        with context.Pool(1) as pool:
+            report["results"][str(size)] = pool.apply(run_size, (size, options))
+        print("{0} customers: load {1[load]:.3f}s, save {1[save]:.3f}s, {2} bytes peak".format(
+            size, report["results"][str(size)], report["results"][str(size)]["max_rss_bytes"]))
+
+    output = options.output
+    if output is None:
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                              now.strftime("%Y%m%d-%H%M%S.json"))
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("Results written to {0}".format(output))
+
+    if options.compare is not None:
+        with open(options.compare) as file:
+            regressions = compare(json.load(file), report, options.threshold)
+        if regressions:
+            print("{0} measurements regressed by more than {1:.0%}".format(
+                len(regressions), options.threshold))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
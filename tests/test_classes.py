@@ -1,6 +1,34 @@
+import argparse
+import asyncio
+import contextlib
+import io
 import unittest
+from unittest import mock
 import json
-from bank import Account, Employee, Service, Customer, Storage, FileUtils
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import bank.main
+from bank import Account, Employee, Service, ServiceStatus, Customer, Storage, FileUtils
+from bank import JournalFileUtils, IndexedFileUtils, SqliteUtils, ConcurrentModificationError
+from bank import BinaryFileUtils, ShardedFileUtils
+from bank.money import parse_amount, format_amount, dollars_to_cents
+from bank.storage import codecs
+from bank.storage.columnar import BalanceColumns
+from bank.storage.compression import parse_location
+from bank.storage.ids import IdIndex
+from bank.storage.lazy import LazyList
+from bank.storage.ledger import Ledger, CHECKPOINT_BUCKETS, CHECKPOINT_INTERVAL
+from bank.batch import run_batch
+from bank.bulk import import_customers, export_customers
+from bank.eod import accrue, end_of_day
+from bank.server import BankServer, execute, parse_address, send_command, serve
+from benchmarks.generate import BACKENDS, generate_data, generate_records
+from benchmarks.run import COMMANDS, compare, run_size
 
 class TestAccount(unittest.TestCase):
     def test_init_properties(self):
@@ -79,6 +107,28 @@ class TestEmployee(unittest.TestCase):
         self.assertEqual(emp.l_name, "Torvald")
 
 
+class TestMoney(unittest.TestCase):
+    def test_parse_and_format(self):
+        self.assertEqual(parse_amount("10.25"), 1025)
+        self.assertEqual(parse_amount(3), 300)
+        self.assertEqual(parse_amount(0.1), 10)
+        with self.assertRaises(ValueError):
+            parse_amount("0.001")
+        with self.assertRaises(ValueError):
+            parse_amount("ten")
+        self.assertEqual(format_amount(-1005), "-10.05")
+        self.assertEqual(format_amount(7), "0.07")
+        self.assertEqual(dollars_to_cents(1.005), 101)
+
+    def test_domain_takes_cents(self):
+        acct = Account("checking", 100.)
+        self.assertIs(type(acct.balance), int)
+        with self.assertRaises(TypeError):
+            acct.deposit(0.5)
+        with self.assertRaises(TypeError):
+            Service("100")
+
+
 class TestService(unittest.TestCase):
     def test_init(self):
         service = Service(100.)
@@ -174,6 +224,16 @@ class TestService(unittest.TestCase):
         self.assertEqual(service.balance, 0)
         self.assertEqual(service.status, "application")
 
+    def test_status_values(self):
+        service = Service(100)
+        self.assertIs(service.status, ServiceStatus.APPLICATION)
+        self.assertIs(type(service.to_dict()["status"]), str)
+        service.approve()
+        self.assertIs(service.status, ServiceStatus.APPROVED)
+        self.assertEqual(Service(100, status="denied").status, "denied")
+        with self.assertRaises(AttributeError):
+            service.note = "slots only"
+
 
 class TestCustomer(unittest.TestCase):
     def test_init(self):
@@ -239,6 +299,37 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(cust.total_limit, 100)
 
 
+    def test_incremental_totals(self):
+        acct = Account("checking", 10)
+        service = Service(100, Account("service", 0))
+        cust = Customer("Alex", "Trebek", "1 Jeopardy! Ave", [acct], [service])
+        self.assertEqual((cust.total_balance, cust.total_limit), (10, 0))
+
+        service.approve()
+        self.assertEqual(cust.total_limit, 100)
+        service.lend(30, acct)
+        self.assertEqual(cust.total_balance, 10)
+        service.collect(5, acct)
+        acct.deposit(20)
+        self.assertEqual(cust.total_balance, 30)
+        service.limit = 150
+        self.assertEqual(cust.total_limit, 150)
+
+        cust.accounts.append(Account("savings", 7))
+        self.assertEqual(cust.total_balance, 37)
+        del cust.accounts[0]
+        acct.deposit(1000)
+        self.assertEqual(cust.total_balance, -18)
+        cust.services.pop()
+        self.assertEqual((cust.total_balance, cust.total_limit), (7, 0))
+        cust.accounts.insert(0, Account("checking", 3))
+        self.assertEqual(cust.total_balance, 10)
+        cust.verify_totals()
+
+        cust._total_balance += 1
+        with self.assertRaises(RuntimeError):
+            cust.verify_totals()
+
     def test_to_dict(self):
         acct = Account("checking", 0)
         service = Service(100)
@@ -276,7 +367,130 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(cust.services[0].status, "approved")
 
 
+class TestDirtyTracking(unittest.TestCase):
+    def test_account(self):
+        acct = Account.from_dict({"type": "savings", "balance": 10.})
+        self.assertFalse(acct.dirty)
+        acct.deposit(1.)
+        self.assertTrue(acct.dirty)
+        acct.mark_clean()
+        self.assertFalse(acct.dirty)
+        self.assertTrue(Account("savings", 0.).dirty)
+
+    def test_service(self):
+        service = Service.from_dict(Service(100., Account("service", 0.)).to_dict())
+        self.assertFalse(service.dirty)
+        service.approve()
+        self.assertTrue(service.dirty)
+        service.mark_clean()
+        service.lend(10., Account("checking", 0.))
+        self.assertTrue(service.dirty)
+
+    def test_customer(self):
+        cust = Customer.from_dict(Customer(
+            "Carl", "Sagan", "1 Main Street", [Account("checking", 10.)]).to_dict())
+        self.assertFalse(cust.dirty)
+        cust.accounts[0].withdrawl(10.)
+        self.assertTrue(cust.dirty)
+        cust.mark_clean()
+        del cust.accounts[0]
+        self.assertTrue(cust.dirty)
+        cust.mark_clean()
+        cust.address = "2 Main Street"
+        self.assertTrue(cust.dirty)
+
+    def test_lists_allocated_on_use(self):
+        cust = Customer.from_dict({"f_name": "Carl", "l_name": "Sagan", "address": "1 Main Street",
+                                   "accounts": [], "services": []})
+        self.assertFalse(cust.dirty)
+        self.assertEqual(cust.to_dict()["services"], [])
+        self.assertIsNone(cust._services)
+        cust.services.append(Service(100, status="approved"))
+        self.assertTrue(cust.dirty)
+        self.assertEqual(cust.total_limit, 100)
+
+    def test_storage_read_only_does_not_write(self):
+        path = "tests/test_dirty.json"
+        with open(path, "w") as file:
+            json.dump({"customers": [], "employees": [], "globals": {}}, file)
+        modified = os.stat(path).st_mtime_ns
+        os.utime(path, ns=(modified - 10 ** 9, modified - 10 ** 9))
+        with Storage(FileUtils, path) as storage:
+            self.assertEqual(storage.customers, [])
+        self.assertEqual(os.stat(path).st_mtime_ns, modified - 10 ** 9)
+        os.remove(path)
+        os.remove(path + ".lock")
+
+
+class TestLazyList(unittest.TestCase):
+    def test_builds_on_access(self):
+        built = []
+        def factory(record):
+            built.append(record)
+            return Employee.from_dict(record)
+
+        records = [{"f_name": "Ada", "l_name": "Lovelace"}, {"f_name": "Alan", "l_name": "Turing"}]
+        employees = LazyList(records, factory)
+        self.assertEqual(len(employees), 2)
+        self.assertEqual(built, [])
+        self.assertEqual(employees[-1].l_name, "Turing")
+        self.assertEqual(employees[1].l_name, "Turing")
+        self.assertEqual(built, records[1:])
+        self.assertEqual(list(employees.modified()), [])
+
+        with self.assertRaises(IndexError):
+            employees[2]
+
+    def test_changes(self):
+        changes = []
+        employees = LazyList([{"f_name": "Ada", "l_name": "Lovelace"}], Employee.from_dict,
+                             lambda *change: changes.append(change[:2]))
+        emp = Employee("Grace", "Hopper")
+        employees.append(emp)
+        del employees[0]
+        self.assertEqual(changes, [("append", 1), ("delete", 0)])
+        self.assertEqual(list(employees.modified()), [(0, emp)])
+        self.assertEqual(employees, [emp])
+
+    def test_removals_keep_positions(self):
+        # removed slots are only dropped after many removals, in between positions skip them
+        rng = random.Random(1)
+        records = [{"f_name": str(number), "l_name": "Smith"} for number in range(200)]
+        expected = list(records)
+        employees = LazyList(tuple(records), Employee.from_dict)
+        for step in range(150):
+            index = rng.randrange(len(expected))
+            if step % 3 == 0:
+                employees[index].l_name = "Jones"
+                expected[index] = employees[index].to_dict()
+                employees.set_record(index, expected[index])
+            if step % 5 == 0:
+                employee = Employee(str(1000 + step), "Brown")
+                employees.append(employee)
+                expected.append(employee.to_dict())
+                employees.set_record(len(employees) - 1, expected[-1])
+            del employees[index]
+            del expected[index]
+            self.assertEqual(len(employees), len(expected))
+            self.assertEqual(employees.record(index % len(expected)), expected[index % len(expected)])
+            if step % 25 == 0:
+                self.assertEqual([employee.to_dict() for employee in employees], expected)
+                self.assertEqual(list(employees.iter_records()), expected)
+        modified = list(employees.modified())
+        self.assertTrue(modified)
+        for index, employee in modified:
+            self.assertIs(employees[index], employee)
+        self.assertEqual(employees.records(), expected)
+
+
 class TestStorage(unittest.TestCase):
+    def tearDown(self):
+        # every load and save creates a lock file next to the data
+        for path in ("tests/test_read.json", "tests/test_missing_file.json",
+                     "tests/test_write.json"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path + ".lock")
+
     def test_init(self):
         storage = Storage(FileUtils, "test.json")
         self.assertEqual(storage.utils.path, "test.json")
@@ -309,6 +523,7 @@ class TestStorage(unittest.TestCase):
             },
                 file)
 
+        # files without a version hold float dollars, they are read as cents
         storage = Storage(FileUtils, "tests/test_read.json")
         storage.load()
         self.assertEqual(len(storage.customers), 1)
@@ -317,9 +532,9 @@ class TestStorage(unittest.TestCase):
         self.assertEqual(storage.customers[0].address, "1 Downing Street")
         self.assertEqual(len(storage.customers[0].accounts), 1)
         self.assertEqual(storage.customers[0].accounts[0].type, "checking")
-        self.assertEqual(storage.customers[0].accounts[0].balance, 10)
+        self.assertEqual(storage.customers[0].accounts[0].balance, 1000)
         self.assertEqual(len(storage.customers[0].services), 1)
-        self.assertEqual(storage.customers[0].services[0].limit, 100)
+        self.assertEqual(storage.customers[0].services[0].limit, 10000)
         self.assertEqual(storage.customers[0].services[0].balance, 0)
         self.assertEqual(storage.customers[0].services[0].status, "approved")
 
@@ -345,7 +560,8 @@ class TestStorage(unittest.TestCase):
                                  "address": "1 Downing Street",
                                  "accounts": [{
                                      "type": "checking",
-                                     "balance": 10.
+                                     "balance": 10.,
+                                     "id": 2
                                  }],
                                  "services": [{
                                      "limit": 100,
@@ -353,16 +569,1457 @@ class TestStorage(unittest.TestCase):
                                          "type": "service",
                                          "balance": 0
                                      },
-                                     "status": "approved"
-                                 }]
+                                     "status": "approved",
+                                     "id": 3
+                                 }],
+                                 "id": 1
                                  }],
                 "employees": [{
                     "f_name": "Richard",
-                    "l_name": "Feynman"
+                    "l_name": "Feynman",
+                    "id": 4
                 }],
-                "globals": {"test": True}
+                "globals": {"test": True},
+                "next_id": 5,
+                "version": 2
             }
             )
 
         with self.assertRaises(OSError):
             Storage(FileUtils, "/root/test.json").save()
+
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.json")
+            utils = FileUtils(path)
+            utils.write_dict({"customers": [], "employees": [], "globals": {"test": True}})
+
+            # a failure part way through writing leaves the previous content in place
+            def records():
+                yield {"f_name": "James"}
+                raise OSError("disk full")
+            with self.assertRaises(OSError), self.assertLogs(level="CRITICAL"):
+                utils.write_dict({"customers": records(), "employees": [], "globals": {}})
+            self.assertEqual(utils.read_dict()["globals"], {"test": True})
+            self.assertEqual(os.listdir(directory), ["bank.json"])
+
+
+class TestJournalStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+        with open(self.path, "w") as file:
+            json.dump({"customers": [], "employees": [], "globals": {}}, file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_append_and_replay(self):
+        with Storage(JournalFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+            storage.add_employee(Employee("Richard", "Feynman"))
+
+        with Storage(JournalFileUtils, self.path) as storage:
+            storage.customers[0].accounts.append(Account("checking", 10.))
+
+        with open(self.path, "r") as file:
+            self.assertEqual(json.load(file)["customers"], [])
+        with open(self.path + ".journal", "r") as file:
+            self.assertEqual(len(file.readlines()), 6)
+
+        storage = Storage(JournalFileUtils, self.path)
+        storage.load()
+        self.assertEqual(len(storage.customers), 1)
+        self.assertEqual(storage.customers[0].accounts[0].balance, 10.)
+        self.assertEqual(storage.employees[0].l_name, "Feynman")
+
+        storage.remove_employee(0)
+        storage.save()
+        storage.load()
+        self.assertEqual(storage.employees, [])
+
+    def test_read_only_does_not_write(self):
+        with Storage(JournalFileUtils, self.path):
+            pass
+        self.assertFalse(os.path.exists(self.path + ".journal"))
+
+    def test_only_modified_customers_are_journaled(self):
+        with Storage(JournalFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way",
+                                          [Account("checking", 10.)]))
+        with Storage(JournalFileUtils, self.path) as storage:
+            storage.customers[1].accounts[0].withdrawl(5.)
+            storage.remove_customer(0)
+
+        with open(self.path + ".journal", "r") as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual([(record["op"], record.get("index")) for record in records[4:]],
+                         [("delete", 0), ("update", 0)])
+
+        storage = Storage(JournalFileUtils, self.path)
+        storage.load()
+        self.assertEqual(len(storage.customers), 1)
+        self.assertEqual(storage.customers[0].accounts[0].balance, 5.)
+
+    def test_compaction(self):
+        with Storage(JournalFileUtils, self.path, compact_after=4) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+        with Storage(JournalFileUtils, self.path, compact_after=4) as storage:
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+        with Storage(JournalFileUtils, self.path, compact_after=4) as storage:
+            storage.remove_customer(0)
+
+        with open(self.path + ".journal", "r") as file:
+            self.assertEqual(file.read(), "")
+        storage = Storage(JournalFileUtils, self.path)
+        storage.load()
+        self.assertEqual([cust.l_name for cust in storage.customers], ["Hammond"])
+
+    def test_truncated_record(self):
+        with Storage(JournalFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+        with open(self.path + ".journal", "a") as file:
+            file.write('{"op": "append", "tab')
+
+        storage = Storage(JournalFileUtils, self.path)
+        with self.assertLogs(level="WARNING"):
+            storage.load()
+        self.assertEqual(len(storage.customers), 1)
+        storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+        storage.save()
+        storage.load()
+        self.assertEqual(len(storage.customers), 2)
+
+
+class TestJsonCodec(unittest.TestCase):
+    def setUp(self):
+        self.chunk_size = codecs.CHUNK_SIZE
+        # tiny chunks so values, numbers and multi byte characters span chunk boundaries
+        codecs.CHUNK_SIZE = 7
+
+    def tearDown(self):
+        codecs.CHUNK_SIZE = self.chunk_size
+
+    def decode(self, text):
+        data = codecs.JsonCodec.decode(io.BytesIO(text))
+        if "customers" in data:
+            self.assertIsInstance(data["customers"], codecs.JsonRecords)
+            data["customers"] = list(data["customers"])
+        return data
+
+    def test_round_trip(self):
+        records = [{"f_name": "Jürgen", "l_name": "May", "balance": 1234567890123},
+                   {"f_name": "James", "l_name": "May", "balance": -5, "tags": []}]
+        data = {"globals": {"test": [1.5, None, True]}, "customers": iter(records),
+                "next_id": 1000000}
+        file = io.BytesIO()
+        codecs.JsonCodec.encode(data, file)
+        text = file.getvalue()
+
+        self.assertEqual(json.loads(text), dict(data, customers=records))
+        self.assertEqual(self.decode(text), dict(data, customers=records))
+
+    def test_layouts(self):
+        # documents written by other tools, with any key order and whitespace
+        data = {"employees": [], "customers": [{"f_name": "A"}, {"f_name": "B"}],
+                "globals": {}}
+        for text in (json.dumps(data), json.dumps(data, indent=4), json.dumps({"customers": []})):
+            self.assertEqual(self.decode(text.encode()), json.loads(text))
+        for text in (b'{"customers": [{"f_name": "A"}', b'{"customers": [{"f_name": "A"]}'):
+            with self.assertRaises(ValueError):
+                codecs.JsonCodec.decode(io.BytesIO(text))
+
+    def test_records_decoded_on_access(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.json")
+            FileUtils(path).write_dict(generate_data(50))
+            storage = Storage(FileUtils, path)
+            storage.load()
+            self.assertEqual(repr(storage.customers), "LazyList(50 items, 0 loaded)")
+            with open(path) as file:
+                self.assertEqual([customer.to_dict() for customer in storage.customers],
+                                 json.load(file)["customers"])
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        data = {"customers": [{"f_name": "Jürgen", "l_name": "May", "address": "1 Downing Street",
+                               "accounts": [{"type": "checking", "balance": 5}], "services": []}],
+                "employees": [], "globals": {"test": True}}
+        magics = {"gzip": b"\x1f\x8b", "bz2": b"BZh", "lzma": b"\xfd7zXZ"}
+        for utils_class in (FileUtils, BinaryFileUtils):
+            for compression, magic in magics.items():
+                path = os.path.join(self.directory.name, "bank.json")
+                utils_class(path, compression, 1).write_dict(data)
+                with open(path, "rb") as file:
+                    self.assertTrue(file.read().startswith(magic))
+                # compression and format are detected, whatever the reader was created with
+                read = FileUtils(path).read_dict()
+                self.assertEqual(dict(read, customers=list(read["customers"])), data)
+
+    def test_extension(self):
+        path = os.path.join(self.directory.name, "bank.json.xz")
+        self.assertEqual(FileUtils(path).compression.name, "lzma")
+        self.assertIsNone(FileUtils(path, "none").compression)
+        self.assertIsNone(FileUtils("bank.json").compression)
+
+        FileUtils(path).write_dict({"customers": [], "employees": [], "globals": {}})
+        with Storage(JournalFileUtils, path, compact_after=2) as storage:
+            storage.add_employee(Employee("Richard", "Feynman"))
+            storage.add_employee(Employee("Albert", "Einstein"))
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(3), b"\xfd7z")
+        storage = Storage(JournalFileUtils, path)
+        storage.load()
+        self.assertEqual(storage.employees[1].l_name, "Einstein")
+
+    def test_parse_location(self):
+        self.assertEqual(parse_location("bank.json"), ("bank.json", None, None))
+        self.assertEqual(parse_location("bank.json:lzma:9"), ("bank.json", "lzma", 9))
+        self.assertEqual(parse_location("bank.json:gzip"), ("bank.json", "gzip", None))
+        self.assertEqual(parse_location("bank.json.gz:none"), ("bank.json.gz", "none", None))
+        self.assertEqual(parse_location("c:/bank.json"), ("c:/bank.json", None, None))
+        for value in ("bank.json:bz2:0", "bank.json:gzip:fast", "bank.json:none:1"):
+            with self.assertRaises(ValueError):
+                parse_location(value)
+
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.ledger = Ledger(os.path.join(self.directory.name, "bank.json.ledger"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_statement(self):
+        count = CHECKPOINT_INTERVAL * 2 + 10
+        transactions = [(1000. + i, "deposit", 100, 100 * (i + 1)) for i in range(count)]
+        # appended in several parts, each continuing the numbering
+        self.ledger.append({7: transactions[:5]})
+        self.ledger.append({7: transactions[5:]})
+
+        opening, entries, next_seq = self.ledger.statement(7, limit=3)
+        self.assertEqual(opening, 0)
+        self.assertEqual([entry["seq"] for entry in entries], [1, 2, 3])
+        self.assertEqual(next_seq, 4)
+
+        opening, entries, next_seq = self.ledger.statement(7, since_seq=CHECKPOINT_INTERVAL + 3,
+                                                           limit=count)
+        self.assertEqual(opening, 100 * (CHECKPOINT_INTERVAL + 2))
+        self.assertEqual(entries[0], {"seq": CHECKPOINT_INTERVAL + 3, "time": 1002. + CHECKPOINT_INTERVAL,
+                                      "kind": "deposit", "amount": 100,
+                                      "balance": 100 * (CHECKPOINT_INTERVAL + 3)})
+        self.assertEqual(len(entries), count - CHECKPOINT_INTERVAL - 2)
+        self.assertIsNone(next_seq)
+
+        opening, entries, _ = self.ledger.statement(7, since_time=1000. + count - 2)
+        self.assertEqual([entry["seq"] for entry in entries], [count - 1, count])
+        self.assertEqual(self.ledger.statement(8), (None, [], None))
+
+    def test_truncated_entry(self):
+        self.ledger.append({7: [(1000., "deposit", 100, 100)]})
+        # an entry and a checkpoint record a crash cut short
+        with open(os.path.join(self.ledger.directory, "000001.log"), "ab") as file:
+            file.write(b'{"id": 7, "seq": 2, "ti')
+        with open(os.path.join(self.ledger.directory, "checkpoints-07"), "ab") as file:
+            file.write(b"\x07\x00\x00")
+        self.assertEqual(len(self.ledger.statement(7)[1]), 1)
+
+        # the partial entry is skipped, times never go backwards
+        self.ledger.append({7: [(999., "withdrawal", -50, 50)]})
+        _, entries, _ = self.ledger.statement(7)
+        self.assertEqual([(entry["seq"], entry["time"], entry["balance"]) for entry in entries],
+                         [(1, 1000., 100), (2, 1000., 50)])
+
+    def test_shared_files(self):
+        self.ledger.append({item_id: [(1000., "deposit", 100, 100)] for item_id in range(1, 1001)})
+        self.ledger.append({item_id: [(1001., "deposit", 5, 105)] for item_id in range(1, 1001, 7)})
+        # one log for all ids, and a checkpoint file per bucket rather than per id
+        self.assertEqual(len(os.listdir(self.ledger.directory)), 1 + CHECKPOINT_BUCKETS)
+        _, entries, _ = self.ledger.statement(8)
+        self.assertEqual([(entry["seq"], entry["balance"]) for entry in entries],
+                         [(1, 100), (2, 105)])
+
+    def test_storage(self):
+        path = os.path.join(self.directory.name, "bank.json")
+        FileUtils(path).write_dict({"customers": [], "employees": [], "globals": {}})
+        with Storage(FileUtils, path) as storage:
+            checking, savings = Account("checking", 0), Account("savings", 0)
+            service = Service(1000, status="approved")
+            storage.add_customer(Customer("James", "May", "1 Downing Street",
+                                          [checking, savings], [service]))
+            checking.deposit(500)
+            service.lend(200, savings)
+        with Storage(FileUtils, path) as storage:
+            checking, savings = storage.customers[0].accounts
+            checking.withdrawl(100)
+            service = storage.customers[0].services[0]
+
+        _, entries, _ = storage.ledger.statement(checking.id)
+        self.assertEqual([(entry["kind"], entry["amount"], entry["balance"]) for entry in entries],
+                         [("deposit", 500, 500), ("withdrawal", -100, 400)])
+        _, entries, _ = storage.ledger.statement(savings.id)
+        self.assertEqual([(entry["kind"], entry["amount"]) for entry in entries], [("lend", 200)])
+        _, entries, _ = storage.ledger.statement(service.id)
+        self.assertEqual([(entry["kind"], entry["amount"]) for entry in entries], [("lend", -200)])
+
+
+class TestBinaryStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+        with open(self.path, "w") as file:
+            json.dump({"customers": [], "employees": [], "globals": {"test": True}}, file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        with Storage(BinaryFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street",
+                                          [Account("checking", 1000), Account("savings", 5)],
+                                          [Service(10000, status="approved")]))
+            storage.add_customer(Customer("Jürgen", "May", "1 Downing Street"))
+            storage.add_employee(Employee("Richard", "Feynman"))
+            records = [cust.to_dict() for cust in storage.customers]
+
+        with open(self.path, "rb") as file:
+            self.assertEqual(file.read(8), b"BANKBIN\x01")
+
+        # read back with the JSON backend, the codec is detected
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        self.assertEqual(repr(storage.customers), "LazyList(2 items, 0 loaded)")
+        self.assertEqual([cust.to_dict() for cust in storage.customers], records)
+        self.assertEqual(storage.employees[0].l_name, "Feynman")
+        self.assertEqual(storage.globals, {"test": True})
+
+        storage.customers[0].accounts[0].deposit(1)
+        storage.save()
+
+        with open(self.path, "rb") as file:
+            self.assertEqual(json.load(file)["customers"][0]["accounts"][0]["balance"], 1001)
+
+    def test_byte_order(self):
+        data = {"customers": [{"f_name": "James", "l_name": "May", "address": "1 Downing Street",
+                               "accounts": [{"type": "checking", "balance": 1234567890123}],
+                               "services": []}],
+                "globals": {}}
+        for swap in (False, True):
+            with mock.patch("bank.storage.codecs.SWAP", swap):
+                file = io.BytesIO()
+                codecs.BinaryCodec.encode(data, file)
+                decoded = codecs.BinaryCodec.decode(io.BytesIO(file.getvalue()))
+            self.assertEqual(list(decoded["customers"]), data["customers"])
+            # little-endian, unless swapped the way a host of the other byte order swaps
+            little = (sys.byteorder == "little") != swap
+            self.assertIn(struct.pack("<q" if little else ">q", 1234567890123), file.getvalue())
+
+
+class TestIndexedStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.idx")
+        with open(self.path, "w") as file:
+            json.dump({"customers": [], "employees": [], "globals": {"test": True}}, file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_convert_and_update(self):
+        with Storage(IndexedFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street",
+                                          [Account("checking", 10.)]))
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+            storage.add_employee(Employee("Richard", "Feynman"))
+
+        with open(self.path, "rb") as file:
+            self.assertEqual(file.read(8), b"BANKIDX\x02")
+            content = file.read()
+
+        # the modified record is appended, rather than the file rewritten
+        with Storage(IndexedFileUtils, self.path) as storage:
+            storage.customers[0].accounts[0].deposit(5.)
+        with open(self.path, "rb") as file:
+            file.seek(8 + len(content))
+            self.assertLess(len(file.read()), len(content) // 2)
+
+        with Storage(IndexedFileUtils, self.path) as storage:
+            self.assertEqual(storage.customers[0].accounts[0].balance, 15.)
+            storage.customers[1].accounts.extend([Account("savings", 1.)] * 20)
+            storage.remove_customer(0)
+            storage.add_customer(Customer("Jeremy", "Clarkson", "1 Diddly Squat Road"))
+            storage.remove_employee(0)
+
+        storage = Storage(IndexedFileUtils, self.path)
+        storage.load()
+        self.assertEqual([cust.l_name for cust in storage.customers], ["Hammond", "Clarkson"])
+        self.assertEqual(len(storage.customers[0].accounts), 20)
+        self.assertEqual(storage.employees, [])
+        self.assertEqual(storage.globals, {"test": True})
+
+    def test_reads_only_requested_record(self):
+        with Storage(IndexedFileUtils, self.path) as storage:
+            for index in range(10):
+                storage.add_customer(Customer(str(index), "Doe", "1 Main Street"))
+
+        storage = Storage(IndexedFileUtils, self.path)
+        storage.load()
+        self.assertEqual(storage.customers[7].f_name, "7")
+        self.assertEqual(repr(storage.customers), "LazyList(10 items, 1 loaded)")
+
+    def test_crash(self):
+        with Storage(IndexedFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street",
+                                          [Account("checking", 10.)]))
+
+        # records and journal are written, the header still names the old state
+        storage = Storage(IndexedFileUtils, self.path)
+        storage.load()
+        storage.customers[0].accounts[0].deposit(5.)
+        with mock.patch("bank.storage.indexed.sync", side_effect=OSError("crash")), \
+                self.assertRaises(OSError), self.assertLogs(level="CRITICAL"):
+            storage.save()
+        with Storage(IndexedFileUtils, self.path) as storage:
+            self.assertEqual(storage.customers[0].accounts[0].balance, 10.)
+
+            # the header names the journal, its entries never reached the table
+            storage.customers[0].accounts[0].deposit(5.)
+            with mock.patch.object(IndexedFileUtils, "_patch_table"):
+                storage.save()
+        with Storage(IndexedFileUtils, self.path) as storage:
+            self.assertEqual(storage.customers[0].accounts[0].balance, 15.)
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+
+        storage = Storage(IndexedFileUtils, self.path)
+        storage.load()
+        self.assertEqual(storage.customers[0].accounts[0].balance, 15.)
+        self.assertEqual(storage.customers[1].l_name, "Hammond")
+
+    def test_employees_after_full_write(self):
+        storage = Storage(IndexedFileUtils, self.path)
+        storage.load()
+        storage.add_employee(Employee("Richard", "Feynman"))
+        # the first save writes the whole store, the next ones only changes
+        storage.save()
+        storage.add_employee(Employee("Paul", "Dirac"))
+        storage.save()
+        storage.remove_employee(-1)
+        storage.add_employee(Employee("Max", "Planck"))
+        storage.save()
+
+        storage = Storage(IndexedFileUtils, self.path)
+        storage.load()
+        self.assertEqual([emp.l_name for emp in storage.employees], ["Feynman", "Planck"])
+
+    def test_stale_read(self):
+        with Storage(IndexedFileUtils, self.path) as storage:
+            for index in range(10):
+                storage.add_customer(Customer(str(index), "Doe", "1 Main Street"))
+
+        first = Storage(IndexedFileUtils, self.path)
+        first.load()
+        with Storage(IndexedFileUtils, self.path) as second:
+            second.customers[3].f_name = "Jane"
+        # the record may have been rewritten in place
+        with self.assertRaises(ConcurrentModificationError):
+            first.customers[3]
+
+        # records not loaded yet are still read after saving itself
+        second.customers[4].f_name = "John"
+        second.save()
+        self.assertEqual(second.customers[5].f_name, "5")
+
+
+class TestShardedStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+        with open(self.path, "w") as file:
+            json.dump({"customers": [], "employees": [], "globals": {"test": True}}, file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _add(self, count, shard_size):
+        with Storage(ShardedFileUtils, self.path, shard_size) as storage:
+            storage.add_customers(Customer(str(index), "Doe", "1 Main Street")
+                                  for index in range(count))
+
+    def _shards(self):
+        with open(self.path) as file:
+            return [(shard["file"], shard["count"]) for shard in json.load(file)["shards"]]
+
+    def test_convert_and_update(self):
+        self._add(7, 3)
+        shards = self._shards()
+        self.assertEqual([count for _, count in shards], [3, 3, 1])
+
+        with Storage(ShardedFileUtils, self.path, 3) as storage:
+            storage.customers[4].accounts.append(Account("checking", 1000))
+            storage.add_employee(Employee("Richard", "Feynman"))
+            self.assertEqual(repr(storage.customers), "LazyList(7 items, 1 loaded)")
+        changed = self._shards()
+        self.assertEqual(changed[0], shards[0])
+        self.assertNotEqual(changed[1], shards[1])
+        self.assertEqual(sorted(os.listdir(self.path + ".shards")),
+                         sorted(file for file, _ in changed))
+
+        with Storage(ShardedFileUtils, self.path, 3) as storage:
+            for _ in range(3):
+                storage.remove_customer(0)
+            storage.add_customer(Customer("7", "Doe", "1 Main Street"))
+        self.assertEqual([count for _, count in self._shards()], [3, 2])
+
+        storage = Storage(ShardedFileUtils, self.path, 3)
+        storage.load()
+        self.assertEqual([customer.f_name for customer in storage.customers],
+                         ["3", "4", "5", "6", "7"])
+        self.assertEqual(storage.customers[1].accounts[0].balance, 1000)
+        self.assertEqual(storage.employees[0].l_name, "Feynman")
+        self.assertEqual(storage.globals, {"test": True})
+        self.assertEqual(storage.names.find("7"), [storage.customers[4].id])
+
+    def test_employees_after_full_write(self):
+        storage = Storage(ShardedFileUtils, self.path)
+        storage.load()
+        storage.add_employee(Employee("Richard", "Feynman"))
+        # the first save writes the whole store, the next ones only changes
+        storage.save()
+        storage.add_employee(Employee("Paul", "Dirac"))
+        storage.save()
+        storage.remove_employee(-1)
+        storage.add_employee(Employee("Max", "Planck"))
+        storage.save()
+
+        storage = Storage(ShardedFileUtils, self.path)
+        storage.load()
+        self.assertEqual([emp.l_name for emp in storage.employees], ["Feynman", "Planck"])
+
+    def test_rebalance(self):
+        self._add(10, 8)
+        with Storage(ShardedFileUtils, self.path, 8) as storage:
+            for _ in range(7):
+                storage.remove_customer(0)
+        self.assertEqual([count for _, count in self._shards()], [3])
+
+        with Storage(ShardedFileUtils, self.path, 1) as storage:
+            storage.customers[0].accounts.append(Account("checking", 1))
+        self.assertEqual([count for _, count in self._shards()], [1, 1, 1])
+
+    def test_replaced_shards_stay_readable(self):
+        self._add(6, 2)
+        storage = Storage(ShardedFileUtils, self.path, 2)
+        storage.load()
+        storage.customers[0].accounts.append(Account("checking", 1))
+        storage.globals = {}
+        storage.save()
+        self.assertEqual(storage.customers[5].f_name, "5")
+
+
+class TestSqliteStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        with Storage(SqliteUtils, self.path) as storage:
+            self.assertEqual(len(storage.customers), 0)
+            storage.add_customer(Customer("James", "May", "1 Downing Street",
+                                          [Account("checking", 10.), Account("savings", 5.)],
+                                          [Service(100., status="approved")]))
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+            storage.add_employee(Employee("Richard", "Feynman"))
+
+        with Storage(SqliteUtils, self.path) as storage:
+            cust = storage.customers[0]
+            cust.services[0].lend(50., cust.accounts[1])
+            del cust.accounts[0]
+            storage.remove_customer(1)
+
+        storage = Storage(SqliteUtils, self.path)
+        storage.load()
+        self.assertEqual(len(storage.customers), 1)
+        self.assertEqual([acct.to_dict() for acct in storage.customers[0].accounts],
+                         [{"type": "savings", "balance": 55., "id": 3}])
+        self.assertEqual(storage.customers[0].services[0].balance, -50.)
+        self.assertEqual(storage.customers[0].services[0].status, "approved")
+        self.assertEqual(storage.employees[0].l_name, "Feynman")
+        rows = storage.utils.connection.execute("SELECT COUNT(*) FROM accounts").fetchone()
+        self.assertEqual(rows, (1,))
+
+    def test_full_write(self):
+        storage = Storage(SqliteUtils, self.path)
+        storage.customers = [Customer("James", "May", "1 Downing Street")]
+        storage.globals = {"test": True}
+        storage.save()
+
+        storage = Storage(SqliteUtils, self.path)
+        storage.load()
+        self.assertEqual(storage.customers[0].l_name, "May")
+        self.assertEqual(storage.globals, {"test": True})
+
+    def test_stale_writer(self):
+        with Storage(SqliteUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+        first = Storage(SqliteUtils, self.path)
+        first.load()
+        second = Storage(SqliteUtils, self.path)
+        second.load()
+
+        first.customers[0].address = "2 Downing Street"
+        first.save()
+        second.customers[0].address = "3 Downing Street"
+        with self.assertRaises(ConcurrentModificationError):
+            second.save()
+
+        second.load()
+        second.customers[0].address = "3 Downing Street"
+        second.save()
+        first.load()
+        self.assertEqual(first.customers[0].address, "3 Downing Street")
+
+
+class TestApplicationIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check_backend(self, utils_class, name):
+        path = os.path.join(self.directory.name, name)
+        if utils_class is not SqliteUtils:
+            with open(path, "w") as file:
+                json.dump({"customers": [], "employees": [], "globals": {}}, file)
+
+        with Storage(utils_class, path) as storage:
+            for l_name in ("May", "Hammond", "Clarkson"):
+                storage.add_customer(Customer("James", l_name, "1 Downing Street",
+                                              [], [Service(10.)]))
+        # customers get ids 1, 3 and 5, their services 2, 4 and 6
+        with Storage(utils_class, path) as storage:
+            self.assertEqual(list(storage.applications), [(1, 0), (3, 0), (5, 0)])
+            bank.main.apply_for_service(storage, argparse.Namespace(customer_index=2, limit=5.))
+            storage.customers[0].services[0].approve()
+            storage.applications.discard(1, 0)
+
+        with Storage(utils_class, path) as storage:
+            self.assertEqual(list(storage.applications), [(3, 0), (5, 0), (5, 1)])
+            bank.main.remove_application(
+                storage, argparse.Namespace(customer_index=-1, service_index=0))
+            storage.remove_customer(0)
+
+        storage = Storage(utils_class, path)
+        storage.load()
+        self.assertEqual(list(storage.applications), [(3, 0), (5, 0)])
+        self.assertEqual(storage.customers[1].services[0].limit, 5.)
+
+    def test_backends(self):
+        for utils_class, name in ((FileUtils, "bank.json"), (JournalFileUtils, "bank.jnl"),
+                                  (IndexedFileUtils, "bank.idx"), (SqliteUtils, "bank.db")):
+            with self.subTest(backend=utils_class.__name__):
+                self.check_backend(utils_class, name)
+
+    def test_built_when_missing(self):
+        storage = Storage(FileUtils, os.path.join(self.directory.name, "bank.json"))
+        storage.customers = [Customer("James", "May", "1 Downing Street", [],
+                                      [Service(10., status="approved"), Service(20.)])]
+        self.assertEqual(list(storage.applications), [(storage.customers[0].id, 1)])
+
+
+class TestNameIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find(self):
+        storage = Storage(FileUtils, self.path)
+        storage.customers = [Customer("James", "May", "1 Downing Street"),
+                             Customer("Richard", "Hammond", "1 Trekking Way"),
+                             Customer("Jeremy", "Clarkson", "1 Diddly Squat Road")]
+        # customers got ids 1 to 3
+        self.assertEqual(sorted(storage.names.find("j")), [1, 3])
+        self.assertEqual(storage.names.find("JE 1 squat"), [3])
+        self.assertEqual(storage.names.find("nobody"), [])
+        self.assertEqual(storage.names.find(""), [])
+
+    def test_maintained_and_persisted(self):
+        with open(self.path, "w") as file:
+            json.dump({"customers": [], "employees": [], "globals": {}}, file)
+
+        with Storage(FileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+            self.assertEqual(storage.names.find("hammond"), [storage.customers[1].id])
+
+        with Storage(FileUtils, self.path) as storage:
+            storage.remove_customer(0)
+            storage.add_customer(Customer("Jeremy", "Clarkson", "1 Diddly Squat Road"))
+
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        self.assertEqual(sorted(storage.ids.position(customer_id)
+                                for customer_id in storage.names.find("1")), [0, 1])
+        self.assertEqual([storage.ids.position(customer_id)
+                          for customer_id in storage.names.find("ham")], [0])
+        self.assertEqual(storage.names.find("may"), [])
+        self.assertEqual(repr(storage.customers), "LazyList(2 items, 0 loaded)")
+
+
+class TestIndexFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.jnl")
+        with open(self.path, "w") as file:
+            json.dump({"customers": [], "employees": [], "globals": {}}, file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_changes_appended(self):
+        with Storage(JournalFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+            storage.names.find("may")
+        log_path = os.path.join(self.path + ".indexes", "names.log")
+        self.assertEqual(os.path.getsize(log_path), 0)
+
+        with Storage(JournalFileUtils, self.path) as storage:
+            self.assertEqual(storage._indexes, {})
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+        # the index was not read, its changes were appended to its log
+        with open(log_path) as file:
+            self.assertEqual([json.loads(line)["changes"] for line in file],
+                             [[["add", [[2, ["1", "hammond", "richard", "trekking", "way"]]]]]])
+        # the journal holds the customer and the new marks, not the terms of the index
+        with open(self.path + ".journal") as file:
+            self.assertNotIn("trekking", file.read())
+
+        storage = Storage(JournalFileUtils, self.path)
+        storage.load()
+        self.assertEqual(storage.names.find("ham"), [2])
+        self.assertEqual(storage.ids.position(2), 1)
+
+    def test_unsaved_log_ignored(self):
+        with Storage(JournalFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+            storage.names.find("may")
+        storage = Storage(JournalFileUtils, self.path)
+        storage.load()
+        # changes of a save which failed after writing the index
+        storage.index_files.append("names", storage._index_marks["names"],
+                                   [["add", [[9, ["ghost"]]]]])
+        self.assertEqual(storage.names.find("ghost"), [])
+
+    def test_compacted(self):
+        with Storage(JournalFileUtils, self.path) as storage:
+            storage.add_customer(Customer("James", "May", "1 Downing Street"))
+            storage.names.find("may")
+        with mock.patch("bank.storage.index_files.COMPACT_BYTES", 0):
+            for l_name in ("Hammond", "Clarkson", "Wilman", "Harris"):
+                with Storage(JournalFileUtils, self.path) as storage:
+                    storage.add_customer(Customer("James", l_name, "1 Downing Street"))
+        # the log outgrew the snapshot, which was written out again
+        with open(os.path.join(self.path + ".indexes", "names.json")) as file:
+            self.assertGreater(json.load(file)["seq"], 1)
+        storage = Storage(JournalFileUtils, self.path)
+        storage.load()
+        self.assertEqual(sorted(storage.names.find("james")), [1, 2, 3, 4, 5])
+        self.assertEqual(storage.names.find("harris"), [5])
+
+    def test_legacy_indexes_dropped(self):
+        with open(self.path, "w") as file:
+            json.dump({"customers": [Customer("James", "May", "1 Downing Street").to_dict()],
+                       "employees": [], "globals": {}, "names": [["stale", 1]]}, file)
+        with Storage(JournalFileUtils, self.path) as storage:
+            self.assertEqual(storage.names.find("stale"), [])
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+        with open(self.path) as file:
+            self.assertNotIn("names", json.loads(file.readline()))
+
+
+class TestIds(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+        with open(self.path, "w") as file:
+            json.dump({"customers": [Customer("James", "May", "1 Downing Street",
+                                              [Account("checking", 0.)]).to_dict()],
+                       "employees": [], "globals": {}}, file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_assigned_on_load(self):
+        with Storage(FileUtils, self.path) as storage:
+            self.assertEqual(storage.customers[0].id, 1)
+        with open(self.path, "r") as file:
+            data = json.load(file)
+        self.assertEqual(data["customers"][0]["accounts"][0]["id"], 2)
+        self.assertEqual(data["next_id"], 3)
+
+    def test_never_reused(self):
+        with Storage(FileUtils, self.path) as storage:
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way"))
+            storage.remove_customer(1)
+            storage.add_customer(Customer("Jeremy", "Clarkson", "1 Diddly Squat Road",
+                                          [Account("savings", 0.)]))
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        self.assertEqual([cust.id for cust in storage.customers], [1, 4])
+        self.assertEqual(storage.customers[1].accounts[0].id, 5)
+
+    def test_references(self):
+        with Storage(FileUtils, self.path) as storage:
+            storage.add_customer(Customer("Richard", "Hammond", "1 Trekking Way",
+                                          [Account("checking", 0.), Account("savings", 0.)]))
+            bank.main.deposit(storage, argparse.Namespace(
+                customer_index="@3", account_index="@5", amount=5.))
+            bank.main.remove_customer(storage, argparse.Namespace(customer_index=0))
+            self.assertEqual(storage.customers[0].accounts[1].balance, 5.)
+        with Storage(FileUtils, self.path) as storage:
+            self.assertEqual(storage.ids.position(3), 0)
+            self.assertIsNone(storage.ids.position(1))
+            with self.assertRaises(SystemExit):
+                bank.main.list_accounts(storage, argparse.Namespace(customer_index="@1"))
+
+    def test_lookups_do_not_save(self):
+        with Storage(FileUtils, self.path):
+            pass
+        with open(self.path + ".lock") as file:
+            generation = file.read()
+        for func, args in ((bank.main.list_accounts, argparse.Namespace(customer_index=0)),
+                           (bank.main.find_customers, argparse.Namespace(query="may")),
+                           (bank.main.list_applicaitons, argparse.Namespace())):
+            with contextlib.redirect_stdout(io.StringIO()), Storage(FileUtils, self.path) as storage:
+                func(storage, args)
+        with open(self.path + ".lock") as file:
+            self.assertEqual(file.read(), generation)
+
+    def test_positions_after_removal(self):
+        index = IdIndex([10, 20, 30, 40])
+        index.remove(20)
+        index.add([50])
+        index.remove(40)
+        self.assertEqual([index.position(customer_id) for customer_id in (10, 20, 30, 40, 50)],
+                         [0, None, 1, None, 2])
+        self.assertEqual(index.to_list(), [10, 30, 50])
+
+        rng = random.Random(1)
+        ids = list(range(100))
+        index = IdIndex(ids)
+        for customer_id in rng.sample(ids, 60):
+            index.remove(customer_id)
+            ids.remove(customer_id)
+            self.assertEqual([index.position(customer_id) for customer_id in ids],
+                             list(range(len(ids))))
+        self.assertEqual(index.to_list(), ids)
+
+
+class TestBatch(unittest.TestCase):
+    def test_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "batch.jsonl")
+            with open(path, "w") as file:
+                file.write('{"command": "add_customer", "first_name": "James", '
+                           '"last_name": "May", "address": "1 Downing Street"}\n')
+                file.write('{"command": "add_account", "customer_index": 0, "type": "checking"}\n')
+                file.write("# comment\n\n")
+                file.write('{"command": "deposit", "customer_index": 0, "account_index": 0, "amount": 5}\n')
+                file.write('{"command": "withdraw", "customer_index": 0, "account_index": 0, "amount": 9}\n')
+                file.write('{"command": "deposit", "customer_index": 0, "amount": 1}\n')
+                file.write('{"command": "unknown"}\n')
+
+            storage = Storage(FileUtils, os.path.join(directory, "bank.json"))
+            with self.assertLogs(level="ERROR") as logs:
+                run_batch(storage, argparse.Namespace(source=path, save_every=2, parser=None))
+            self.assertEqual(len(logs.records), 3)
+            self.assertIn("missing argument account_index", logs.output[1])
+            self.assertEqual(storage.customers[0].accounts[0].balance, 500)
+
+            with open(os.path.join(directory, "bank.json")) as file:
+                self.assertEqual(json.load(file)["customers"][0]["accounts"],
+                                 [{"type": "checking", "balance": 0, "id": 2}])
+
+    def test_save_interval(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "batch.jsonl")
+            with open(path, "w") as file:
+                file.write('{"command": "add_customer", "first_name": "James", '
+                           '"last_name": "May", "address": "1 Downing Street"}\n' * 3)
+
+            storage = Storage(FileUtils, os.path.join(directory, "bank.json"))
+            saves = []
+            storage.save = lambda: saves.append(len(storage.customers))
+            run_batch(storage, argparse.Namespace(source=path, save_every=0,
+                                                  save_interval=1e-9, parser=None))
+            self.assertEqual(saves, [1, 2, 3])
+
+    def test_save_interval_while_idle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "batch.fifo")
+            os.mkfifo(path)
+            line = ('{"command": "add_customer", "first_name": "James", '
+                    '"last_name": "May", "address": "1 Downing Street"}\n')
+            storage = Storage(FileUtils, os.path.join(directory, "bank.json"))
+            saved = threading.Event()
+            storage.save = saved.set
+            waited = []
+
+            def write():
+                with open(path, "w") as fifo:
+                    fifo.write(line)
+                    fifo.flush()
+                    # the next line only comes once the first was saved
+                    waited.append(saved.wait(5))
+                    fifo.write(line)
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            run_batch(storage, argparse.Namespace(source=path, save_every=0,
+                                                  save_interval=0.01, parser=None))
+            writer.join()
+            self.assertEqual(waited, [True])
+            self.assertEqual(len(storage.customers), 2)
+
+
+    def test_only_transactional_commands(self):
+        parser = argparse.ArgumentParser()
+        subparsers = parser.add_subparsers()
+        subparsers.add_parser("list").set_defaults(func=bank.main.list_customers)
+        subparsers.add_parser("batch").set_defaults(func=run_batch, source="-")
+        subparsers.add_parser("serve").set_defaults(func=serve, address="bank.sock")
+        subparsers.add_parser("eod").set_defaults(func=end_of_day)
+        read, write = os.pipe()
+        with os.fdopen(write, "w") as pipe:
+            pipe.write("batch\nserve\neod\nlist\n")
+        with tempfile.TemporaryDirectory() as directory, os.fdopen(read) as stdin:
+            storage = Storage(FileUtils, os.path.join(directory, "bank.json"))
+            with mock.patch("sys.stdin", stdin), self.assertLogs(level="ERROR") as logs, \
+                    contextlib.redirect_stdout(io.StringIO()) as output:
+                run_batch(storage, argparse.Namespace(source="-", save_every=0, parser=parser))
+            self.assertEqual(len(logs.records), 3)
+            self.assertIn("serve can not be run in a batch", logs.output[1])
+            self.assertIn("Applied 1 operations, 3 failed", output.getvalue())
+            # stdin belongs to the caller
+            self.assertFalse(stdin.closed)
+
+
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+        FileUtils(self.path).write_dict({"customers": [], "employees": [], "globals": {}})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _import(self, name, content, expected_errors):
+        source = os.path.join(self.directory.name, name)
+        with open(source, "w") as file:
+            file.write(content)
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        storage.add_customer(Customer("Richard", "Hammond", "2 Downing Street"))
+        storage.names  # indexes which exist are updated along with the import
+        with self.assertLogs(level="ERROR") as logs:
+            import_customers(storage, argparse.Namespace(source=source, format=None))
+        self.assertEqual(len(logs.records), expected_errors)
+        return storage
+
+    def test_csv(self):
+        storage = self._import("customers.csv", (
+            "record,first_name,last_name,address,type,balance,limit,status\n"
+            "customer,James,May,1 Downing Street,,,,\n"
+            "account,,,,checking,10.50,,\n"
+            "account,,,,savings,-1,,\n"
+            "service,,,,,-5,100,approved\n"
+            "customer,,May,3 Downing Street,,,,\n"
+            "account,,,,checking,1,,\n"
+            "customer,Jürgen,Klopp,4 Anfield Road,,,,\n"
+            "service,,,,,,50,\n"
+            "service,,,,,,50,pending\n"), 3)
+        self.assertEqual([customer.f_name for customer in storage.customers],
+                         ["Richard", "James", "Jürgen"])
+        james, juergen = storage.customers[1], storage.customers[2]
+        self.assertEqual([account.balance for account in james.accounts], [1050])
+        self.assertEqual(james.total_balance, 550)
+        self.assertEqual(james.total_limit, 10000)
+        self.assertEqual(list(storage.applications), [(juergen.id, 0)])
+        self.assertEqual(storage.names.find("klo"), [juergen.id])
+        self.assertEqual(storage.ids.position(juergen.id), 2)
+
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        self.assertEqual(storage.customers[2].to_dict(), juergen.to_dict())
+        self.assertEqual(storage.names.find("may"), [james.id])
+
+    def test_json_lines(self):
+        storage = self._import("customers.jsonl", (
+            '{"record": "customer", "first_name": "James", "last_name": "May", "address": "1 Downing Street"}\n'
+            '{"record": "account", "type": "checking", "balance": 10.5}\n'
+            '{"record": "account", "type": "checking", "balance": 0.001}\n'
+            '{"record": "account", "type": "checking"\n'
+            '["customer"]\n'), 3)
+        self.assertEqual(len(storage.customers), 2)
+        self.assertEqual(storage.customers[1].accounts[0].balance, 1050)
+
+    def test_status_as_service_takes_it(self):
+        storage = self._import("customers.jsonl", (
+            '{"record": "customer", "first_name": "James", "last_name": "May", "address": "1 Downing Street"}\n'
+            '{"record": "service", "limit": 50, "status": "pending"}\n'
+            '{"record": "service", "limit": 50, "status": "approved"}\n'
+            '{"record": "service", "limit": 50}\n'
+            '{"record": "service", "limit": 50, "status": 1}\n'), 1)
+        expected = [Service(5000, status=status).status
+                    for status in ("pending", "approved", "application")]
+        with self.assertRaises(TypeError):
+            Service(5000, status=1)
+        self.assertEqual([service.status for service in storage.customers[1].services], expected)
+
+        # the store is loaded with the same statuses
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        self.assertEqual([service.status for service in storage.customers[1].services], expected)
+        self.assertEqual(storage.customers[1].total_limit, 5000)
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(FileUtils, os.path.join(self.directory.name, "bank.json"))
+        self.storage.customers = [
+            Customer("James", "May", "1 Downing Street", [Account("checking", 1050)],
+                     [Service(10000, Account("service", -500), "approved")]),
+            Customer("Jürgen", "Klopp", "4 Anfield Road", [], [Service(5000)])]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _export(self, name, **options):
+        args = dict(output=os.path.join(self.directory.name, name), format=None,
+                    records="customers", columns=None, min_balance=None, max_balance=None,
+                    status=None)
+        args.update(options)
+        export_customers(self.storage, argparse.Namespace(**args))
+        with open(args["output"], newline="") as file:
+            return file.read()
+
+    def test_csv(self):
+        self.assertEqual(self._export("customers.csv").splitlines(), [
+            "index,id,first_name,last_name,address,accounts,services,total_balance,total_limit",
+            "0,1,James,May,1 Downing Street,1,1,5.50,100.00",
+            "1,4,Jürgen,Klopp,4 Anfield Road,0,1,0.00,0.00"])
+        self.assertEqual(self._export("services.csv", records="services", status="application",
+                                      columns="customer_id,limit").splitlines(),
+                         ["customer_id,limit", "4,50.00"])
+
+    def test_json_lines(self):
+        lines = self._export("accounts.jsonl", records="accounts", min_balance=1000)
+        self.assertEqual([json.loads(line) for line in lines.splitlines()], [
+            {"customer_index": 0, "customer_id": 1, "index": 0, "id": 2, "type": "checking",
+             "balance": "10.50"}])
+        lines = self._export("customers.jsonl", max_balance=0, columns="first_name")
+        self.assertEqual(lines, '{"first_name": "J\\u00fcrgen"}\n')
+
+    def test_unknown_column(self):
+        with self.assertRaises(SystemExit), self.assertLogs(level="ERROR"):
+            self._export("customers.csv", columns="first_name,balance")
+
+
+class TestEndOfDay(unittest.TestCase):
+    RULES = {"accounts": {"savings": {"interest": "0.01"}},
+             "services": {"approved": {"interest": 0.001, "fee": 1.5}}}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+        storage = Storage(FileUtils, self.path)
+        storage.customers = [
+            Customer("James", "May", "1 Downing Street",
+                     [Account("savings", 1050), Account("checking", 1000)],
+                     [Service(100000, Account("service", -50000), "approved"),
+                      Service(5000, Account("service", -100))]),
+            Customer("Richard", "Hammond", "2 Downing Street", [Account("savings", 250)]),
+            Customer("Jürgen", "Klopp", "4 Anfield Road", [Account("savings", 350)])]
+        storage.globals = {"eod_rules": self.RULES}
+        storage.save()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_accrue(self):
+        self.assertEqual(accrue(250, (1, 100)), 2)
+        self.assertEqual(accrue(350, (1, 100)), 4)
+        self.assertEqual(accrue(-351, (1, 100)), -4)
+        self.assertEqual(accrue(1000, (0, 1)), 0)
+
+    def test_end_of_day(self):
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        # built and changed, so accrued through its objects
+        storage.customers[1].accounts[0].deposit(50)
+        end_of_day(storage, argparse.Namespace(rules=None, keep_rules=False, workers=2))
+
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        james, richard, juergen = storage.customers
+        self.assertEqual([account.balance for account in james.accounts], [1060, 1000])
+        self.assertEqual([service.balance for service in james.services], [-50200, -100])
+        self.assertEqual(james.total_balance, 1060 + 1000 - 50200 - 100)
+        self.assertEqual(richard.accounts[0].balance, 303)
+        self.assertEqual(juergen.accounts[0].balance, 354)
+
+        _, entries, _ = storage.ledger.statement(james.services[0].id)
+        self.assertEqual([(entry["kind"], entry["amount"]) for entry in entries],
+                         [("interest", -50), ("fee", -150)])
+        _, entries, _ = storage.ledger.statement(richard.accounts[0].id)
+        self.assertEqual([entry["kind"] for entry in entries], ["deposit", "interest"])
+
+    def test_rules(self):
+        rules = os.path.join(self.directory.name, "rules.json")
+        with open(rules, "w") as file:
+            json.dump({"accounts": {"checking": {"interest": 0.5}}}, file)
+        storage = Storage(FileUtils, self.path)
+        storage.load()
+        storage.globals = {}
+        end_of_day(storage, argparse.Namespace(rules=rules, keep_rules=True, workers=1))
+        self.assertEqual(storage.customers[0].accounts[1].balance, 1500)
+        self.assertEqual(storage.customers[0].accounts[0].balance, 1050)
+        self.assertIn("checking", storage.globals["eod_rules"]["accounts"])
+
+        with open(rules, "w") as file:
+            json.dump({"accounts": {"checking": {"interest": -1}}}, file)
+        with self.assertRaises(SystemExit), self.assertLogs(level="ERROR"):
+            end_of_day(storage, argparse.Namespace(rules=rules, keep_rules=False, workers=1))
+
+
+class TestServer(unittest.TestCase):
+    def test_execute(self):
+        storage = Storage(FileUtils, "unused.json")
+        storage.customers = [Customer("James", "May", "1 Downing Street", [Account("checking", 5.)])]
+        response = execute(storage, {"command": "list_customers"})
+        self.assertTrue(response["ok"])
+        self.assertIn("James, May", response["output"])
+
+        response = execute(storage, {"command": "withdraw", "customer_index": 0,
+                                     "account_index": 3, "amount": 1.})
+        self.assertFalse(response["ok"])
+        self.assertEqual(response["error"], "exited with status 1")
+        self.assertEqual(len(response["log"]), 1)
+
+        response = execute(storage, {"command": "serve"})
+        self.assertFalse(response["ok"])
+
+        response = execute(storage, {"command": "deposit", "customer_index": 0, "amount": 1})
+        self.assertFalse(response["ok"])
+        self.assertEqual(response["error"],
+                         "ValueError: Command deposit is missing argument account_index")
+
+    def test_malformed_request(self):
+        storage = Storage(FileUtils, "unused.json")
+        storage.customers = [Customer("James", "May", "1 Downing Street", [Account("checking", 5)])]
+        storage.save = lambda: None
+
+        async def run(path):
+            server = BankServer(storage)
+            async with await asyncio.start_unix_server(server._serve_client, path=path):
+                reader, writer = await asyncio.open_unix_connection(path)
+                responses = []
+                for request in ({"command": "deposit", "amount": 1},
+                                {"command": "deposit", "customer_index": 0, "account_index": 0,
+                                 "amount": 1}):
+                    writer.write(json.dumps(request).encode() + b"\n")
+                    responses.append(json.loads(await reader.readline()))
+                writer.close()
+                return responses
+        with tempfile.TemporaryDirectory() as directory:
+            responses = asyncio.run(run(os.path.join(directory, "bank.sock")))
+        # the connection outlived the malformed request
+        self.assertEqual([response["ok"] for response in responses], [False, True])
+        self.assertEqual(storage.customers[0].accounts[0].balance, 105)
+
+    def test_group_commit(self):
+        saves = []
+        storage = Storage(FileUtils, "unused.json")
+        storage.customers = [Customer("James", "May", "1 Downing Street", [Account("checking", 5.)])]
+        storage.save = lambda: saves.append(storage.customers[0].accounts[0].balance)
+        request = {"command": "deposit", "customer_index": 0, "account_index": 0, "amount": 0.01}
+
+        async def run():
+            server = BankServer(storage, save_every=3, save_interval=0.01)
+            for _ in range(4):
+                server.handle_request(request)
+            self.assertEqual(saves, [8])
+            await asyncio.sleep(0.05)
+            self.assertEqual(saves, [8, 9])
+        asyncio.run(run())
+
+    def test_durable(self):
+        saves = []
+        storage = Storage(FileUtils, "unused.json")
+        storage.customers = [Customer("James", "May", "1 Downing Street", [Account("checking", 5)])]
+        storage.save = lambda: saves.append(storage.customers[0].accounts[0].balance)
+        request = {"command": "deposit", "customer_index": 0, "account_index": 0, "amount": 1}
+
+        async def run():
+            server = BankServer(storage, save_every=1000, save_interval=0.01, durable=True)
+            responses = await asyncio.gather(*(server._respond(request) for _ in range(3)))
+            # all three were acknowledged after the one save which covered them
+            self.assertEqual(saves, [305])
+            self.assertTrue(all(response["ok"] for response in responses))
+        asyncio.run(run())
+
+    def test_concurrent_save(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.json")
+            storage = Storage(FileUtils, path)
+            storage.customers = [Customer("James", "May", "1 Downing Street",
+                                          [Account("checking", 5)])]
+            storage.save()
+            request = {"command": "deposit", "customer_index": 0, "account_index": 0, "amount": 1}
+
+            async def run():
+                server = BankServer(storage, save_interval=0.01, durable=True)
+                with Storage(FileUtils, path) as other:
+                    other.customers[0].accounts[0].deposit(1000)
+                with self.assertLogs(level="ERROR"):
+                    failed = await server._respond(request)
+                # the server reloaded, so the next request is saved on top of the other one
+                return failed, await server._respond(request)
+            failed, response = asyncio.run(run())
+            self.assertFalse(failed["ok"])
+            self.assertIn("changes were not saved", failed["error"])
+            self.assertTrue(response["ok"])
+            storage = Storage(FileUtils, path)
+            storage.load()
+            self.assertEqual(storage.customers[0].accounts[0].balance, 1105)
+
+    def test_reload_when_idle(self):
+        for utils, name in ((IndexedFileUtils, "bank.idx"), (SqliteUtils, "bank.db")):
+            with self.subTest(utils=utils), tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, name)
+                if utils is IndexedFileUtils:
+                    open(path, "w").close()
+                with Storage(utils, path) as storage:
+                    for first_name in ("James", "Richard", "Jeremy"):
+                        storage.add_customer(Customer(first_name, "May", "1 Downing Street"))
+                storage = Storage(utils, path)
+                storage.load()
+                with Storage(utils, path) as other:
+                    other.customers[2].f_name = "Jane"
+
+                async def run():
+                    server = BankServer(storage, save_interval=0.01)
+                    with self.assertLogs(level="INFO"):
+                        server.check()
+                    server._check_timer.cancel()
+                    return execute(server.storage, {"command": "list_customers"})
+                response = asyncio.run(run())
+                self.assertTrue(response["ok"])
+                self.assertIn("Jane, May", response["output"])
+
+    def test_send_command(self):
+        storage = Storage(FileUtils, "unused.json")
+        storage.customers = [Customer("James", "May", "1 Downing Street", [Account("checking", 5)])]
+        storage.save = lambda: None
+        # as parsed from the command line, the amount is in cents
+        args = argparse.Namespace(func=bank.main.deposit, customer_index=0, account_index=0,
+                                  amount=parse_amount("10.05"), file="unused.json",
+                                  backend="json", connect=None)
+
+        async def run(path):
+            server = BankServer(storage)
+            async with await asyncio.start_unix_server(server._serve_client, path=path):
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, send_command, path, args)
+        with tempfile.TemporaryDirectory() as directory:
+            response = asyncio.run(run(os.path.join(directory, "bank.sock")))
+        self.assertTrue(response["ok"])
+        self.assertEqual(storage.customers[0].accounts[0].balance, 1010)
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("localhost:8000"), ("localhost", 8000))
+        self.assertEqual(parse_address("/tmp/bank.sock"), ("/tmp/bank.sock", None))
+
+
+class TestLocking(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.json")
+        storage = Storage(FileUtils, self.path)
+        storage.customers = [Customer("James", "May", "1 Downing Street", [Account("checking", 0.)])]
+        storage.save()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_stale_writer(self):
+        first = Storage(FileUtils, self.path)
+        first.load()
+        second = Storage(FileUtils, self.path)
+        second.load()
+
+        first.customers[0].accounts[0].deposit(10.)
+        first.save()
+        second.customers[0].accounts[0].deposit(5.)
+        with self.assertRaises(ConcurrentModificationError):
+            second.save()
+
+        second.load()
+        second.customers[0].accounts[0].deposit(5.)
+        second.save()
+        first.load()
+        self.assertEqual(first.customers[0].accounts[0].balance, 15.)
+
+    def test_generation(self):
+        with open(self.path + ".lock") as file:
+            self.assertEqual(file.read(), "1")
+        with Storage(FileUtils, self.path):
+            pass
+        with open(self.path + ".lock") as file:
+            self.assertEqual(file.read(), "1")
+
+
+class TestReportTotals(unittest.TestCase):
+    def test_totals(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.json")
+            storage = Storage(FileUtils, path)
+            storage.customers = [
+                Customer("Alex", "Trebek", "1 Jeopardy! Ave", [Account("checking", 1000)],
+                         [Service(10000, Account("service", -4000), "approved"), Service(5000)]),
+                Customer("Pat", "Sajak", "1 Wheel Way"),
+                Customer("Steve", "Harvey", "1 Family Affiars Highway",
+                         [Account("checking", 500), Account("savings", 700)])
+            ]
+            storage.save()
+
+            storage = Storage(FileUtils, path)
+            storage.load()
+            storage.customers[2].accounts[0].deposit(100)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                bank.main.report_totals(storage, argparse.Namespace())
+            self.assertEqual(repr(storage.customers), "LazyList(3 items, 1 loaded)")
+            self.assertEqual(output.getvalue().splitlines(), [
+                "customers: 3", "accounts: 3", "services: 2", "account_balance: 23.00",
+                "deposits: 23.00", "service_balance: -40.00", "approved_limit: 100.00"])
+
+
+class TestBalanceColumns(unittest.TestCase):
+    def assertMatches(self, storage):
+        columns = storage.balances
+        self.assertEqual(list(columns.total_balances()),
+                         [customer.total_balance for customer in storage.customers])
+        self.assertEqual(list(columns.total_limits()),
+                         [customer.total_limit for customer in storage.customers])
+        self.assertEqual(columns.bank_totals(),
+                         BalanceColumns.build(list(storage.customers)).bank_totals())
+
+    def test_kept_up_to_date(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.json")
+            storage = Storage(FileUtils, path)
+            storage.customers = [
+                Customer("Alex", "Trebek", "1 Jeopardy! Ave", [Account("checking", 1000)],
+                         [Service(10000, Account("service", -4000), "approved"), Service(5000)]),
+                Customer("Pat", "Sajak", "1 Wheel Way"),
+                Customer("Steve", "Harvey", "1 Family Affiars Highway",
+                         [Account("checking", 500), Account("savings", 700)])
+            ]
+            storage.save()
+
+            storage = Storage(FileUtils, path)
+            storage.load()
+            columns = storage.balances
+            self.assertEqual(repr(storage.customers), "LazyList(3 items, 0 loaded)")
+            self.assertEqual(list(columns.total_balances()), [-3000, 0, 1200])
+            self.assertEqual(list(columns.total_limits()), [10000, 0, 0])
+            record = dict(storage.customers.record(1), accounts=[{"type": "checking", "balance": 7}])
+            storage.update_records([(1, record, {})])
+            self.assertEqual(list(storage.balances.total_balances()), [-3000, 7, 1200])
+
+            storage.customers[2].accounts[0].deposit(100)
+            storage.customers[0].services[1].approve()
+            self.assertIs(storage.balances, columns)
+            self.assertMatches(storage)
+
+            storage.add_customer(Customer("Drew", "Carey", "1 Price Street", [Account("checking", 300)]))
+            storage.save()
+            # changed after the save as well as before
+            storage.customers[3].accounts[0].withdrawl(100)
+            storage.customers[2].accounts.append(Account("savings", 50))
+            storage.save()
+            self.assertMatches(storage)
+
+            storage.remove_customer(1)
+            self.assertMatches(storage)
+            self.assertEqual(storage.balances.bank_totals(), {
+                "customers": 3, "accounts": 5, "services": 2, "account_balance": 2550,
+                "deposits": 2550, "service_balance": -4000, "approved_limit": 15000})
+
+            storage.customers.reverse()
+            self.assertIsNot(storage.balances, columns)
+            self.assertMatches(storage)
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_generate(self):
+        records = list(generate_records(50, accounts=3, services=0.5, skew=1., seed=3))
+        self.assertEqual(records, list(generate_records(50, accounts=3, services=0.5, skew=1.,
+                                                        seed=3)))
+        self.assertNotEqual(records, list(generate_records(50, seed=4)))
+        customers = [Customer.from_dict(record) for record in records]
+        self.assertEqual([customer.to_dict() for customer in customers], records)
+
+        data = generate_data(50)
+        ids = [employee["id"] for employee in data["employees"]]
+        for record in data["customers"]:
+            ids.append(record["id"])
+            ids.extend(account["id"] for account in record["accounts"])
+            ids.extend(service["id"] for service in record["services"])
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertLess(max(ids), data["next_id"])
+
+    def test_every_backend(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for backend in BACKENDS:
+            with self.subTest(backend=backend), tempfile.TemporaryDirectory() as directory:
+                output = os.path.join(directory, "results.json")
+                subprocess.run([sys.executable, "-m", "benchmarks.run", "--sizes", "20",
+                                "-b", backend, "--skip", "report_codecs",
+                                "--directory", directory, "--output", output],
+                               cwd=root, check=True, capture_output=True)
+                with open(output) as file:
+                    results = json.load(file)["results"]["20"]
+                self.assertEqual(set(results["commands"]),
+                                 {name for name, _ in COMMANDS} - {"report_codecs"})
+
+    def test_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as directory:
+            options = argparse.Namespace(backend="json", accounts=2., services=0.3, skew=0.,
+                                         seed=0, skip=["report_codecs"], directory=directory)
+            results = run_size(20, options)
+        self.assertEqual(set(results["commands"]),
+                         {name for name, _ in COMMANDS} - {"report_codecs"})
+        self.assertGreater(results["max_rss_bytes"], 0)
+        self.assertGreater(results["load_peak_bytes"], 0)
+
+        previous = {"results": {"20": dict(results, load=results["load"] / 2)}}
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(compare(previous, {"results": {"20": results}}), ["20:load"])